@@ -8,9 +8,17 @@ import json
 import time
 import logging
 import requests
-from typing import Optional, Dict, Any, List, Union
+from typing import Optional, Dict, Any, List, Union, Callable
 
 from efficode_core import EfficodePacket, create_ack_packet, create_data_packet, create_error_packet
+from packet_identity import SeenPacketCache
+from api_client import ApiClient, get_default_client
+from model_router import ModelRouter, get_default_router
+from efficode_workers import compress_packet
+from reasoning import ReasoningStore, ThinkStreamFilter, split_reasoning, reasoning_token_count
+from auth_sessions import SessionTable, GROUP_PARAM, did_for, is_valid_did, get_default_session_table
+from cancellation import Cancelled
+from circuit_breaker import CircuitOpenError
 
 # 配置日志
 logging.basicConfig(
@@ -177,25 +185,75 @@ AGENT_ROLES = {
     }
 }
 
+# 模型配置：回答者需要长输出，沿用推理模型和较大的输出上限
+DEFAULT_MODEL_PROFILE = {
+    "name": "answerer",
+    "model": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+    "max_tokens": 2000,  # 增加令牌上限，确保回答完整
+    "temperature": 0.8,  # 提高温度以增加创造性
+    "timeout": 60  # 增加超时时间，确保大型响应不会被截断
+}
+
+# 提问者只需输出一个简短的问题：限制输出长度，并在非推理小模型和推理模型之间按实测代价选择
+QUESTIONER_MODEL_PROFILE = {
+    "name": "questioner",
+    "model": "Qwen/Qwen2.5-7B-Instruct",
+    "candidates": ["Qwen/Qwen2.5-7B-Instruct", "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"],
+    "max_tokens": 300,
+    "temperature": 0.9,
+    "timeout": 30
+}
+
+# 角色 -> 模型配置，未列出的角色使用DEFAULT_MODEL_PROFILE
+MODEL_PROFILES = {
+    "智谋": QUESTIONER_MODEL_PROFILE
+}
+
+def get_model_profile(name: str) -> Dict[str, Any]:
+    """
+    获取角色的模型配置
+
+    Args:
+        name: 智能体名称
+
+    Returns:
+        模型配置
+    """
+    if name in MODEL_PROFILES:
+        return MODEL_PROFILES[name]
+    # 自定义的提问者角色同样使用短输出配置
+    if "提问" in AGENT_ROLES.get(name, {}).get("description", ""):
+        return QUESTIONER_MODEL_PROFILE
+    return DEFAULT_MODEL_PROFILE
+
 class AIAgent:
     """AI智能体类，具有特定身份和能力"""
     
-    def __init__(self, name: str, api_key: str):
+    def __init__(self, name: str, api_key: Optional[str] = None, client: Optional[ApiClient] = None,
+                 router: Optional[ModelRouter] = None, sessions: Optional[SessionTable] = None):
         """
         初始化AI智能体
         
         Args:
             name: 智能体名称，对应AGENT_ROLES中的某个角色
-            api_key: API密钥
+            api_key: API密钥，环境变量未配置提供方池时使用
+            client: API客户端，默认使用进程级共享的客户端（所有智能体共用同一个提供方池）
+            router: 模型路由器，默认使用进程级共享的路由器
+            sessions: 身份验证会话表，默认使用进程级共享的会话表
         """
         self.name = name
         self.did = f"did:efficode:{name}"
-        self.api_key = api_key
-        self.api_base = "https://api.siliconflow.cn/v1"
-        self.model = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"
-        self.authenticated = False
+        self.client = client or get_default_client(api_key)
+        self.router = router or get_default_router()
+        self.model_profile = get_model_profile(name)
+        self.model = self.model_profile["model"]  # 最近一次调用使用的模型
+        self.usage_stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0,
+                            "reasoning_tokens": 0}  # reasoning_tokens: 从回复中剥离、未转发给对端的推理令牌
+        self.reasoning_store = ReasoningStore()  # 数据包ID -> 被剥离的推理内容
+        self.sessions = sessions or get_default_session_table()
         self.peer = None  # 对话伙伴
         self.context = []  # 对话上下文
+        self.seen_packets = SeenPacketCache()  # 已处理数据包ID -> 响应，用于重传去重
         
         # 设置角色
         if name in AGENT_ROLES:
@@ -215,14 +273,23 @@ class AIAgent:
             }
             logger.info(f"AI智能体 {name} (通用类型) 已初始化")
     
-    def send_message(self, message: Union[str, EfficodePacket]) -> Optional[str]:
-        """调用API发送消息并获取响应"""
-        try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+    def send_message(self, message: Union[str, EfficodePacket], on_chunk: Optional[Callable[[str], None]] = None,
+                     commit_context: bool = True, usage: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        调用API发送消息并获取响应
+        
+        Args:
+            message: 文本或Efficode数据包
+            on_chunk: 流式回调，提供时以SSE方式调用API，每收到一段回复内容回调一次
+            commit_context: 是否把本次问答写入对话上下文；推测性的草稿调用应传False，
+                            被采用后再调用commit_exchange()
+            usage: 如提供，写入本次调用的令牌用量
             
+        Returns:
+            加密的Efficode格式响应
+        """
+        selection: Optional[Dict[str, Any]] = None
+        try:
             # 准备消息内容 - 从Efficode格式中提取纯文本
             pure_content = ""
             original_format = ""
@@ -233,8 +300,8 @@ class AIAgent:
                 logger.info(f"原始Efficode消息: {original_format}")
                 
                 # 先检查是否需要解压内容
-                if "compressed" in message.params and message.params["compressed"] == "true":
-                    message = message.decompress_content()
+                if message.is_compressed():
+                    message = message.decompress_if_needed()
                     logger.info(f"已解压Efficode消息: {message.to_string()}")
                 
                 # 从数据包中提取主要内容
@@ -275,34 +342,52 @@ class AIAgent:
                 messages.extend(self.context[-5:])  # 只保留最近5条消息作为上下文
             messages.append({"role": "user", "content": pure_content})
             
+            # 按角色的模型配置选择本次调用的模型和参数
+            selection = self.router.select(self.model_profile)
+            self.model = selection["model"]
+            streaming = on_chunk is not None
             data = {
-                "model": self.model,
+                "model": selection["model"],
                 "messages": messages,
-                "stream": False,
-                "temperature": 0.8,  # 提高温度以增加创造性
-                "max_tokens": 2000  # 增加令牌上限，确保回答完整
+                "stream": streaming,
+                "temperature": selection["temperature"],
+                "max_tokens": selection["max_tokens"]
             }
+            if streaming:
+                data["stream_options"] = {"include_usage": True}
             
-            logger.info(f"正在调用API...")
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=60  # 增加超时时间，确保大型响应不会被截断
-            )
+            logger.info(f"正在调用API... (模型: {selection['model']}{'，流式' if streaming else ''})")
+            started = time.monotonic()
+            # 流式回调只转发回答，内联的推理块被过滤；相同的并发请求由客户端合并为一次上游调用
+            stream_filter = ThinkStreamFilter(on_chunk) if streaming else None
+            response = self.client.complete(data, timeout=selection["timeout"], on_chunk=stream_filter)
+            if stream_filter is not None:
+                stream_filter.flush()
             
             if response.status_code == 200:
                 response_json = response.json()
-                api_content = response_json["choices"][0]["message"]["content"]
-                logger.info(f"API响应成功，原始内容长度: {len(api_content)}")
+                response_message = response_json["choices"][0]["message"]
+                raw_content = response_message.get("content") or ""
+                if response.coalesced:
+                    # 与其他请求合并，本次没有产生上游调用和令牌消耗
+                    logger.info("与进行中的相同请求合并，共享其结果")
+                else:
+                    self._record_usage(selection, started, response_json.get("usage"))
+                    if usage is not None and response_json.get("usage"):
+                        usage.update(response_json["usage"])
+                logger.info(f"API响应成功，原始内容长度: {len(raw_content)}")
                 
-                # 更新上下文
-                self.context.append({"role": "user", "content": pure_content})
-                self.context.append({"role": "assistant", "content": api_content})
+                # 推理过程不进入上下文和数据包，只转发回答
+                api_content, reasoning = split_reasoning(raw_content, response_message.get("reasoning_content"))
+                reasoning_tokens = reasoning_token_count(response_json.get("usage"), reasoning, api_content)
+                if reasoning and not api_content:
+                    # 回答在推理中途被max_tokens截断，只能转发推理
+                    logger.warning("回复只有推理内容，没有回答，转发推理内容")
+                    api_content, reasoning, reasoning_tokens = reasoning, "", 0
                 
-                # 保持上下文在合理大小
-                if len(self.context) > 10:
-                    self.context = self.context[-10:]
+                # 更新上下文
+                if commit_context:
+                    self.commit_exchange(pure_content, api_content)
                     
                 # 将普通文本响应转换为Efficode格式
                 efficode_response = ""
@@ -317,17 +402,27 @@ class AIAgent:
                 
                 logger.info(f"转换为Efficode格式: {efficode_response}")
                 
-                # 创建Efficode数据包
+                # 创建Efficode数据包，附带唯一ID以便接收方去重
                 packet = EfficodePacket.from_string(efficode_response, self.name)
+                packet.add_metadata()
+                if reasoning:
+                    self.reasoning_store.add(packet.packet_id, {
+                        "model": selection["model"],
+                        "reasoning": reasoning,
+                        "tokens": reasoning_tokens
+                    })
+                    self.usage_stats["reasoning_tokens"] += reasoning_tokens
+                    logger.info(f"已剥离推理内容 {len(reasoning)} 字符（约 {reasoning_tokens} 令牌）")
                 
                 # 加密内容并转换回字符串
-                encrypted_packet = packet.compress_content()
+                encrypted_packet = compress_packet(packet)
                 final_response = encrypted_packet.to_string()
                 
                 logger.info(f"最终加密的Efficode响应: {final_response}")
                 
                 return final_response
             else:
+                self.router.record_failure(selection)
                 logger.error(f"API调用失败: 状态码 {response.status_code}")
                 logger.error(f"错误详情: {response.text}")
                 # 尝试解析错误响应
@@ -342,11 +437,18 @@ class AIAgent:
                 error_packet = create_error_packet(f"API调用失败: {response.status_code}", self.name)
                 return error_packet.compress_content().to_string()
                 
+        except (Cancelled, CircuitOpenError):
+            # 取消、截止时间和熔断由对话管理器处理（结束或暂停对话），不转换为错误数据包
+            raise
         except requests.exceptions.Timeout:
+            if selection is not None:
+                self.router.record_failure(selection)
             logger.error("API调用超时")
             error_packet = create_error_packet("API调用超时", self.name)
             return error_packet.compress_content().to_string()
         except requests.exceptions.ConnectionError:
+            if selection is not None:
+                self.router.record_failure(selection)
             logger.error("API连接错误")
             error_packet = create_error_packet("API连接错误", self.name)
             return error_packet.compress_content().to_string()
@@ -356,32 +458,82 @@ class AIAgent:
             error_packet = create_error_packet(f"消息处理异常: {str(e)}", self.name)
             return error_packet.compress_content().to_string()
 
-    def process_message(self, packet: EfficodePacket) -> Optional[str]:
-        """处理接收到的Efficode数据包"""
+    def commit_exchange(self, user_content: str, assistant_content: str) -> None:
+        """
+        把一次问答写入对话上下文
+        
+        Args:
+            user_content: 发给API的内容
+            assistant_content: API的回复
+        """
+        self.context.append({"role": "user", "content": user_content})
+        self.context.append({"role": "assistant", "content": assistant_content})
+        
+        # 保持上下文在合理大小
+        if len(self.context) > 10:
+            self.context = self.context[-10:]
+
+    def _record_usage(self, selection: Dict[str, Any], started: float, usage: Optional[Dict[str, Any]]) -> None:
+        """记录一次成功调用的延迟和令牌用量，供模型路由和对话统计使用"""
+        self.router.record(selection, started, usage)
+        self.usage_stats["calls"] += 1
+        self.usage_stats["latency"] += time.monotonic() - started
+        if usage:
+            self.usage_stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+            self.usage_stats["completion_tokens"] += usage.get("completion_tokens", 0)
+
+    def process_message(self, packet: EfficodePacket,
+                        on_chunk: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        处理接收到的Efficode数据包
+        
+        Args:
+            packet: 数据包
+            on_chunk: 流式回调，REQ/DATA数据包的回复内容边生成边回调
+        """
         try:
             if packet.op_code == "DID":
-                # 身份验证
+                # 身份验证：单个对端(value)或批量握手的群组成员(group)
+                group = packet.params.get(GROUP_PARAM)
+                if isinstance(group, list):
+                    peers = [did for did in group if did != self.did]
+                    if peers and all(is_valid_did(did) for did in peers):
+                        for did in peers:
+                            self.sessions.establish(did, self.did)
+                        logger.info(f"验证群组内 {len(peers)} 个对端成功")
+                        return create_ack_packet("success", f"群组验证成功 from {self.name}", self.name).to_string()
+                    return create_error_packet("群组身份验证失败", self.name).to_string()
                 did_value = packet.params.get("value", "")
-                if did_value.startswith("did:efficode:"):
-                    self.authenticated = True
+                if is_valid_did(did_value):
+                    self.sessions.establish(did_value, self.did)
                     self.peer = packet.sender
                     logger.info(f"验证 {did_value} 成功")
                     return create_ack_packet("success", f"验证成功 from {self.name}", self.name).to_string()
                 return create_error_packet("身份验证失败", self.name).to_string()
                 
             elif packet.op_code in ["REQ", "DATA"]:
-                if not self.authenticated and packet.sender != "用户":
+                if packet.sender != "用户" and not self.sessions.is_valid(did_for(packet.sender), self.did):
                     return create_error_packet("请先进行身份验证", self.name).to_string()
                 
+                # 重传的数据包直接返回首次处理的响应，避免重复调用API
+                seen, cached_response = self.seen_packets.lookup(packet.packet_id)
+                if seen and cached_response:
+                    logger.info(f"数据包 {packet.packet_id} 已处理过，返回缓存的响应")
+                    return cached_response
+                
                 # 调用API处理消息
-                response = self.send_message(packet)
+                response = self.send_message(packet, on_chunk=on_chunk)
                 if response:
+                    if not response.startswith("!ERROR"):
+                        self.seen_packets.add(packet.packet_id, response)
                     # 返回API响应字符串（已经是加密的Efficode格式）
                     return response
                 return create_error_packet("消息处理失败", self.name).to_string()
             
             return create_error_packet(f"未知操作码: {packet.op_code}", self.name).to_string()
             
+        except (Cancelled, CircuitOpenError):
+            raise
         except Exception as e:
             logger.error(f"消息处理错误: {str(e)}")
             return create_error_packet(f"处理错误: {str(e)}", self.name).to_string() 
\ No newline at end of file
@@ -1,14 +1,20 @@
-import requests
 import json
 import time
 import logging
-import zlib
-import base64
-import re
 import os
+import argparse
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Union, Tuple
-from dataclasses import dataclass
+
+# 数据包引擎与DialogueManager共用efficode_core，旧版线格式由其兼容解码
+from efficode_core import EfficodePacket, OP_CODE_PREFIXES
+from packet_identity import SeenPacketCache
+from api_client import ApiClient, get_default_client
+from efficode_workers import optimize_packet
+from efficode_keywords import load_default_model
+from convergence import ConvergencePolicy, REDIRECT, STOP
+from memory_monitor import MemoryMonitor, SpilledHistory, MEMORY_SNAPSHOT_ROUNDS, limit_from_env
+from profiling import DialogueProfiler, SAMPLE, PROFILE_MODES
 
 # 配置日志
 logging.basicConfig(
@@ -17,342 +23,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger('AI_Communication')
 
-@dataclass
-class EfficodePacket:
-    """Efficode数据包结构"""
-    op_code: str  # 操作码: DID/REQ/DATA/ACK/ERROR
-    params: Dict[str, Any]  # 参数
-    sender: str  # 发送者ID
-    timestamp: float = time.time()  # 时间戳
-    
-    def to_string(self) -> str:
-        """将数据包转换为Efficode字符串格式"""
-        prefix = {
-            "DID": "@",
-            "REQ": "#",
-            "DATA": "#",
-            "ACK": "!",
-            "ERROR": "!"
-        }.get(self.op_code, "#")
-        
-        # 构建参数字符串
-        param_str = ""
-        if self.params:
-            if self.op_code in ["DID", "ACK", "ERROR"]:
-                param_str = f":{json.dumps(self.params, ensure_ascii=False)}"
-            else:
-                param_parts = []
-                for k, v in self.params.items():
-                    if isinstance(v, dict):
-                        param_parts.append(f"{k}={json.dumps(v, ensure_ascii=False)}")
-                    else:
-                        param_parts.append(f"{k}={v}")
-                param_str = f"?{'&'.join(param_parts)}"
-        
-        return f"{prefix}{self.op_code}{param_str}"
-    
-    @classmethod
-    def from_string(cls, message: str, sender: str) -> 'EfficodePacket':
-        """从Efficode字符串解析数据包"""
-        if not message:
-            return cls("ERROR", {"message": "空消息"}, sender)
-        
-        prefix = message[0]
-        op_code_map = {
-            "@": ["DID"],
-            "#": ["REQ", "DATA"],
-            "!": ["ACK", "ERROR"]
-        }
-        
-        # 查找可能的操作码
-        possible_op_codes = op_code_map.get(prefix, [])
-        if not possible_op_codes:
-            return cls("ERROR", {"message": f"未知前缀: {prefix}"}, sender)
-        
-        # 提取操作码和参数
-        parts = message[1:].split(":", 1) if ":" in message else message[1:].split("?", 1)
-        op_code = None
-        
-        # 确定操作码
-        for code in possible_op_codes:
-            if parts[0].startswith(code):
-                op_code = code
-                break
-        
-        if not op_code:
-            return cls("ERROR", {"message": f"未知操作码: {parts[0]}"}, sender)
-        
-        # 解析参数
-        params = {}
-        if len(parts) > 1:
-            param_str = parts[1]
-            if op_code in ["DID", "ACK", "ERROR"]:
-                try:
-                    params = json.loads(param_str)
-                except:
-                    params = {"value": param_str}
-            else:
-                param_pairs = param_str.split("&")
-                for pair in param_pairs:
-                    if "=" in pair:
-                        k, v = pair.split("=", 1)
-                        try:
-                            # 尝试解析JSON
-                            if v.startswith("{") and v.endswith("}"):
-                                params[k] = json.loads(v)
-                            else:
-                                params[k] = v
-                        except:
-                            params[k] = v
-        
-        # 检查是否有压缩数据需要解压
-        packet = cls(op_code, params, sender)
-        return packet.decompress_if_needed()
-    
-    def compress_content(self, threshold: int = 500) -> 'EfficodePacket':
-        """
-        压缩数据包内容，如果内容大小超过阈值
-        
-        Args:
-            threshold: 压缩阈值（字节），默认500字节
-            
-        Returns:
-            压缩后的数据包
-        """
-        if self.op_code == "DATA" and "content" in self.params:
-            content = self.params["content"]
-            content_str = ""
-            
-            # 将内容转换为字符串
-            if isinstance(content, dict):
-                content_str = json.dumps(content, ensure_ascii=False)
-            elif isinstance(content, str):
-                content_str = content
-            else:
-                content_str = str(content)
-            
-            # 检查内容大小是否超过阈值
-            if len(content_str.encode('utf-8')) > threshold:
-                # 压缩内容
-                compressed = zlib.compress(content_str.encode('utf-8'))
-                # Base64编码，确保可以安全传输
-                encoded = base64.b64encode(compressed).decode('ascii')
-                
-                # 更新参数
-                self.params["content"] = encoded
-                self.params["_compressed"] = True
-                self.params["_original_type"] = "json" if isinstance(content, dict) else "text"
-                
-                logger.info(f"内容已压缩，压缩率: {len(encoded) / len(content_str):.2f}")
-        
-        return self
-    
-    def decompress_if_needed(self) -> 'EfficodePacket':
-        """
-        如果数据包内容被压缩，则解压
-        
-        Returns:
-            解压后的数据包
-        """
-        if self.op_code == "DATA" and self.params.get("_compressed", False):
-            try:
-                # 获取压缩内容
-                encoded_content = self.params["content"]
-                # Base64解码
-                compressed = base64.b64decode(encoded_content)
-                # 解压
-                decompressed = zlib.decompress(compressed).decode('utf-8')
-                
-                # 根据原始类型恢复内容
-                original_type = self.params.get("_original_type", "text")
-                if original_type == "json":
-                    self.params["content"] = json.loads(decompressed)
-                else:
-                    self.params["content"] = decompressed
-                
-                # 移除压缩标记
-                self.params.pop("_compressed", None)
-                self.params.pop("_original_type", None)
-                
-                logger.info("内容已解压")
-            except Exception as e:
-                logger.error(f"解压内容失败: {str(e)}")
-        
-        return self
-    
-    def add_metadata(self) -> 'EfficodePacket':
-        """
-        添加元数据，增强自解释能力
-        
-        Returns:
-            添加元数据后的数据包
-        """
-        if self.op_code == "DATA" and "content" in self.params:
-            content = self.params["content"]
-            
-            # 添加内容类型元数据
-            if isinstance(content, dict):
-                # 提取结构信息
-                schema = {k: type(v).__name__ for k, v in content.items()}
-                self.params["_metadata"] = {
-                    "type": "json",
-                    "schema": schema,
-                    "keys": list(content.keys())
-                }
-            elif isinstance(content, str):
-                # 尝试检测内容类型
-                content_type = self._detect_content_type(content)
-                self.params["_metadata"] = {
-                    "type": "text",
-                    "content_type": content_type,
-                    "length": len(content)
-                }
-        
-        return self
-    
-    def _detect_content_type(self, text: str) -> str:
-        """
-        检测文本内容类型
-        
-        Args:
-            text: 要检测的文本
-            
-        Returns:
-            内容类型
-        """
-        # 检测是否是JSON
-        if text.strip().startswith('{') and text.strip().endswith('}'):
-            try:
-                json.loads(text)
-                return "json"
-            except:
-                pass
-        
-        # 检测是否是URL
-        if text.startswith(('http://', 'https://')):
-            return "url"
-        
-        # 检测是否是代码
-        code_patterns = [
-            r'def\s+\w+\s*\(.*\):',  # Python函数
-            r'function\s+\w+\s*\(.*\)',  # JavaScript函数
-            r'class\s+\w+',  # 类定义
-            r'import\s+\w+',  # 导入语句
-            r'<\w+>.*</\w+>'  # HTML标签
-        ]
-        
-        for pattern in code_patterns:
-            if re.search(pattern, text):
-                return "code"
-        
-        # 检测是否是问题
-        if '?' in text and len(text) < 200:
-            return "question"
-        
-        # 默认为普通文本
-        return "plain_text"
-    
-    def extract_semantic_info(self) -> 'EfficodePacket':
-        """
-        提取语义信息，增强自解释能力
-        
-        Returns:
-            添加语义信息后的数据包
-        """
-        if self.op_code == "REQ":
-            # 提取请求意图
-            req_type = self.params.get("type", "")
-            if req_type:
-                self.params["_semantic"] = {
-                    "intent": f"request_{req_type}",
-                    "expected_response": "data"
-                }
-        
-        elif self.op_code == "DATA" and "content" in self.params:
-            content = self.params.get("content", "")
-            if isinstance(content, str):
-                # 提取关键词
-                keywords = self._extract_keywords(content)
-                if keywords:
-                    if "_semantic" not in self.params:
-                        self.params["_semantic"] = {}
-                    self.params["_semantic"]["keywords"] = keywords
-        
-        return self
-    
-    def _extract_keywords(self, text: str) -> List[str]:
-        """
-        从文本中提取关键词
-        
-        Args:
-            text: 要提取关键词的文本
-            
-        Returns:
-            关键词列表
-        """
-        # 简单实现：提取长度大于2的词
-        words = re.findall(r'\b\w{3,}\b', text.lower())
-        # 过滤常见停用词
-        stopwords = {'the', 'and', 'is', 'in', 'to', 'of', 'for', 'with', 'on', 'at'}
-        keywords = [word for word in words if word not in stopwords]
-        # 返回出现频率最高的前5个词
-        word_counts = {}
-        for word in keywords:
-            word_counts[word] = word_counts.get(word, 0) + 1
-        
-        sorted_words = sorted(word_counts.items(), key=lambda x: x[1], reverse=True)
-        return [word for word, _ in sorted_words[:5]]
-    
-    def optimize_for_transmission(self) -> 'EfficodePacket':
-        """
-        优化数据包以提高传输效率
-        
-        Returns:
-            优化后的数据包
-        """
-        # 添加元数据
-        self.add_metadata()
-        
-        # 提取语义信息
-        self.extract_semantic_info()
-        
-        # 压缩内容
-        self.compress_content()
-        
-        return self
-
 class AIAgent:
-    def __init__(self, name: str, api_key: str):
+    def __init__(self, name: str, api_key: Optional[str] = None, client: Optional[ApiClient] = None):
         """
         初始化AI代理
         
         Args:
             name: AI代理的名称
-            api_key: API密钥
+            api_key: API密钥，环境变量未配置提供方池时使用
+            client: API客户端，默认使用进程级共享的客户端
         """
         self.name = name
         self.did = f"did:efficode:{name}"
-        self.api_key = api_key
-        self.api_base = "https://api.siliconflow.cn/v1"  # SiliconFlow API地址
+        self.client = client or get_default_client(api_key)
         self.model = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"  # 指定模型
         self.authenticated = False
         self.peer = None  # 对话伙伴
         self.context = []  # 对话上下文
+        self.seen_packets = SeenPacketCache()  # 已处理数据包ID -> 响应，用于重传去重
         
         logger.info(f"AI代理 {name} 已初始化")
     
     def send_message(self, message: Union[str, EfficodePacket]) -> Optional[str]:
         """调用SiliconFlow API发送消息"""
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
             # 准备消息内容
             if isinstance(message, EfficodePacket):
                 # 优化数据包以提高传输效率
-                message.optimize_for_transmission()
+                optimize_packet(message)
                 content = message.to_string()
                 logger.info(f"发送到API的Efficode消息: {content}")
                 
@@ -437,10 +135,8 @@ class AIAgent:
             }
             
             logger.info(f"正在调用API...")
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=data,
+            response = self.client.complete(
+                data,
                 timeout=30  # 增加超时时间
             )
             
@@ -485,19 +181,24 @@ class AIAgent:
                 if not self.authenticated:
                     return EfficodePacket("ERROR", {"status": "auth_required", "message": "请先进行身份验证"}, self.name)
                 
+                # 重传的数据包直接返回首次处理的响应
+                seen, cached_response = self.seen_packets.lookup(packet.packet_id)
+                if seen and cached_response is not None:
+                    logger.info(f"数据包 {packet.packet_id} 已处理过，返回缓存的响应")
+                    return cached_response
+                
                 # 调用API处理消息
                 response = self.send_message(packet)
                 if response:
-                    # 尝试解析响应为Efficode格式
-                    try:
+                    # 响应为Efficode格式时解析，否则作为DATA返回
+                    if response[0] in OP_CODE_PREFIXES.values():
                         response_packet = EfficodePacket.from_string(response, self.name)
-                        # 优化响应数据包
-                        return response_packet.optimize_for_transmission()
-                    except:
-                        # 如果无法解析，则作为DATA返回
-                        data_packet = EfficodePacket("DATA", {"content": response, "type": "text"}, self.name)
-                        # 优化响应数据包
-                        return data_packet.optimize_for_transmission()
+                    else:
+                        response_packet = EfficodePacket("DATA", {"content": response, "type": "text"}, self.name)
+                    # 优化响应数据包
+                    response_packet = optimize_packet(response_packet)
+                    self.seen_packets.add(packet.packet_id, response_packet)
+                    return response_packet
                 return EfficodePacket("ERROR", {"status": "processing_failed", "message": "消息处理失败"}, self.name)
             
             return EfficodePacket("ERROR", {"status": "unknown_opcode", "message": f"未知操作码: {packet.op_code}"}, self.name)
@@ -506,7 +207,29 @@ class AIAgent:
             logger.error(f"消息处理错误: {str(e)}")
             return EfficodePacket("ERROR", {"status": "exception", "message": f"处理错误: {str(e)}"}, self.name)
 
-def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, delay: int = 3, first_message: Optional[str] = None):
+def _compact_seen_packets(agents: Tuple[AIAgent, ...], keep: Optional[EfficodePacket]) -> int:
+    """
+    重新压缩已处理数据包缓存中被就地解压的响应（对话循环解压后用于显示和记录），
+    只保留压缩后的一份；重传时返回的仍是与首次相同的响应
+
+    Args:
+        agents: 智能体
+        keep: 当前正在流转的数据包，不压缩
+
+    Returns:
+        重新压缩的数据包数
+    """
+    count = 0
+    for agent in agents:
+        for packet in agent.seen_packets.values():
+            if isinstance(packet, EfficodePacket) and packet is not keep and not packet.is_compressed():
+                if packet.compress_content().is_compressed():
+                    count += 1
+    return count
+
+def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, delay: int = 3, first_message: Optional[str] = None,
+                          early_stop: bool = True, memory_every: int = MEMORY_SNAPSHOT_ROUNDS,
+                          memory_limit_mb: Optional[float] = None, profile: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """运行自动对话，无需用户输入，两个AI代理自动交流
 
     Args:
@@ -515,7 +238,39 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
         max_rounds: 最大对话轮次，默认100轮
         delay: 每轮对话的延迟时间（秒），默认3秒
         first_message: 启动对话的第一条消息，默认为简单问候
+        early_stop: 对话连续高度重复时先引导换角度，仍重复则提前结束
+        memory_every: 每多少轮做一次内存快照（tracemalloc），0表示不做快照
+        memory_limit_mb: 内存上限（MB），超过时把较早的对话记录转存到磁盘、重新压缩缓存中
+                         解压过的数据包；默认读取环境变量EFFICODE_MEMORY_LIMIT_MB，未设置则不压缩
+        profile: 剖析模式（sample或cprofile），剖析结果写到logs目录的对话记录旁边；None表示不剖析
+
+    Returns:
+        剖析报告（见DialogueProfiler.write），不剖析时返回None
     """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    args = (ai_a, ai_b, max_rounds, delay, first_message, early_stop, memory_every, memory_limit_mb, timestamp)
+    if not profile:
+        _run_auto_conversation(*args)
+        return None
+    profiler = DialogueProfiler(profile)
+    try:
+        with profiler:
+            _run_auto_conversation(*args)
+    finally:
+        report = profiler.write(os.path.join("logs", f"conversation_{timestamp}"),
+                                title=f"自动对话 {ai_a.name} - {ai_b.name}")
+    return report
+
+def _run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int, delay: int, first_message: Optional[str],
+                           early_stop: bool, memory_every: int, memory_limit_mb: Optional[float], timestamp: str):
+    """自动对话的主体，参数见run_auto_conversation，timestamp用于对话记录的文件名"""
+    # 对话记录较早的条目可以转存到磁盘，保存时按原顺序读回
+    conversation_log = SpilledHistory(os.path.join("logs", f"conversation_{timestamp}.spill.jsonl"))
+    current_packet: Optional[EfficodePacket] = None
+    monitor = MemoryMonitor(memory_every, memory_limit_mb if memory_limit_mb is not None else limit_from_env())
+    monitor.add_compactor("spilled_entries", conversation_log.spill)
+    monitor.add_compactor("recompressed_packets", lambda: _compact_seen_packets((ai_a, ai_b), current_packet))
+    monitor.start()
     try:
         logger.info("开始自动对话...")
         
@@ -550,9 +305,6 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
             # 默认消息
             first_packet = EfficodePacket("REQ", {"type": "conversation", "topic": "AI_future"}, ai_a.name)
         
-        # 初始化对话记录
-        conversation_log = []
-        
         # 让第一个智能体先处理用户输入的问题
         if first_packet.op_code == "REQ" or (first_packet.op_code == "DATA" and "content" in first_packet.params):
             print(f"\n[系统] 首先让 {ai_a.name} 处理用户输入...")
@@ -631,6 +383,7 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
         
         # 对话轮次计数
         rounds = 0
+        policy = ConvergencePolicy() if early_stop else None
         
         # 开始自动对话循环
         print(f"\n{'='*50}")
@@ -692,6 +445,16 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
                             
                     print("-" * 30)
                 
+                # 收敛检测: 与双方近期发言高度重复时引导换角度或提前结束
+                if policy and isinstance(response.params.get("content"), str):
+                    action = policy.observe_round([(current_receiver.name, response.params["content"])])
+                    if action == STOP:
+                        print(f"\n[系统] 对话已收敛，提前结束（节省 {max_rounds - rounds} 轮）")
+                        break
+                    if action == REDIRECT:
+                        print(f"\n[系统] 对话开始重复，引导 {current_sender.name} 换一个角度")
+                        response.params["content"] = policy.redirect(response.params["content"])
+                
                 # 交换发送者和接收者
                 temp = current_sender
                 current_sender = current_receiver
@@ -707,9 +470,13 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
                 logger.error(f"对话中断: 未收到响应")
                 print(f"\n对话中断: {current_receiver.name} 未返回响应")
                 break
+            
+            monitor.observe(rounds)
         
         # 保存对话记录
-        spl_file = save_conversation_to_spl(conversation_log)
+        spl_file = save_conversation_to_spl(conversation_log, f"conversation_{timestamp}.spl",
+                                            metadata={"memory": monitor.report()})
+        conversation_log.close()
         
         print(f"\n{'='*50}")
         print(f"{'自动对话结束':^50}")
@@ -717,14 +484,18 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
         print(f"{'对话已保存至 {spl_file}':^50}")
         print(f"{'='*50}\n")
         logger.info(f"自动对话结束，共完成 {rounds} 轮对话")
+        if policy:
+            logger.info(f"收敛检测: {policy.report(max_rounds)}")
             
     except KeyboardInterrupt:
         print("\n用户中断对话")
         logger.info("自动对话被用户终止")
         
         # 尝试保存已有的对话记录
-        if 'conversation_log' in locals() and len(conversation_log) > 0:
-            spl_file = save_conversation_to_spl(conversation_log)
+        if len(conversation_log) > 0:
+            spl_file = save_conversation_to_spl(conversation_log, f"conversation_{timestamp}.spl",
+                                                metadata={"memory": monitor.report()})
+            conversation_log.close()
             print(f"部分对话已保存至 {spl_file}")
     except Exception as e:
         logger.error(f"自动对话错误: {str(e)}")
@@ -732,9 +503,13 @@ def run_auto_conversation(ai_a: AIAgent, ai_b: AIAgent, max_rounds: int = 100, d
         print(f"对话发生错误: {str(e)}")
         
         # 尝试保存已有的对话记录
-        if 'conversation_log' in locals() and len(conversation_log) > 0:
-            spl_file = save_conversation_to_spl(conversation_log)
+        if len(conversation_log) > 0:
+            spl_file = save_conversation_to_spl(conversation_log, f"conversation_{timestamp}.spl",
+                                                metadata={"memory": monitor.report()})
+            conversation_log.close()
             print(f"部分对话已保存至 {spl_file}")
+    finally:
+        monitor.stop()
 
 def run_conversation(ai_a: AIAgent, ai_b: AIAgent):
     """运行交互式对话，需要用户输入"""
@@ -870,13 +645,15 @@ def run_conversation(ai_a: AIAgent, ai_b: AIAgent):
         print(f"{'共完成 '+str(rounds)+' 轮对话':^50}")
         print(f"{'='*50}\n")
         
-def save_conversation_to_spl(conversation: List[Dict[str, Any]], filename: Optional[str] = None) -> str:
+def save_conversation_to_spl(conversation: Union[List[Dict[str, Any]], SpilledHistory], filename: Optional[str] = None,
+                             metadata: Optional[Dict[str, Any]] = None) -> str:
     """
     将对话保存到SPL文件中
     
     Args:
-        conversation: 对话记录列表
+        conversation: 对话记录列表（或部分条目已转存到磁盘的对话记录）
         filename: 文件名，如果为None则自动生成
+        metadata: 写入文件头的元数据（例如内存报告），每项一行JSON
         
     Returns:
         保存的文件路径
@@ -893,7 +670,10 @@ def save_conversation_to_spl(conversation: List[Dict[str, Any]], filename: Optio
     with open(filepath, "w", encoding="utf-8") as f:
         f.write("# Efficode对话记录 SPL格式\n")
         f.write(f"# 生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"# 对话轮次: {len(conversation)}\n\n")
+        f.write(f"# 对话轮次: {len(conversation)}\n")
+        for key, value in (metadata or {}).items():
+            f.write(f"# {key}: {json.dumps(value, ensure_ascii=False)}\n")
+        f.write("\n")
         
         for i, entry in enumerate(conversation):
             f.write(f"## 轮次 {i+1}\n")
@@ -913,8 +693,17 @@ def save_conversation_to_spl(conversation: List[Dict[str, Any]], filename: Optio
     logger.info(f"对话已保存到文件: {filepath}")
     return filepath
 
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Efficode智能体自动对话系统")
+    parser.add_argument("--profile", nargs="?", const=SAMPLE, choices=PROFILE_MODES,
+                        help="剖析自动对话（默认sample低开销采样，cprofile为确定性剖析），"
+                             "结果写到logs目录的对话记录旁边")
+    return parser.parse_args()
+
 def main():
     """主函数"""
+    args = parse_args()
     try:
         print("=" * 50)
         print(f"{'Efficode智能体自动对话系统 v1.0':^50}")
@@ -943,10 +732,6 @@ def main():
         
         try:
             # 测试API连接
-            test_headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
             test_data = {
                 "model": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
                 "messages": [{"role": "user", "content": "测试连接"}],
@@ -954,12 +739,7 @@ def main():
             }
             
             print("正在测试API连接...")
-            test_response = requests.post(
-                "https://api.siliconflow.cn/v1/chat/completions",
-                headers=test_headers,
-                json=test_data,
-                timeout=10
-            )
+            test_response = get_default_client(api_key).chat_completion(test_data, timeout=10)
             
             if test_response.status_code == 200:
                 print("API连接测试成功!")
@@ -973,6 +753,11 @@ def main():
             print("请检查API密钥和网络连接后重试")
             return
             
+        # 从已有的对话日志学习关键词权重
+        keyword_model = load_default_model()
+        if keyword_model:
+            print(f"已从 {keyword_model.documents} 条历史消息学习关键词权重")
+            
         # 创建AI实例
         ai_names = ["智谋", "慧眼", "达闻", "明智", "博学", "睿思", "悟道", "知心", "思辨", "通晓"]
         print("\n选择AI智能体名称:")
@@ -1036,7 +821,12 @@ def main():
                     first_message = None
                     
                 # 运行自动对话
-                run_auto_conversation(ai_a, ai_b, max_rounds, delay, first_message)
+                report = run_auto_conversation(ai_a, ai_b, max_rounds, delay, first_message, profile=args.profile)
+                if report:
+                    print(f"\n性能剖析（{report['mode']}）: " + "，".join(
+                        f"{name} {seconds:.2f} 秒" for name, seconds in report["subsystems"].items()))
+                    for path in report["files"]:
+                        print(f"- {path}")
                 break
                 
             else:
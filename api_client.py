@@ -0,0 +1,441 @@
+"""
+API客户端模块
+
+这个模块是所有对SiliconFlow API的HTTP调用的统一入口：请求经由提供方池
+分配到具体的密钥/端点，失败（限流、服务端错误、连接错误）时换一个成员重试，
+并把每次的结果反馈给提供方池以维护健康状态和限流额度。
+
+完成调用(complete)还经过单飞(single-flight)层：并发的完全相同的请求只向上游
+发送一次，结果（包括流式数据块）分发给所有等待者；上游调用再由请求调度器按
+优先级类别和对话排队。cancel_scope()设置的取消令牌限制每次尝试的超时，并在取消
+时关闭正在读取的响应。
+"""
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any, List, Iterator, Callable
+
+import requests
+
+from provider_pool import ProviderPool, ProviderMember
+from request_scheduler import RequestScheduler, get_default_scheduler
+from cancellation import Cancelled, CancelToken, current_token, POLL_INTERVAL
+from circuit_breaker import CircuitOpenError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('API_Client')
+
+# 常量定义
+CHAT_COMPLETIONS_PATH = "/chat/completions"
+MAX_ATTEMPTS = 3  # 单个请求最多尝试的成员数
+RETRYABLE_STATUS_CODES = frozenset({401, 403, 408, 429, 500, 502, 503, 504})  # 换成员重试的状态码
+MAX_IN_FLIGHT_KEYS = 256  # 单飞层同时跟踪的不同请求数，超过后新请求不参与合并
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """
+    完成请求的键：请求体（模型、消息、采样参数、是否流式）规范化JSON的摘要
+
+    Args:
+        payload: /chat/completions请求体
+
+    Returns:
+        十六进制摘要
+    """
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+class CompletionResult:
+    """
+    一次完成调用的结果，可在合并的请求之间共享
+
+    接口与requests.Response的常用部分一致(status_code、text、json())；
+    coalesced为True表示本次调用搭了其他请求的便车，没有产生上游调用。
+    """
+
+    def __init__(self, status_code: int, data: Optional[Dict[str, Any]] = None, text: str = "",
+                 coalesced: bool = False):
+        self.status_code = status_code
+        self.data = data
+        self.text = text
+        self.coalesced = coalesced
+
+    def json(self) -> Dict[str, Any]:
+        return self.data if self.data is not None else json.loads(self.text)
+
+    def shared(self) -> 'CompletionResult':
+        """供合并的请求使用的副本"""
+        return CompletionResult(self.status_code, self.data, self.text, coalesced=True)
+
+class _Flight:
+    """一个进行中的上游请求"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.chunks: List[str] = []
+        self.listeners: List[Callable[[str], None]] = []
+        self.result: Optional[CompletionResult] = None
+        self.error: Optional[BaseException] = None
+
+    def emit(self, text: str) -> None:
+        """记录一个数据块并分发给所有监听者"""
+        with self.lock:
+            self.chunks.append(text)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(text)
+            except Exception as e:
+                logger.warning(f"流式回调出错: {str(e)}")
+
+class SingleFlight:
+    """
+    单飞层：相同键的并发调用共享一次执行
+
+    首个调用者(leader)执行上游请求；执行期间到达的相同请求等待其结果，
+    并收到已产生的数据块和之后的每个数据块。请求结束后立即移除，不缓存结果。
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT_KEYS):
+        self.max_in_flight = max_in_flight
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0, "bypassed": 0}
+
+    def do(self, key: str, fn: Callable[[Callable[[str], None]], CompletionResult],
+           on_chunk: Optional[Callable[[str], None]] = None) -> CompletionResult:
+        """
+        执行或加入一次调用
+
+        Args:
+            key: 请求键
+            fn: 上游调用，参数为数据块回调
+            on_chunk: 本调用者的数据块回调
+
+        Returns:
+            调用结果，加入他人请求时coalesced为True
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if not leader:
+                self.stats["coalesced"] += 1
+            elif len(self._flights) >= self.max_in_flight:
+                self.stats["bypassed"] += 1
+            else:
+                flight = self._flights[key] = _Flight()
+                self.stats["upstream"] += 1
+
+        if flight is None:
+            # 跟踪的请求数已达上限，直接调用
+            return fn(on_chunk or (lambda text: None))
+
+        if not leader:
+            if on_chunk is not None:
+                with flight.lock:
+                    # 先补发已产生的数据块，再接收后续数据块
+                    for text in flight.chunks:
+                        on_chunk(text)
+                    flight.listeners.append(on_chunk)
+            token = current_token()
+            try:
+                while not flight.done.wait(POLL_INTERVAL if token is not None else None):
+                    token.check()
+            finally:
+                if on_chunk is not None:
+                    with flight.lock:
+                        if on_chunk in flight.listeners:
+                            flight.listeners.remove(on_chunk)
+            if isinstance(flight.error, Cancelled) and not (token is not None and token.cancelled):
+                # 被取消的是发起请求的调用者，本调用者自己重新请求
+                return self.do(key, fn, on_chunk)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result.shared()
+
+        if on_chunk is not None:
+            flight.listeners.append(on_chunk)
+        try:
+            flight.result = fn(flight.emit)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+class ApiClient:
+    """基于提供方池的API客户端，线程安全，可被多个智能体共享"""
+
+    def __init__(self, pool: ProviderPool, max_attempts: int = MAX_ATTEMPTS,
+                 session: Optional[requests.Session] = None, scheduler: Optional[RequestScheduler] = None):
+        """
+        初始化API客户端
+
+        Args:
+            pool: 提供方池
+            max_attempts: 单个请求最多尝试的成员数（不超过池的成员数）
+            session: HTTP会话，复用连接
+            scheduler: 完成调用的调度器，默认使用进程级共享的调度器（并发上限随池的成员数提高）
+        """
+        self.pool = pool
+        self.max_attempts = max(1, min(max_attempts, len(pool.members)))
+        self.session = session or requests.Session()
+        self.single_flight = SingleFlight()
+        self.scheduler = scheduler or get_default_scheduler(len(pool.members))
+
+    @classmethod
+    def from_env(cls, fallback_key: Optional[str] = None) -> 'ApiClient':
+        """
+        从环境变量（SILICONFLOW_API_KEYS / SILICONFLOW_API_KEY）创建客户端
+
+        设置了EFFICODE_API_RECORD或EFFICODE_API_REPLAY时录制或回放API流量（见api_recording）。
+        """
+        from api_recording import ReplaySession, session_from_env, REPLAY_API_KEY
+        session = session_from_env()
+        if isinstance(session, ReplaySession):
+            fallback_key = fallback_key or REPLAY_API_KEY
+        return cls(ProviderPool.from_env(fallback_key), session=session)
+
+    def post(self, path: str, payload: Dict[str, Any], timeout: float = 60,
+             member: Optional[ProviderMember] = None, stream: bool = False) -> requests.Response:
+        """
+        发送POST请求
+
+        可重试的失败会换一个成员重试；所有尝试都失败时返回最后一个响应，
+        或重新抛出最后一个连接异常(requests.exceptions.Timeout/ConnectionError)。
+        当前上下文有取消令牌时，每次尝试的超时不超过剩余时间，超时或取消后
+        抛出Cancelled/DeadlineExceeded而不再重试。所有成员的熔断器都打开时
+        不发出请求，直接抛出CircuitOpenError；最后一次失败使熔断器全部打开时
+        同样抛出CircuitOpenError，调用方可暂停后重试。
+
+        Args:
+            path: API路径，例如/chat/completions
+            payload: JSON请求体
+            timeout: 每次尝试的超时时间（秒）
+            member: 指定成员（不重试），用于逐个检测成员
+            stream: 是否流式读取响应体（SSE），只在收到响应头之前重试
+
+        Returns:
+            HTTP响应
+        """
+        tried: List[ProviderMember] = []
+        attempts = 1 if member is not None else self.max_attempts
+        response = None
+        last_error: Optional[Exception] = None
+        token = current_token()
+        for attempt in range(attempts):
+            attempt_timeout = token.clamp_timeout(timeout) if token is not None else timeout
+            try:
+                current = self.pool.acquire(exclude=tried) if member is None else self.pool.pin(member)
+            except CircuitOpenError:
+                if not tried:
+                    raise
+                # 其余成员均已熔断，返回本次请求最后一次尝试的结果
+                break
+            tried.append(current)
+            started = time.monotonic()
+            try:
+                attempt_response = self.session.post(
+                    f"{current.api_base}{path}",
+                    headers={
+                        "Authorization": f"Bearer {current.api_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json=payload,
+                    timeout=attempt_timeout,
+                    stream=stream
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if response is not None:
+                    # 上一次尝试返回的可重试响应不会再被返回，关闭它，把连接还给连接池
+                    response.close()
+                    response = None
+                # 被本次请求自己的截止时间或取消中止的尝试不计入成员的熔断统计
+                aborted = token is not None and token.cancelled
+                self.pool.release(current, latency=time.monotonic() - started, record_health=not aborted)
+                logger.warning(f"成员 {current.name} 请求失败 ({attempt + 1}/{attempts}): {str(e)}")
+                if token is not None:
+                    token.check()
+                if attempt == attempts - 1:
+                    if member is None:
+                        self.pool.check_circuits()
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                # 不是网络故障（例如无效的URL、回放缺失或中断）：归还并发计数和探测名额，不计入熔断统计
+                if response is not None:
+                    response.close()
+                self.pool.release(current, latency=time.monotonic() - started, record_health=False)
+                raise
+
+            if response is not None:
+                # 上一次尝试返回了可重试的状态码：关闭它，把连接还给连接池
+                response.close()
+            response = attempt_response
+            last_error = None
+            self.pool.release(current, response.status_code, response.headers, time.monotonic() - started)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                break
+            if attempt < attempts - 1:
+                logger.warning(f"成员 {current.name} 返回状态码 {response.status_code}，换成员重试")
+        if last_error is not None:
+            raise last_error
+        if member is None and response.status_code in RETRYABLE_STATUS_CODES:
+            self.pool.check_circuits()
+        return response
+
+    def chat_completion(self, payload: Dict[str, Any], timeout: float = 60,
+                        member: Optional[ProviderMember] = None, stream: bool = False) -> requests.Response:
+        """
+        调用/chat/completions接口
+
+        Args:
+            payload: 请求体（model、messages等），流式调用时须包含"stream": True
+            timeout: 每次尝试的超时时间（秒）
+            member: 指定成员（不重试）
+            stream: 是否流式读取响应体，成功时用read_chat_stream()读取
+
+        Returns:
+            HTTP响应
+        """
+        return self.post(CHAT_COMPLETIONS_PATH, payload, timeout, member, stream)
+
+    def complete(self, payload: Dict[str, Any], timeout: float = 60,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> CompletionResult:
+        """
+        调用/chat/completions并读取完整结果，相同的并发请求只向上游发送一次
+
+        Args:
+            payload: 请求体，"stream": True时以流式读取并回调on_chunk
+            timeout: 每次尝试的超时时间（秒）
+            on_chunk: 流式回调
+
+        Returns:
+            成功时data为与非流式接口相同格式的响应，失败时text为响应体
+
+        Raises:
+            Cancelled: 当前上下文的取消令牌被取消或超过截止时间（DeadlineExceeded）
+            CircuitOpenError: 提供方池的熔断器全部打开
+        """
+        def upstream(emit: Callable[[str], None]) -> CompletionResult:
+            token = current_token()
+            started = time.monotonic()
+            # 服务不可用（熔断器全部打开）时直接失败，不占用调度槽位
+            self.pool.check_circuits()
+            try:
+                # 按request_context()设置的类别和对话排队，流式响应读完才释放槽位
+                with self.scheduler.slot():
+                    # 响应体总是延后读取，取消时关闭响应即可中止读取（包括非流式响应）
+                    response = self.chat_completion(payload, timeout, stream=True)
+                    unregister = token.on_cancel(response.close) if token is not None else None
+                    try:
+                        if response.status_code != 200:
+                            return CompletionResult(response.status_code, text=response.text)
+                        if payload.get("stream"):
+                            return CompletionResult(200, read_chat_stream(response, emit, token))
+                        return CompletionResult(200, response.json())
+                    except Exception:
+                        if token is not None:
+                            token.check()
+                        raise
+                    finally:
+                        if unregister is not None:
+                            unregister()
+            except Cancelled:
+                token.record_waste(time.monotonic() - started)
+                raise
+
+        return self.single_flight.do(request_key(payload), upstream, on_chunk)
+
+def iter_sse_events(response: requests.Response) -> Iterator[Dict[str, Any]]:
+    """
+    逐个解析SSE响应中的data事件
+
+    Args:
+        response: 以stream=True发送的请求的响应
+
+    Yields:
+        事件的JSON对象，遇到[DONE]时结束
+    """
+    for line in response.iter_lines():
+        # 按字节分行后再解码，避免响应头未声明编码时中文被错误解码
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            logger.warning(f"无法解析的SSE事件: {data[:100]}")
+
+def read_chat_stream(response: requests.Response, on_chunk: Optional[Callable[[str], None]] = None,
+                     token: Optional[CancelToken] = None) -> Dict[str, Any]:
+    """
+    读取流式/chat/completions响应，边读边回调，最后聚合为与非流式接口相同的格式
+
+    Args:
+        response: 以stream=True发送的请求的响应
+        on_chunk: 每收到一段回复内容时的回调
+        token: 取消令牌，每个事件之后检查，超时或取消时停止读取并抛出异常
+
+    Returns:
+        {"choices": [{"message": {"role", "content"[, "reasoning_content"]}}], "usage": ...}
+    """
+    content_parts: List[str] = []
+    reasoning_parts: List[str] = []
+    usage = None
+    try:
+        for event in iter_sse_events(response):
+            if token is not None:
+                token.check()
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices") or []:
+                delta = choice.get("delta") or {}
+                if delta.get("reasoning_content"):
+                    reasoning_parts.append(delta["reasoning_content"])
+                text = delta.get("content")
+                if text:
+                    content_parts.append(text)
+                    if on_chunk:
+                        on_chunk(text)
+    finally:
+        response.close()
+
+    message = {"role": "assistant", "content": "".join(content_parts)}
+    if reasoning_parts:
+        message["reasoning_content"] = "".join(reasoning_parts)
+    return {"choices": [{"message": message}], "usage": usage}
+
+_default_client: Optional[ApiClient] = None
+
+def get_default_client(fallback_key: Optional[str] = None) -> ApiClient:
+    """
+    获取进程级共享的API客户端，首次调用时从环境变量创建
+
+    Args:
+        fallback_key: 环境变量未配置密钥时使用的密钥
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = ApiClient.from_env(fallback_key)
+    return _default_client
+
+def set_default_client(client: Optional[ApiClient]) -> None:
+    """设置进程级共享的API客户端"""
+    global _default_client
+    _default_client = client
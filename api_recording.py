@@ -0,0 +1,315 @@
+"""
+API流量录制与回放模块
+
+在没有网络和API费用的环境中剖析、回归测试DialogueManager：
+
+- 录制: RecordingSession包装ApiClient的HTTP会话，把每个请求的响应（状态码、
+  限流相关的响应头、响应体或SSE事件行及其到达时间、连接失败）追加到压缩存档；
+- 回放: ReplaySession按请求的摘要（与单飞层相同的request_key）返回录制的响应，
+  按原始时序或加速（speed倍）重现首字节延迟和SSE事件间隔，超时和连接失败同样重现。
+
+模型路由会按观测到的延迟选择模型（并偶尔随机探索），回放时选到的模型可能与录制时
+不同，因此完整摘要找不到时再按不含模型和采样参数的宽松摘要（消息+是否流式）查找。
+同一摘要录制了多次时按录制顺序依次返回，用完后重复返回最后一次。
+
+存档是gzip压缩的JSON Lines文件，每个条目是一个独立的gzip成员，录制中途退出
+也不会损坏已写入的条目。
+
+设置环境变量EFFICODE_API_RECORD=<存档路径>或EFFICODE_API_REPLAY=<存档路径>
+（EFFICODE_API_REPLAY_SPEED=<倍数>，0表示不等待）后，ApiClient.from_env()
+创建的客户端自动录制或回放。
+"""
+
+import os
+import json
+import gzip
+import time
+import threading
+import logging
+from typing import Optional, Dict, Any, List, Iterator, Mapping
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from api_client import request_key
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('API_Recording')
+
+# 常量定义
+RECORD_ENV = "EFFICODE_API_RECORD"
+REPLAY_ENV = "EFFICODE_API_REPLAY"
+REPLAY_SPEED_ENV = "EFFICODE_API_REPLAY_SPEED"
+REPLAY_API_KEY = "replay"  # 回放时不需要真实密钥
+ARCHIVE_FORMAT = "efficode-api-archive"
+ARCHIVE_VERSION = 1
+RECORDED_HEADERS = ("content-type", "retry-after")  # 录制的响应头（另加所有x-ratelimit-*）
+ROUTED_FIELDS = ("model", "temperature", "max_tokens")  # 由模型路由决定、宽松摘要忽略的字段
+
+class ReplayMiss(Exception):
+    """回放存档中没有与请求匹配的响应"""
+
+def loose_request_key(payload: Dict[str, Any]) -> str:
+    """不含模型和采样参数的请求摘要"""
+    return request_key({key: value for key, value in payload.items() if key not in ROUTED_FIELDS})
+
+def _recorded_headers(headers: Mapping[str, str]) -> Dict[str, str]:
+    return {name.lower(): value for name, value in headers.items()
+            if name.lower() in RECORDED_HEADERS or name.lower().startswith("x-ratelimit")}
+
+class _RecordingResponse:
+    """
+    录制中的响应：代理原响应，响应体被读取（json/text/content）、SSE行读完或响应被关闭时写入条目
+
+    状态码和响应头直接来自原响应；其他属性同样转发给原响应。
+    """
+
+    def __init__(self, response: requests.Response, entry: Dict[str, Any], started: float,
+                 session: 'RecordingSession'):
+        self._response = response
+        self._entry = entry
+        self._started = started
+        self._session = session
+        self._events: List[List[Any]] = []  # [距上一行（首行为距收到响应头）的秒数, 行]
+        self._last = time.monotonic()
+        self._streamed = False
+        self._finished = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._response, name)
+
+    @property
+    def content(self) -> bytes:
+        content = self._response.content
+        if not self._finished:
+            self._entry["body"] = content.decode('utf-8', errors='replace')
+            self._entry["body_seconds"] = round(time.monotonic() - self._started - self._entry["latency"], 4)
+            self._finish()
+        return content
+
+    @property
+    def text(self) -> str:
+        self.content
+        return self._response.text
+
+    def json(self, **kwargs: Any) -> Any:
+        self.content
+        return self._response.json(**kwargs)
+
+    def iter_lines(self, *args: Any, **kwargs: Any) -> Iterator[Any]:
+        self._streamed = True
+        try:
+            for line in self._response.iter_lines(*args, **kwargs):
+                now = time.monotonic()
+                if line:
+                    text = line.decode('utf-8') if isinstance(line, bytes) else line
+                    self._events.append([round(now - self._last, 4), text])
+                    self._last = now
+                yield line
+        except Exception as e:
+            self._entry["truncated"] = type(e).__name__
+            raise
+        finally:
+            self._finish()
+
+    def close(self) -> None:
+        # 读到[DONE]后调用方不再继续迭代就关闭响应，这是正常结束
+        done = bool(self._events) and self._events[-1][1].strip() == "data: [DONE]"
+        if self._streamed and not self._finished and not done:
+            self._entry["truncated"] = "closed"
+        self._finish()
+        self._response.close()
+
+    def _finish(self) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        if self._streamed:
+            self._entry["events"] = self._events
+        self._session.write(self._entry)
+
+class RecordingSession:
+    """录制经过的请求和响应，接口与requests.Session.post一致"""
+
+    def __init__(self, path: str, session: Optional[requests.Session] = None):
+        """
+        初始化录制会话
+
+        Args:
+            path: 存档路径，已存在时追加
+            session: 实际发送请求的HTTP会话
+        """
+        self.path = path
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "stream_events": 0, "errors": 0}
+        if not os.path.exists(path):
+            self._append({"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "created": time.time()})
+        logger.info(f"录制API流量到: {path}")
+
+    def post(self, url: str, json: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None,
+             stream: bool = False, **kwargs: Any) -> Any:
+        """发送请求并录制；连接失败同样录制后重新抛出"""
+        payload = json or {}
+        entry: Dict[str, Any] = {"key": request_key(payload), "loose_key": loose_request_key(payload),
+                                 "path": url.split("/v1", 1)[-1], "model": payload.get("model"),
+                                 "stream": bool(payload.get("stream"))}
+        started = time.monotonic()
+        try:
+            response = self.session.post(url, json=json, timeout=timeout, stream=stream, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            entry["error"] = "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection"
+            entry["latency"] = round(time.monotonic() - started, 4)
+            self.write(entry)
+            raise
+        entry["latency"] = round(time.monotonic() - started, 4)
+        entry["status"] = response.status_code
+        entry["headers"] = _recorded_headers(response.headers)
+        recording = _RecordingResponse(response, entry, started, self)
+        if response.status_code != 200:
+            # 失败的响应调用方不一定读取响应体（例如换成员重试），立即录制
+            recording.content
+        return recording
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        """追加一个条目"""
+        with self._lock:
+            self._append(entry)
+            self.stats["recorded"] += 1
+            self.stats["stream_events"] += len(entry.get("events") or ())
+            if "error" in entry or entry.get("status", 200) != 200:
+                self.stats["errors"] += 1
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            f.write(line)
+
+class _ReplayResponse:
+    """回放的响应，接口与requests.Response的常用部分一致；close()会中止进行中的iter_lines()"""
+
+    def __init__(self, entry: Dict[str, Any], speed: float):
+        self.status_code = entry["status"]
+        self.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        self.encoding = 'utf-8'
+        self._entry = entry
+        self._speed = speed
+        self._closed = threading.Event()
+        self._body_waited = False
+
+    def _wait(self, seconds: float) -> None:
+        if self._speed > 0 and seconds > 0:
+            self._closed.wait(seconds / self._speed)
+        if self._closed.is_set():
+            raise requests.exceptions.ConnectionError("响应已关闭")
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode('utf-8')
+
+    @property
+    def text(self) -> str:
+        if not self._body_waited:
+            self._body_waited = True
+            self._wait(self._entry.get("body_seconds", 0.0))
+        if "body" in self._entry:
+            return self._entry["body"]
+        # 录制时以流式读取的响应被当作普通响应体读取
+        return "\n\n".join(line for _, line in self._entry.get("events") or ())
+
+    def json(self, **kwargs: Any) -> Any:
+        return json.loads(self.text, **kwargs)
+
+    def iter_lines(self, *args: Any, **kwargs: Any) -> Iterator[bytes]:
+        if "events" not in self._entry:
+            yield from self.content.splitlines()
+            return
+        for delay, line in self._entry["events"]:
+            self._wait(delay)
+            yield line.encode('utf-8')
+        if self._entry.get("truncated"):
+            raise requests.exceptions.ConnectionError(f"录制时响应被中止: {self._entry['truncated']}")
+
+    def close(self) -> None:
+        self._closed.set()
+
+class ReplaySession:
+    """按请求摘要回放存档中的响应，接口与requests.Session.post一致"""
+
+    def __init__(self, path: str, speed: float = 1.0):
+        """
+        初始化回放会话
+
+        Args:
+            path: 存档路径
+            speed: 时序倍数，1为原始时序，10为加速10倍，0为不等待
+        """
+        self.path = path
+        self.speed = speed
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._loose: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[int, int] = {}  # id(条目列表) -> 已返回的条目数
+        self._lock = threading.Lock()
+        self.stats = {"entries": 0, "hits": 0, "loose_hits": 0, "repeats": 0, "misses": 0}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if "key" not in entry:
+                    continue
+                self._entries.setdefault(entry["key"], []).append(entry)
+                self._loose.setdefault(entry["loose_key"], []).append(entry)
+                self.stats["entries"] += 1
+        logger.info(f"从 {path} 回放API流量: {self.stats['entries']} 个响应，时序 {speed or '不等待'}x")
+
+    def _next(self, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """按录制顺序返回下一个条目（调用方持有锁），用完后重复返回最后一个"""
+        served = self._served.get(id(entries), 0)
+        if served >= len(entries):
+            self.stats["repeats"] += 1
+            return entries[-1]
+        self._served[id(entries)] = served + 1
+        return entries[served]
+
+    def lookup(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """查找请求对应的录制条目，找不到时抛出ReplayMiss"""
+        with self._lock:
+            entries = self._entries.get(request_key(payload))
+            if entries:
+                self.stats["hits"] += 1
+                return self._next(entries)
+            entries = self._loose.get(loose_request_key(payload))
+            if entries:
+                self.stats["loose_hits"] += 1
+                return self._next(entries)
+            self.stats["misses"] += 1
+        raise ReplayMiss(f"存档中没有匹配的响应（模型 {payload.get('model')}，"
+                         f"{len(payload.get('messages') or [])} 条消息）")
+
+    def post(self, url: str, json: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None,
+             stream: bool = False, **kwargs: Any) -> _ReplayResponse:
+        """返回录制的响应；首字节延迟超过本次的timeout时与真实请求一样超时"""
+        entry = self.lookup(json or {})
+        latency = entry["latency"] / self.speed if self.speed > 0 else 0.0
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"回放: 首字节延迟 {latency:.1f}s 超过超时 {timeout:.1f}s")
+        time.sleep(latency)
+        if entry.get("error") == "timeout":
+            raise requests.exceptions.ReadTimeout("回放: 录制时请求超时")
+        if entry.get("error"):
+            raise requests.exceptions.ConnectionError("回放: 录制时连接失败")
+        return _ReplayResponse(entry, self.speed)
+
+def session_from_env() -> Optional[Any]:
+    """按环境变量创建录制或回放会话，都未设置时为None"""
+    replay = os.getenv(REPLAY_ENV)
+    if replay:
+        return ReplaySession(replay, float(os.getenv(REPLAY_SPEED_ENV, "1")))
+    record = os.getenv(RECORD_ENV)
+    if record:
+        return RecordingSession(record)
+    return None
@@ -0,0 +1,170 @@
+"""
+身份验证会话模块
+
+这个模块用会话表取代智能体上的authenticated标志：一次DID握手成功后，按
+(对端DID, 本地DID)记录一个带过期时间的会话，会话在有效期内可被多次对话和多个
+DialogueManager复用，不再在每次对话前重复握手。
+
+多个智能体组成的群组使用批量握手：协调方向每个缺少会话的成员发送一个列出全体
+成员DID的DID数据包，成员一次验证所有对端并回复一个ACK，N个智能体只需N次往返，
+而不是两两握手的N(N-1)次。
+"""
+
+import time
+import threading
+import logging
+from typing import Optional, Dict, Any, Tuple, Sequence
+
+from efficode_core import EfficodePacket
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Auth_Sessions')
+
+# 常量定义
+DID_PREFIX = "did:efficode:"
+SESSION_TTL = 3600  # 会话有效期（秒）
+GROUP_PARAM = "group"  # 批量握手的DID数据包中列出全体成员DID的参数
+
+def did_for(name: str) -> str:
+    """智能体名称对应的DID"""
+    return f"{DID_PREFIX}{name}"
+
+def is_valid_did(did: Any) -> bool:
+    """检查DID格式"""
+    return isinstance(did, str) and did.startswith(DID_PREFIX) and len(did) > len(DID_PREFIX)
+
+class SessionTable:
+    """
+    身份验证会话表
+
+    键为(对端DID, 本地DID)，表示本地智能体已验证过对端。线程安全，
+    默认由进程内所有智能体和对话管理器共享。
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL):
+        """
+        初始化会话表
+
+        Args:
+            ttl: 会话有效期（秒）
+        """
+        self.ttl = ttl
+        self._expires: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self.stats = {"established": 0, "reused": 0, "expired": 0, "handshakes": 0}
+
+    def establish(self, peer_did: str, local_did: str, ttl: Optional[float] = None) -> None:
+        """记录本地智能体已验证对端，已有会话时刷新过期时间"""
+        with self._lock:
+            self._expires[(peer_did, local_did)] = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self.stats["established"] += 1
+
+    def is_valid(self, peer_did: str, local_did: str) -> bool:
+        """检查会话是否存在且未过期，过期的会话同时被移除"""
+        with self._lock:
+            expires = self._expires.get((peer_did, local_did))
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._expires[(peer_did, local_did)]
+                self.stats["expired"] += 1
+                return False
+            return True
+
+    def revoke(self, did: Optional[str] = None) -> None:
+        """撤销与某个DID相关的所有会话（作为任一方），未指定时清空会话表"""
+        with self._lock:
+            if did is None:
+                self._expires.clear()
+            else:
+                for key in [key for key in self._expires if did in key]:
+                    del self._expires[key]
+
+    def purge_expired(self) -> int:
+        """移除所有过期会话，返回移除的数量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, expires in self._expires.items() if expires <= now]
+            for key in expired:
+                del self._expires[key]
+            self.stats["expired"] += len(expired)
+            return len(expired)
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计数据"""
+        with self._lock:
+            return dict(self.stats, active=len(self._expires))
+
+_default_table: Optional[SessionTable] = None
+_default_table_lock = threading.Lock()
+
+def get_default_session_table() -> SessionTable:
+    """获取进程级共享的会话表"""
+    global _default_table
+    with _default_table_lock:
+        if _default_table is None:
+            _default_table = SessionTable()
+        return _default_table
+
+def create_group_did_packet(member_dids: Sequence[str], sender: str) -> EfficodePacket:
+    """
+    创建批量握手的DID数据包
+
+    Args:
+        member_dids: 群组全体成员的DID
+        sender: 发送者（协调方）
+
+    Returns:
+        DID数据包
+    """
+    return EfficodePacket("DID", {GROUP_PARAM: list(member_dids)}, sender)
+
+def authenticate_group(agents: Sequence[Any], table: Optional[SessionTable] = None,
+                       coordinator: str = "系统") -> bool:
+    """
+    确保群组内任意两个智能体之间都有有效会话
+
+    只有缺少会话（或会话已过期）的成员会收到一个批量握手数据包，每个成员一次往返。
+
+    Args:
+        agents: 智能体列表（AIAgent或RemoteAgent，需有name、did和process_message）
+        table: 会话表，默认使用进程级会话表
+        coordinator: 握手数据包的发送者
+
+    Returns:
+        是否所有成员都验证成功
+    """
+    table = table or get_default_session_table()
+    dids = [agent.did for agent in agents]
+    pending = [
+        agent for agent in agents
+        if not all(table.is_valid(peer, agent.did) for peer in dids if peer != agent.did)
+    ]
+    reused = len(agents) - len(pending)
+    if reused:
+        table._count("reused", reused)
+    if not pending:
+        logger.info(f"群组 {[agent.name for agent in agents]} 的会话均有效，跳过握手")
+        return True
+
+    for agent in pending:
+        response = agent.process_message(create_group_did_packet(dids, coordinator))
+        table._count("handshakes")
+        reply = EfficodePacket.from_string(response, agent.name) if response else None
+        if reply is None or reply.op_code != "ACK":
+            logger.error(f"{agent.name} 的群组身份验证失败")
+            return False
+        # 对端在其他进程中时，本地会话表同样记录验证结果
+        for peer in dids:
+            if peer != agent.did:
+                table.establish(peer, agent.did)
+        logger.info(f"{agent.name} 已验证群组内 {len(dids) - 1} 个对端")
+    return True
@@ -0,0 +1,605 @@
+"""
+Efficode性能基准测试
+
+这个程序对Efficode协议的关键路径进行吞吐量测试，用于比较优化前后的效果。
+
+用法:
+    python benchmark.py compress --packets 200 --size 20000
+    python benchmark.py stream --size-mb 50
+    python benchmark.py keywords --size 102400
+    python benchmark.py classify --size 20000
+    python benchmark.py selfextract --packets 100 --size 5000
+    python benchmark.py server --clients 1000 --dialogues 10
+    python benchmark.py dialogue --archive logs/api.jsonl.gz --record   # 联网录制一次
+    python benchmark.py dialogue --archive logs/api.jsonl.gz --speed 10  # 离线回放
+    python benchmark.py dialogue --archive logs/api.jsonl.gz --speed 0 --profile  # 离线剖析
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import re
+import json
+import zlib
+import base64
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from typing import Callable, List, Dict, Any
+
+from efficode_core import (
+    EfficodePacket,
+    PreambleSession,
+    compress_many,
+    decompress_many,
+    create_data_packet,
+    classify_content,
+    clear_transmission_cache,
+    SELF_EXTRACTING_DECOMPRESSOR_JS,
+    EFFICODE_SYNTAX_GUIDE
+)
+from efficode_keywords import extract_keywords
+from packet_identity import new_packet_id
+from efficode_workers import PacketWorkerPool
+from efficode_transport import AgentServer, RemoteAgent, InProcessTransport, UnixSocketTransport, TcpTransport
+from cancellation import Cancelled, CancelToken, current_token
+
+# 基准测试时关闭逐包的INFO日志，避免日志开销干扰结果
+logging.basicConfig(level=logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+_SAMPLE_WORDS = [
+    "人工智能", "认知", "探索", "未来", "意识", "语言", "模型", "协议",
+    "compression", "packet", "agent", "dialogue", "entropy", "signal", "的", "是",
+]
+
+def make_text(size: int, seed: int = 0) -> str:
+    """生成指定长度、可压缩的中英文混合文本"""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(_SAMPLE_WORDS)
+        parts.append(word)
+        length += len(word) + 1
+    return " ".join(parts)[:size]
+
+def make_cjk_text(size: int, seed: int = 0) -> str:
+    """生成指定长度、不含空格的中文为主文本（夹杂少量英文）"""
+    rng = random.Random(seed)
+    punctuation = ["，", "。", "？"]
+    parts: List[str] = []
+    length = 0
+    while length < size:
+        word = rng.choice(_SAMPLE_WORDS)
+        if word.isascii():
+            word = f" {word} "
+        elif rng.random() < 0.1:
+            word += rng.choice(punctuation)
+        parts.append(word)
+        length += len(word)
+    return "".join(parts)[:size]
+
+def make_packets(count: int, size: int) -> List[EfficodePacket]:
+    """生成一批DATA数据包"""
+    return [
+        EfficodePacket("DATA", {"content": make_text(size, seed=i), "type": "answer"}, "bench")
+        for i in range(count)
+    ]
+
+def timed(func: Callable[[], Any]) -> float:
+    """返回函数执行耗时（秒）"""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def report(title: str, results: Dict[str, float], total_bytes: int) -> None:
+    """打印吞吐量对比结果"""
+    print(f"\n{title}")
+    print("-" * 50)
+    baseline = None
+    for name, elapsed in results.items():
+        throughput = total_bytes / elapsed / 1024 / 1024 if elapsed > 0 else float("inf")
+        speedup = "" if baseline is None else f"  x{baseline / elapsed:.2f}"
+        baseline = baseline or elapsed
+        print(f"{name:<24}{elapsed * 1000:>10.1f} ms{throughput:>10.1f} MB/s{speedup}")
+
+def bench_compress(args: argparse.Namespace) -> None:
+    """批量压缩/解压与逐包循环的吞吐量对比"""
+    total_bytes = args.packets * args.size
+    results: Dict[str, float] = {}
+
+    packets = make_packets(args.packets, args.size)
+    results["逐包 compress_content"] = timed(lambda: [p.compress_content() for p in packets])
+    loop_strings = [p.to_string() for p in packets]
+
+    packets = make_packets(args.packets, args.size)
+    results["compress_many"] = timed(lambda: compress_many(packets, max_workers=args.workers))
+    batch_strings = [p.to_string() for p in packets]
+    assert loop_strings == batch_strings, "批量压缩结果与逐包压缩不一致"
+    report(f"压缩: {args.packets} 个数据包 x {args.size} 字符", results, total_bytes)
+
+    results = {}
+    compressed = make_packets(args.packets, args.size)
+    compress_many(compressed, max_workers=args.workers)
+    results["逐包 decompress_content"] = timed(lambda: [p.decompress_content() for p in compressed])
+    compressed = make_packets(args.packets, args.size)
+    compress_many(compressed, max_workers=args.workers)
+    results["decompress_many"] = timed(lambda: decompress_many(compressed, max_workers=args.workers))
+    report(f"解压: {args.packets} 个数据包 x {args.size} 字符", results, total_bytes)
+
+def peak_memory(func: Callable[[], Any]) -> float:
+    """返回函数执行期间的Python堆内存峰值（MB）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def bench_stream(args: argparse.Namespace) -> None:
+    """大内容一次性压缩与从文件流式压缩的峰值内存对比"""
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as source:
+        chunk = make_text(1024 * 1024)
+        for _ in range(args.size_mb):
+            source.write(chunk)
+
+        def from_file() -> None:
+            source.seek(0)
+            create_data_packet(source, "file", "bench")
+
+        source.seek(0)
+        content = source.read()
+        print(f"\n流式压缩: {args.size_mb} MB 内容")
+        print("-" * 50)
+        packet = EfficodePacket("DATA", {"content": content, "type": "file"}, "bench")
+        mb = peak_memory(lambda: packet._find_best_compression(content))
+        print(f"{'一次性多算法压缩':<24}{mb:>10.1f} MB 峰值(不含原文)")
+        del content, packet
+        mb = peak_memory(from_file)
+        print(f"{'文件流式压缩':<24}{mb:>10.1f} MB 峰值")
+
+def legacy_extract_keywords(text: str) -> List[str]:
+    """旧版关键词提取（正则 + 字典计数 + 全量排序），用作对照"""
+    words = re.findall(r'\b\w{3,}\b', text.lower())
+    stopwords = {'the', 'and', 'is', 'in', 'to', 'of', 'for', 'with', 'on', 'at'}
+    word_counts: Dict[str, int] = {}
+    for word in words:
+        if word not in stopwords:
+            word_counts[word] = word_counts.get(word, 0) + 1
+    sorted_words = sorted(word_counts.items(), key=lambda x: x[1], reverse=True)
+    return [word for word, _ in sorted_words[:5]]
+
+def bench_keywords(args: argparse.Namespace) -> None:
+    """关键词提取耗时与结果对比"""
+    text = make_cjk_text(args.size)
+    results: Dict[str, float] = {}
+    legacy: List[str] = []
+    current: List[str] = []
+    results["旧版 regex+sort"] = timed(lambda: [legacy.append(legacy_extract_keywords(text)) for _ in range(args.repeat)])
+    results["extract_keywords"] = timed(lambda: [current.append(extract_keywords(text)) for _ in range(args.repeat)])
+    report(f"关键词提取: {args.size} 字符 x {args.repeat} 次", results, args.size * args.repeat)
+    print(f"旧版结果: {legacy[0]}")
+    print(f"新版结果: {current[0]}")
+
+def legacy_detect_content_type(text: str) -> str:
+    """旧版内容类型检测（完整json.loads + 五个未编译正则全文搜索），用作对照"""
+    if text.strip().startswith('{') and text.strip().endswith('}'):
+        try:
+            json.loads(text)
+            return "json"
+        except ValueError:
+            pass
+    if text.startswith(('http://', 'https://')):
+        return "url"
+    for pattern in [r'def\s+\w+\s*\(.*\):', r'function\s+\w+\s*\(.*\)', r'class\s+\w+',
+                    r'import\s+\w+', r'<\w+>.*</\w+>']:
+        if re.search(pattern, text):
+            return "code"
+    if '?' in text and len(text) < 200:
+        return "question"
+    return "plain_text"
+
+def bench_classify(args: argparse.Namespace) -> None:
+    """内容类型检测在普通与恶意构造输入上的耗时对比"""
+    size = args.size
+    inputs = {
+        "普通中文文本": make_cjk_text(size),
+        "大型JSON": "{" + ",".join(f'"k{i}": "{make_text(20, seed=i)}"' for i in range(size // 30)) + "}",
+        "def a( 重复": "def a(" * (size // 6),
+        "function f( 重复": "function f(" * (size // 11),
+        "<a> 重复": "<a>" * (size // 3),
+    }
+    print(f"\n内容类型检测: 每种输入约 {size} 字符")
+    print("-" * 70)
+    print(f"{'输入':<20}{'旧版':>12}{'classify_content':>20}  结果")
+    for name, text in inputs.items():
+        legacy_result: List[str] = []
+        current_result: List[str] = []
+        legacy = timed(lambda: legacy_result.append(legacy_detect_content_type(text)))
+        current = timed(lambda: current_result.append(classify_content(text)))
+        print(f"{name:<20}{legacy * 1000:>10.2f}ms{current * 1000:>18.3f}ms  {legacy_result[0]} / {current_result[0]}")
+
+def legacy_self_extracting_packet(packet: EfficodePacket) -> Dict[str, Any]:
+    """旧版自解压数据包（每包内嵌解压器与语法说明，解压器中再嵌一份数据，总是重新zlib压缩），用作对照"""
+    content = packet.params["content"]
+    encoded = base64.b64encode(zlib.compress(content.encode('utf-8'), 9)).decode('utf-8')
+    return {
+        "op_code": packet.op_code,
+        "params": {
+            "compressed_data": encoded,
+            "type": packet.params.get("type", "text"),
+            "decompressor": SELF_EXTRACTING_DECOMPRESSOR_JS + f"\n// efficodeDecompress('{encoded}');",
+            "syntax_guide": EFFICODE_SYNTAX_GUIDE,
+            "original_size": len(content),
+            "compressed_size": len(encoded),
+            "compression_ratio": len(encoded) / len(content) if content else 0
+        },
+        "sender": packet.sender,
+        "timestamp": packet.timestamp,
+        "self_extracting": True
+    }
+
+def bench_selfextract(args: argparse.Namespace) -> None:
+    """自解压数据包的体积与耗时对比：旧版、按会话引用前导、复用已压缩内容"""
+    print(f"\n自解压数据包: 同一对端 {args.packets} 个数据包 x {args.size} 字符")
+    print("-" * 70)
+    print(f"{'方式':<24}{'总大小':>14}{'耗时':>14}")
+
+    def run(name: str, build: Callable[[EfficodePacket], Dict[str, Any]], packets: List[EfficodePacket]) -> None:
+        outputs: List[Dict[str, Any]] = []
+        elapsed = timed(lambda: outputs.extend(build(p) for p in packets))
+        size = sum(len(json.dumps(o, ensure_ascii=False).encode('utf-8')) for o in outputs)
+        print(f"{name:<24}{size / 1024:>12.1f}KB{elapsed * 1000:>12.1f}ms")
+
+    run("旧版 每包内嵌", legacy_self_extracting_packet, make_packets(args.packets, args.size))
+    session = PreambleSession()
+    run("前导按会话引用", lambda p: p.create_self_extracting_packet("peer", session),
+        make_packets(args.packets, args.size))
+
+    # 已经为传输压缩过的数据包：直接复用压缩字节
+    compressed = make_packets(args.packets, args.size)
+    clear_transmission_cache()
+    compress_many(compressed, max_workers=1)
+    session = PreambleSession()
+    run("前导引用+复用压缩内容", lambda p: p.create_self_extracting_packet("peer", session), compressed)
+
+class EchoAgent:
+    """回显数据包的智能体，用于排除模型调用，只测量传输开销"""
+
+    name = "echo"
+    did = "did:efficode:echo"
+    role: Dict[str, Any] = {}
+
+    def process_message(self, packet: EfficodePacket, on_chunk: Callable[[str], None] = None) -> str:
+        return packet.to_string()
+
+def bench_transport(args: argparse.Namespace) -> None:
+    """各传输方式往返一个数据包的吞吐量（并发客户端线程共享一个代理的连接池）"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    packets = make_packets(args.packets, args.size)
+    total_bytes = sum(len(p.to_string().encode('utf-8')) for p in packets)
+    print(f"\n传输往返: {args.packets} 个数据包 x {args.size} 字符, {args.clients} 个并发客户端")
+    print("-" * 70)
+    print(f"{'传输':<24}{'耗时':>12}{'数据包/秒':>14}{'吞吐量':>16}")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        transports = {
+            "inproc": InProcessTransport(),
+            "unix": UnixSocketTransport(os.path.join(tmpdir, "echo.sock")),
+            "tcp": TcpTransport("127.0.0.1", 0)
+        }
+        for name, transport in transports.items():
+            server = AgentServer(EchoAgent(), transport).start()
+            agent = RemoteAgent(transport, max_connections=args.clients)
+            with ThreadPoolExecutor(max_workers=args.clients) as executor:
+                elapsed = timed(lambda: list(executor.map(agent.process_message, packets)))
+            agent.close()
+            server.stop()
+            print(f"{name:<24}{elapsed * 1000:>10.1f}ms{args.packets / elapsed:>14.0f}"
+                  f"{total_bytes / elapsed / 1024 / 1024:>12.1f}MB/s")
+
+def bench_workers(args: argparse.Namespace) -> None:
+    """数据包优化阶段（元数据、关键词、多算法压缩）在不同工作进程数下的吞吐量与加速比"""
+    max_workers = args.max_workers or os.cpu_count() or 1
+    total_bytes = args.packets * args.size
+    print(f"\n数据包优化: {args.packets} 个数据包 x {args.size} 字符, CPU核数 {os.cpu_count()}")
+    print("-" * 70)
+    print(f"{'方式':<24}{'耗时':>12}{'吞吐量':>16}{'加速比':>12}")
+
+    clear_transmission_cache()
+    packets = make_packets(args.packets, args.size)
+    baseline = timed(lambda: [p.optimize_for_transmission() for p in packets])
+    print(f"{'本进程串行':<24}{baseline * 1000:>10.1f}ms{total_bytes / baseline / 1024 / 1024:>12.1f}MB/s{1.0:>11.2f}x")
+
+    workers = 1
+    while True:
+        pool = PacketWorkerPool(workers, offload_threshold=0)
+        pool.warm_up()
+        packets = make_packets(args.packets, args.size)
+        elapsed = timed(lambda: pool.map("optimize", packets))
+        pool.shutdown()
+        name = f"进程池 {workers} 个进程"
+        print(f"{name:<24}{elapsed * 1000:>10.1f}ms{total_bytes / elapsed / 1024 / 1024:>12.1f}MB/s"
+              f"{baseline / elapsed:>11.2f}x")
+        if workers >= max_workers:
+            break
+        workers = min(workers * 2, max_workers)
+
+class SimulatedDialogue:
+    """
+    模拟的对话管理器：按固定间隔产生chunk和message事件，用于排除模型调用，
+    只测量对话服务的连接和推送开销；所有对话等待start事件后同时开始
+    """
+
+    def __init__(self, start: threading.Event, chunks: int, chunk_size: int, interval: float):
+        self.dialogue_id = new_packet_id()
+        self.agent1 = type("Agent", (), {"name": "智谋"})()
+        self.agent2 = type("Agent", (), {"name": "慧眼"})()
+        self.conversation_history: List[Dict[str, Any]] = []
+        self.cancellation = None
+        self.profile = None
+        self.profile_report = None
+        self._start = start
+        self._chunks = chunks
+        self._chunk_text = make_cjk_text(chunk_size)
+        self._interval = interval
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        self._listeners.append(listener)
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        for listener in self._listeners:
+            listener(dict(event, dialogue_id=self.dialogue_id))
+
+    def run_auto_conversation(self, topic: str, rounds: int, **kwargs: Any) -> List[Dict[str, Any]]:
+        token = CancelToken(kwargs.get("timeout"), parent=current_token())
+        self._start.wait()
+        try:
+            for i in range(rounds * 2):
+                sender = (self.agent1, self.agent2)[i % 2].name
+                for j in range(self._chunks):
+                    token.sleep(self._interval)
+                    self._emit({"type": "chunk", "sender": sender, "text": self._chunk_text,
+                                "offset": j * len(self._chunk_text)})
+                message = {"sender": sender, "content": self._chunk_text * self._chunks,
+                           "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "seq": i}
+                self.conversation_history.append(message)
+                self._emit({"type": "message", "message": message})
+        except Cancelled as e:
+            self.cancellation = {"reason": str(e)}
+        return self.conversation_history
+
+async def _load_client(port: int, dialogue_id: str, slow_delay: float, results: Dict[str, Any]) -> None:
+    """模拟一个前端WebSocket客户端；slow_delay大于0时为慢客户端，使用很小的接收缓冲，每读一个事件等待slow_delay秒"""
+    import socket
+    import asyncio
+    from dialogue_server import read_frame, websocket_accept, OP_TEXT, OP_CLOSE
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    slow = slow_delay > 0
+    if slow:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    await loop.sock_connect(sock, ("127.0.0.1", port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((f"GET /ws?dialogue_id={dialogue_id} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in head or websocket_accept(key).encode() not in head:
+        raise RuntimeError(f"握手失败: {head[:80]!r}")
+    results["connect"].append(time.perf_counter() - started)
+    results["connected"] += 1
+    try:
+        while True:
+            _, opcode, payload = await read_frame(reader, 1 << 24)
+            if opcode == OP_CLOSE:
+                if payload[:2] == b"\x03\xf5":  # 1013: 接收过慢被断开
+                    results["disconnected"] += 1
+                return
+            if opcode != OP_TEXT:
+                continue
+            event = json.loads(payload)
+            kind = event["type"]
+            results["events"][kind] = results["events"].get(kind, 0) + 1
+            if "time" in event and not slow:
+                results["latency"].append(time.time() - event["time"])
+            if kind == "dialogue_status" and event["status"] not in ("queued", "running"):
+                return
+            if slow:
+                await asyncio.sleep(slow_delay)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        results["disconnected"] += 1
+    finally:
+        writer.close()
+
+def bench_server(args: argparse.Namespace) -> None:
+    """对话服务的WebSocket推送：大量并发客户端订阅模拟对话的事件，统计投递延迟和背压"""
+    import asyncio
+    import resource
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.request import urlopen, Request
+    from dialogue_server import DialogueServer
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = args.clients * 2 + 256
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+        if hard < needed:
+            print(f"文件描述符上限 {hard} 不足以支持 {args.clients} 个客户端")
+
+    def post(port: int, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        request = Request(f"http://127.0.0.1:{port}{path}", data=json.dumps(body).encode('utf-8'),
+                          headers={"Content-Type": "application/json"}, method="POST")
+        with urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    async def run() -> None:
+        start = threading.Event()
+        server = await DialogueServer(
+            lambda params: SimulatedDialogue(start, args.chunks, args.chunk_size, args.chunk_interval),
+            "127.0.0.1", 0, max_running=args.dialogues).start()
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            dialogues = [await loop.run_in_executor(executor, post, server.port, "/api/dialogues",
+                                                    {"topic": f"负载测试 {i}", "rounds": args.rounds})
+                         for i in range(args.dialogues)]
+        ids = [dialogue["dialogue_id"] for dialogue in dialogues]
+        results: Dict[str, Any] = {"connect": [], "connected": 0, "disconnected": 0, "events": {}, "latency": []}
+        slow_every = int(1 / args.slow) if args.slow > 0 else 0
+        clients, slow_clients = [], []
+        connect_started = time.perf_counter()
+        for i in range(args.clients):
+            slow = bool(slow_every) and i % slow_every == 0
+            client = asyncio.ensure_future(_load_client(server.port, ids[i % len(ids)],
+                                                        args.slow_delay if slow else 0.0, results))
+            (slow_clients if slow else clients).append(client)
+            if i % 100 == 99:
+                await asyncio.sleep(0)
+        everyone = clients + slow_clients
+        while results["connected"] < args.clients and not any(c.done() and c.exception() for c in everyone):
+            await asyncio.sleep(0.05)
+        connect_elapsed = time.perf_counter() - connect_started
+        run_started = time.perf_counter()
+        start.set()
+        # 正常客户端收完所有事件即结束；仍在缓慢读取的慢客户端随服务关闭而断开
+        outcomes = await asyncio.gather(*clients, return_exceptions=True)
+        run_elapsed = time.perf_counter() - run_started
+        stats = server.server_stats()
+        await server.stop()
+        for client in slow_clients:
+            client.cancel()
+        outcomes += await asyncio.gather(*slow_clients, return_exceptions=True)
+
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        latency = sorted(results["latency"]) or [0.0]
+        connect = sorted(results["connect"]) or [0.0]
+        delivered = sum(results["events"].values())
+        print(f"\n对话服务: {args.clients} 个WebSocket客户端（{slow_every and args.clients // slow_every} 个慢客户端）, "
+              f"{args.dialogues} 个对话 x {args.rounds} 轮, 每个回复 {args.chunks} 个数据块")
+        print("-" * 70)
+        print(f"建立连接: {results['connected']} 个, 耗时 {connect_elapsed * 1000:.0f}ms, "
+              f"握手 p50 {connect[len(connect) // 2] * 1000:.1f}ms / 最大 {connect[-1] * 1000:.1f}ms")
+        print(f"推送: {delivered} 个事件 {results['events']}, 耗时 {run_elapsed:.2f}s, "
+              f"{delivered / run_elapsed:.0f} 事件/秒")
+        print(f"投递延迟（正常客户端）: p50 {latency[len(latency) // 2] * 1000:.1f}ms, "
+              f"p99 {latency[int(len(latency) * 0.99)] * 1000:.1f}ms, 最大 {latency[-1] * 1000:.1f}ms")
+        print(f"背压: 丢弃数据块 {stats['dropped_chunks']} 个, 断开慢客户端 {stats['slow_disconnects']} 个, "
+              f"客户端错误 {len(errors)} 个{f'（{errors[0]!r}）' if errors else ''}")
+
+    asyncio.run(run())
+
+def bench_dialogue(args: argparse.Namespace) -> None:
+    """端到端运行run_auto_conversation：--record时调用真实API并录制，否则从存档回放（不需要网络）"""
+    import hashlib
+    import dialogue_manager
+    from api_client import ApiClient
+    from provider_pool import ProviderPool
+    from ai_agent import AIAgent
+    from api_recording import RecordingSession, ReplaySession, REPLAY_API_KEY
+
+    if args.record:
+        session = RecordingSession(args.archive)
+        client = ApiClient(ProviderPool.from_env(), session=session)
+    else:
+        session = ReplaySession(args.archive, args.speed)
+        client = ApiClient(ProviderPool.single(REPLAY_API_KEY), session=session)
+        # 步骤之间的固定间隔只是为了避免频繁调用API，与回放时序同比例缩短
+        dialogue_manager.STEP_DELAY = dialogue_manager.STEP_DELAY / args.speed if args.speed > 0 else 0
+    manager = dialogue_manager.DialogueManager(AIAgent("智谋", client=client), AIAgent("慧眼", client=client))
+    manager.profile = args.profile
+    started = time.perf_counter()
+    history = manager.run_auto_conversation(args.topic, args.rounds, pipelined=args.pipelined,
+                                            early_stop=not args.no_early_stop)
+    elapsed = time.perf_counter() - started
+    digest = hashlib.blake2b("\n".join(f"{m['sender']}:{m['content']}" for m in history).encode('utf-8'),
+                             digest_size=8).hexdigest()
+
+    mode = "录制" if args.record else f"回放 {args.speed or '不等待'}x"
+    print(f"\n端到端对话（{mode}）: 主题 {args.topic}, {args.rounds} 轮")
+    print("-" * 70)
+    print(f"耗时 {elapsed:.2f}s, 每轮 {[round(seconds, 2) for seconds in manager.round_seconds]}")
+    print(f"消息 {len(history)} 条, 内容摘要 {digest}（相同存档的回放应一致）")
+    print(f"API流量: {session.stats}")
+    if manager.profile_report:
+        report = manager.profile_report
+        print(f"剖析（{report['mode']}）: {report['subsystems']}")
+        print(f"剖析结果: {', '.join(report['files'])}")
+
+def main(argv: List[str]) -> None:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="Efficode性能基准测试")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compress_parser = subparsers.add_parser("compress", help="批量压缩吞吐量")
+    compress_parser.add_argument("--packets", type=int, default=200, help="数据包数量")
+    compress_parser.add_argument("--size", type=int, default=20000, help="每个数据包的内容长度")
+    compress_parser.add_argument("--workers", type=int, default=None, help="线程数，默认CPU核数")
+    compress_parser.set_defaults(func=bench_compress)
+
+    stream_parser = subparsers.add_parser("stream", help="大内容流式压缩峰值内存")
+    stream_parser.add_argument("--size-mb", type=int, default=50, help="内容大小（MB）")
+    stream_parser.set_defaults(func=bench_stream)
+
+    keywords_parser = subparsers.add_parser("keywords", help="关键词提取")
+    keywords_parser.add_argument("--size", type=int, default=100 * 1024, help="文本长度")
+    keywords_parser.add_argument("--repeat", type=int, default=20, help="重复次数")
+    keywords_parser.set_defaults(func=bench_keywords)
+
+    classify_parser = subparsers.add_parser("classify", help="内容类型检测")
+    classify_parser.add_argument("--size", type=int, default=20000, help="输入长度")
+    classify_parser.set_defaults(func=bench_classify)
+
+    selfextract_parser = subparsers.add_parser("selfextract", help="自解压数据包体积与耗时")
+    selfextract_parser.add_argument("--packets", type=int, default=100, help="数据包数量")
+    selfextract_parser.add_argument("--size", type=int, default=5000, help="每个数据包的内容长度")
+    selfextract_parser.set_defaults(func=bench_selfextract)
+
+    transport_parser = subparsers.add_parser("transport", help="各传输方式的往返吞吐量")
+    transport_parser.add_argument("--packets", type=int, default=2000, help="数据包数量")
+    transport_parser.add_argument("--size", type=int, default=2000, help="每个数据包的内容长度")
+    transport_parser.add_argument("--clients", type=int, default=4, help="并发客户端线程数")
+    transport_parser.set_defaults(func=bench_transport)
+
+    workers_parser = subparsers.add_parser("workers", help="工作进程池处理数据包的多核扩展性")
+    workers_parser.add_argument("--packets", type=int, default=200, help="数据包数量")
+    workers_parser.add_argument("--size", type=int, default=50000, help="每个数据包的内容长度")
+    workers_parser.add_argument("--max-workers", type=int, default=None, help="最大进程数，默认CPU核数")
+    workers_parser.set_defaults(func=bench_workers)
+
+    server_parser = subparsers.add_parser("server", help="对话服务的WebSocket并发推送（模拟对话和客户端）")
+    server_parser.add_argument("--clients", type=int, default=1000, help="WebSocket客户端数")
+    server_parser.add_argument("--dialogues", type=int, default=10, help="同时运行的对话数")
+    server_parser.add_argument("--rounds", type=int, default=3, help="每个对话的轮数")
+    server_parser.add_argument("--chunks", type=int, default=50, help="每个回复的数据块数")
+    server_parser.add_argument("--chunk-size", type=int, default=20, help="每个数据块的字符数")
+    server_parser.add_argument("--chunk-interval", type=float, default=0.01, help="数据块间隔（秒）")
+    server_parser.add_argument("--slow", type=float, default=0.02, help="慢客户端的比例")
+    server_parser.add_argument("--slow-delay", type=float, default=0.5, help="慢客户端每读一个事件等待的时间（秒）")
+    server_parser.set_defaults(func=bench_server)
+
+    dialogue_parser = subparsers.add_parser("dialogue", help="端到端自动对话（录制或离线回放API流量）")
+    dialogue_parser.add_argument("--archive", required=True, help="API流量存档路径")
+    dialogue_parser.add_argument("--record", action="store_true", help="调用真实API并录制到存档")
+    dialogue_parser.add_argument("--speed", type=float, default=1.0, help="回放时序倍数，0表示不等待")
+    dialogue_parser.add_argument("--topic", default="AI与人类的未来", help="对话主题")
+    dialogue_parser.add_argument("--rounds", type=int, default=3, help="对话轮数")
+    dialogue_parser.add_argument("--pipelined", action="store_true", help="流水线模式")
+    dialogue_parser.add_argument("--no-early-stop", action="store_true", help="关闭收敛检测")
+    dialogue_parser.add_argument("--profile", nargs="?", const="sample", choices=("sample", "cprofile"),
+                                 help="剖析对话，结果写到logs目录")
+    dialogue_parser.set_defaults(func=bench_dialogue)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
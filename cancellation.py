@@ -0,0 +1,188 @@
+"""
+截止时间与取消模块
+
+一次对话的耗时原本没有上限：每次API调用最多阻塞60秒，按Ctrl-C只能直接退出。
+这个模块提供取消令牌(CancelToken)：
+
+- 截止时间: 令牌可以有总截止时间，并可用limit()设置阶段（例如每轮）截止时间；
+  HTTP调用的超时被缩短到剩余时间，流式读取在每个事件之间检查截止时间；
+- 协作式取消: cancel()或到达截止时间时触发注册的回调（例如关闭正在读取的
+  HTTP响应），等待中的调用（调度排队、合并等待）在检查时抛出Cancelled；
+- 浪费统计: 被中止的调用已花费的时间累计在令牌（及其上级令牌）上。
+
+令牌通过cancel_scope()设置在上下文变量中，调用链上的ApiClient和RemoteAgent
+自动读取，与request_scheduler的request_context()相同。
+"""
+
+import time
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from typing import Optional, Callable, List, Iterator
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Cancellation')
+
+# 常量定义
+POLL_INTERVAL = 0.1  # 阻塞等待时检查取消的间隔（秒）
+
+_current_token: contextvars.ContextVar = contextvars.ContextVar("cancel_token", default=None)
+
+class Cancelled(Exception):
+    """操作被取消"""
+
+class DeadlineExceeded(Cancelled):
+    """操作超过截止时间"""
+
+class CancelToken:
+    """
+    取消令牌，线程安全
+
+    上级令牌被取消或超时时，下级令牌同样视为已取消。
+    """
+
+    def __init__(self, timeout: Optional[float] = None, parent: Optional['CancelToken'] = None):
+        """
+        初始化令牌
+
+        Args:
+            timeout: 从现在起的总时限（秒），None表示不限
+            parent: 上级令牌
+        """
+        self.parent = parent
+        self.created = time.monotonic()
+        self.deadline = self.created + timeout if timeout is not None else None
+        self.reason: Optional[str] = None
+        self.wasted_seconds = 0.0  # 被中止的调用已花费的时间
+        self._stage_deadline: Optional[float] = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def limit(self, timeout: Optional[float]) -> None:
+        """设置从现在起的阶段时限（不超过总时限），None表示取消阶段时限"""
+        self._stage_deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def cancel(self, reason: str = "已取消") -> None:
+        """取消令牌并调用注册的回调，重复调用无效"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"取消: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"取消回调出错: {str(e)}")
+
+    def _expired(self) -> Optional[str]:
+        """已超过的截止时间的说明，未超时为None"""
+        now = time.monotonic()
+        if self._stage_deadline is not None and now >= self._stage_deadline:
+            return "超过阶段截止时间"
+        if self.deadline is not None and now >= self.deadline:
+            return "超过截止时间"
+        return None
+
+    @property
+    def cancelled(self) -> bool:
+        """是否已取消或超时（包括上级令牌）"""
+        if self._event.is_set() or self._expired():
+            return True
+        return self.parent is not None and self.parent.cancelled
+
+    def remaining(self) -> Optional[float]:
+        """距最近截止时间的剩余秒数（包括上级令牌），没有截止时间时为None"""
+        deadlines = [d for d in (self.deadline, self._stage_deadline) if d is not None]
+        remaining = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        if self.parent is not None:
+            inherited = self.parent.remaining()
+            if inherited is not None:
+                remaining = inherited if remaining is None else min(remaining, inherited)
+        return remaining
+
+    def check(self) -> None:
+        """已取消时抛出Cancelled，已超时时抛出DeadlineExceeded"""
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+        expired = self._expired()
+        if expired:
+            raise DeadlineExceeded(expired)
+        if self.parent is not None:
+            self.parent.check()
+
+    def clamp_timeout(self, timeout: float) -> float:
+        """把一次调用的超时缩短到剩余时间；已取消或超时时抛出异常"""
+        self.check()
+        remaining = self.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def sleep(self, seconds: float) -> None:
+        """等待一段时间，取消时提前返回；之后已取消或超时则抛出异常"""
+        remaining = self.remaining()
+        self._event.wait(seconds if remaining is None else min(seconds, remaining))
+        self.check()
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        注册取消时的回调，已取消或已超时时立即调用
+
+        上级令牌被取消时同样调用；有截止时间时，到达截止时间（注册时的剩余时间）
+        也会调用一次。
+
+        Returns:
+            注销回调的函数
+        """
+        if self.cancelled:
+            callback()
+            return lambda: None
+        with self._lock:
+            self._callbacks.append(callback)
+        unregister_parent = self.parent.on_cancel(callback) if self.parent is not None else None
+        timer = None
+        remaining = self.remaining()
+        if remaining is not None:
+            timer = threading.Timer(remaining, callback)
+            timer.daemon = True
+            timer.start()
+
+        def unregister() -> None:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+            if timer is not None:
+                timer.cancel()
+            if unregister_parent is not None:
+                unregister_parent()
+        return unregister
+
+    def record_waste(self, seconds: float) -> None:
+        """记录被中止的调用已花费的时间（同时计入上级令牌）"""
+        with self._lock:
+            self.wasted_seconds += seconds
+        if self.parent is not None:
+            self.parent.record_waste(seconds)
+
+@contextmanager
+def cancel_scope(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    """在此上下文中使用指定的取消令牌，None表示沿用外层令牌"""
+    if token is None:
+        yield current_token()
+        return
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+def current_token() -> Optional[CancelToken]:
+    """当前上下文的取消令牌，未设置时为None"""
+    return _current_token.get()
@@ -0,0 +1,237 @@
+"""
+熔断器模块
+
+API服务降级时，每个对话中的每个智能体仍不断发出会在60秒后超时的请求。
+这个模块为提供方池的每个成员（一个密钥+端点）提供一个熔断器：
+
+- 关闭(closed): 正常放行，按最近的调用统计错误率和慢调用比例；
+- 打开(open): 错误率或慢调用比例超过阈值（或连续失败）时打开，期间直接拒绝，
+  不再发出请求；打开时长随连续打开次数指数增长；
+- 半开(half_open): 打开时长到期后放行少量探测请求，探测成功则关闭，失败则再次打开。
+
+每次状态变化都记入统计并通知监听者，供指标输出使用。
+"""
+
+import time
+import threading
+import logging
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable, Deque, Tuple
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Circuit_Breaker')
+
+# 常量定义
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+WINDOW_SECONDS = 60.0  # 统计错误率和慢调用比例的时间窗口（秒）
+WINDOW_SIZE = 50  # 窗口内最多保留的调用记录数
+MIN_CALLS = 5  # 窗口内调用数达到此值才按比例判断
+ERROR_RATE_THRESHOLD = 0.5  # 错误率达到此值时打开
+SLOW_CALL_SECONDS = 20.0  # 耗时达到此值的调用视为慢调用
+SLOW_RATE_THRESHOLD = 0.8  # 慢调用比例达到此值时打开
+CONSECUTIVE_FAILURES = 3  # 连续失败多少次后立即打开（不等窗口内调用数达到MIN_CALLS）
+BASE_OPEN_SECONDS = 10.0  # 首次打开时长（秒），再次打开时加倍
+MAX_OPEN_SECONDS = 300.0  # 打开时长上限（秒）
+HALF_OPEN_PROBES = 1  # 半开状态同时放行的探测请求数
+RECENT_TRANSITIONS = 20  # 保留的最近状态变化记录数
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被直接拒绝"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after  # 最早可能恢复的时间（秒）
+
+class CircuitBreaker:
+    """
+    一个成员的熔断器，线程安全
+
+    用法: allow()为True时发出请求，结束后用record()报告结果。
+    """
+
+    def __init__(self, name: str, window_seconds: float = WINDOW_SECONDS,
+                 error_rate: float = ERROR_RATE_THRESHOLD, slow_call_seconds: float = SLOW_CALL_SECONDS,
+                 slow_rate: float = SLOW_RATE_THRESHOLD, base_open_seconds: float = BASE_OPEN_SECONDS):
+        """
+        初始化熔断器
+
+        Args:
+            name: 名称（成员名称），用于日志和指标
+            window_seconds: 统计窗口（秒）
+            error_rate: 打开的错误率阈值
+            slow_call_seconds: 慢调用的耗时阈值（秒）
+            slow_rate: 打开的慢调用比例阈值
+            base_open_seconds: 首次打开时长（秒）
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.base_open_seconds = base_open_seconds
+        self.state = CLOSED
+        self.open_until = 0.0
+        self._opened_times = 0  # 连续打开次数，决定下次打开时长
+        self._consecutive_failures = 0
+        self._probes = 0  # 半开状态下进行中的探测请求数
+        self._calls: Deque[Tuple[float, bool, bool]] = deque(maxlen=WINDOW_SIZE)  # (时间, 失败, 慢调用)
+        self._listeners: List[Callable[[str, str, str, str], None]] = []
+        self._lock = threading.Lock()
+        self.transitions: Deque[Dict[str, Any]] = deque(maxlen=RECENT_TRANSITIONS)
+        self.stats = {"opened": 0, "half_opened": 0, "closed": 0, "rejected": 0, "probes": 0}
+
+    def add_listener(self, listener: Callable[[str, str, str, str], None]) -> None:
+        """注册状态变化的监听者，参数为(名称, 原状态, 新状态, 原因)"""
+        self._listeners.append(listener)
+
+    def _transition(self, state: str, reason: str, now: float) -> Callable[[], None]:
+        """切换状态（调用方持有锁），返回在锁外通知监听者的函数"""
+        previous, self.state = self.state, state
+        self.stats[{OPEN: "opened", HALF_OPEN: "half_opened", CLOSED: "closed"}[state]] += 1
+        self.transitions.append({"time": time.time(), "from": previous, "to": state, "reason": reason})
+        listeners = list(self._listeners)
+
+        def notify() -> None:
+            log = logger.info if state == CLOSED else logger.warning
+            log(f"熔断器 {self.name}: {previous} -> {state}（{reason}）")
+            for listener in listeners:
+                try:
+                    listener(self.name, previous, state, reason)
+                except Exception as e:
+                    logger.warning(f"熔断器监听者出错: {str(e)}")
+        return notify
+
+    def _open(self, reason: str, now: float) -> Callable[[], None]:
+        duration = min(self.base_open_seconds * (2 ** self._opened_times), MAX_OPEN_SECONDS)
+        self.open_until = now + duration
+        self._opened_times += 1
+        self._consecutive_failures = 0
+        self._probes = 0
+        return self._transition(OPEN, f"{reason}，{duration:.0f} 秒后探测", now)
+
+    def _refresh(self, now: float) -> Optional[Callable[[], None]]:
+        """打开时长到期时转为半开（调用方持有锁）"""
+        if self.state == OPEN and now >= self.open_until:
+            return self._transition(HALF_OPEN, "打开时长到期", now)
+        return None
+
+    def available(self, now: Optional[float] = None) -> bool:
+        """是否可以放行请求（不占用探测名额）"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            notify = self._refresh(now)
+            result = self.state == CLOSED or (self.state == HALF_OPEN and self._probes < HALF_OPEN_PROBES)
+        if notify:
+            notify()
+        return result
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """
+        请求放行检查，半开状态下占用一个探测名额
+
+        Returns:
+            是否放行；不放行时计入rejected
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            notify = self._refresh(now)
+            if self.state == CLOSED:
+                allowed = True
+            elif self.state == HALF_OPEN and self._probes < HALF_OPEN_PROBES:
+                self._probes += 1
+                self.stats["probes"] += 1
+                allowed = True
+            else:
+                self.stats["rejected"] += 1
+                allowed = False
+        if notify:
+            notify()
+        return allowed
+
+    def count_rejected(self) -> None:
+        """记录一次因熔断被直接拒绝的请求"""
+        with self._lock:
+            self.stats["rejected"] += 1
+
+    def retry_after(self, now: Optional[float] = None) -> float:
+        """距可以再次放行的秒数（半开状态下探测名额已满时为0）"""
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.open_until - now) if self.state == OPEN else 0.0
+
+    def record(self, success: bool, latency: Optional[float] = None) -> None:
+        """
+        报告一次调用的结果
+
+        Args:
+            success: 是否成功（连接失败、超时、服务端错误、密钥失效为失败）
+            latency: 耗时（秒），达到slow_call_seconds视为慢调用
+        """
+        now = time.monotonic()
+        slow = latency is not None and latency >= self.slow_call_seconds
+        notify = None
+        with self._lock:
+            self._calls.append((now, not success, slow))
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if success and not slow:
+                    self._opened_times = 0
+                    self._calls.clear()
+                    notify = self._transition(CLOSED, "探测成功", now)
+                else:
+                    notify = self._open("探测失败" if not success else "探测仍为慢调用", now)
+            elif self.state == CLOSED:
+                self._consecutive_failures = 0 if success else self._consecutive_failures + 1
+                reason = self._trip_reason(now)
+                if reason:
+                    notify = self._open(reason, now)
+        if notify:
+            notify()
+
+    def discard(self) -> None:
+        """调用被调用方中止，不计入统计，只归还半开状态下占用的探测名额"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def _trip_reason(self, now: float) -> Optional[str]:
+        """关闭状态下是否应打开（调用方持有锁）"""
+        if self._consecutive_failures >= CONSECUTIVE_FAILURES:
+            return f"连续失败 {self._consecutive_failures} 次"
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+        total = len(self._calls)
+        if total < MIN_CALLS:
+            return None
+        failures = sum(1 for _, failed, _ in self._calls if failed)
+        slow = sum(1 for _, _, is_slow in self._calls if is_slow)
+        if failures / total >= self.error_rate:
+            return f"错误率 {failures}/{total}"
+        if slow / total >= self.slow_rate:
+            return f"慢调用 {slow}/{total}"
+        return None
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """获取状态和指标"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            notify = self._refresh(now)
+            calls = [call for call in self._calls if now - call[0] <= self.window_seconds]
+            result = {
+                "state": self.state,
+                "retry_after": round(self.retry_after(now), 3),
+                "window_calls": len(calls),
+                "error_rate": round(sum(1 for _, failed, _ in calls if failed) / len(calls), 3) if calls else 0.0,
+                "slow_rate": round(sum(1 for _, _, slow in calls if slow) / len(calls), 3) if calls else 0.0,
+                "transitions": list(self.transitions),
+                **self.stats
+            }
+        if notify:
+            notify()
+        return result
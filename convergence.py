@@ -0,0 +1,172 @@
+"""
+对话收敛检测模块
+
+自动对话往往在达到轮数上限之前就开始围绕几乎相同的问题打转。这个模块为每轮
+计算新颖度：每条发言的词集合（中文为二元组或分词结果）计算MinHash签名，与同一
+发言者最近若干条发言的签名估算Jaccard相似度，新颖度为1减去最高相似度（窗口大小
+固定，每轮的开销与对话长度无关）。新颖度连续过低时，停止策略先引导对话换一个
+角度，仍无改善则提前结束对话，节省后续的API调用。
+"""
+
+import random
+import hashlib
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Any, List, Tuple, Sequence, Deque
+
+from efficode_keywords import count_terms
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Convergence')
+
+# 常量定义
+MINHASH_PERMUTATIONS = 64  # 签名长度，相似度估计的标准误约为 0.5/sqrt(64) ≈ 0.06
+NOVELTY_WINDOW = 8  # 每个发言者参与比较的最近发言数
+NOVELTY_THRESHOLD = 0.35  # 低于此新颖度（即与近期某条发言的相似度高于0.65）的轮次视为重复
+STOP_PATIENCE = 2  # 连续多少轮重复后触发停止策略
+MAX_REDIRECTS = 1  # 提前结束前最多引导换角度的次数
+
+CONTINUE = "continue"
+REDIRECT = "redirect"
+STOP = "stop"
+
+REDIRECT_HINT = "\n\n（系统提示：最近几轮讨论开始重复，请跳出已经讨论过的内容，从一个全新的角度继续。）"
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# 固定种子，使同一文本在不同进程中的签名一致
+_seed_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_seed_rng.randrange(1, _MERSENNE_PRIME), _seed_rng.randrange(_MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+
+@lru_cache(maxsize=65536)
+def _term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def minhash(text: str) -> Tuple[int, ...]:
+    """
+    计算文本词集合的MinHash签名
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        签名，文本中没有有效的词时为空元组
+    """
+    hashes = [_term_hash(term) for term in count_terms(text)]
+    if not hashes:
+        return ()
+    return tuple(min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS)
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    """由两个签名估算词集合的Jaccard相似度"""
+    if not a or not b:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+class NoveltyTracker:
+    """按发言者记录最近发言的MinHash签名，计算新发言的新颖度"""
+
+    def __init__(self, window: int = NOVELTY_WINDOW):
+        self.window = window
+        self._recent: Dict[str, Deque[Tuple[int, ...]]] = {}
+
+    def observe(self, speaker: str, text: str) -> float:
+        """
+        记录一条发言并返回其新颖度
+
+        Args:
+            speaker: 发言者
+            text: 发言内容
+
+        Returns:
+            新颖度，0表示与最近某条发言几乎相同，1表示完全不同；发言者的首条发言为1
+        """
+        signature = minhash(text)
+        recent = self._recent.setdefault(speaker, deque(maxlen=self.window))
+        novelty = 1.0 - max((similarity(signature, previous) for previous in recent), default=0.0)
+        recent.append(signature)
+        return novelty
+
+class ConvergencePolicy:
+    """
+    对话收敛的停止策略
+
+    每轮调用observe_round()，返回CONTINUE、REDIRECT（调用方用redirect()给下一条
+    消息加上换角度的提示）或STOP（调用方结束对话）。
+    """
+
+    def __init__(self, threshold: float = NOVELTY_THRESHOLD, patience: int = STOP_PATIENCE,
+                 max_redirects: int = MAX_REDIRECTS, window: int = NOVELTY_WINDOW):
+        """
+        初始化停止策略
+
+        Args:
+            threshold: 新颖度阈值，低于此值的轮次视为重复
+            patience: 连续多少轮重复后触发引导或停止
+            max_redirects: 提前结束前最多引导的次数，0表示直接结束
+            window: 每个发言者参与比较的最近发言数
+        """
+        self.threshold = threshold
+        self.patience = patience
+        self.max_redirects = max_redirects
+        self.tracker = NoveltyTracker(window)
+        self.novelty: List[float] = []
+        self.redirects = 0
+        self.stopped = False
+        self._low_streak = 0
+
+    def observe_round(self, turns: Sequence[Tuple[str, str]]) -> str:
+        """
+        记录一轮发言并决定下一步
+
+        Args:
+            turns: 本轮的(发言者, 内容)列表
+
+        Returns:
+            CONTINUE、REDIRECT或STOP
+        """
+        scores = [self.tracker.observe(speaker, text) for speaker, text in turns if text]
+        novelty = sum(scores) / len(scores) if scores else 1.0
+        self.novelty.append(novelty)
+        self._low_streak = self._low_streak + 1 if novelty < self.threshold else 0
+        if self._low_streak < self.patience:
+            return CONTINUE
+
+        self._low_streak = 0
+        if self.redirects < self.max_redirects:
+            self.redirects += 1
+            logger.info(f"第 {len(self.novelty)} 轮新颖度 {novelty:.2f}，引导对话换一个角度")
+            return REDIRECT
+        self.stopped = True
+        logger.info(f"第 {len(self.novelty)} 轮新颖度 {novelty:.2f}，对话已收敛，提前结束")
+        return STOP
+
+    @staticmethod
+    def redirect(content: str) -> str:
+        """给下一条消息加上换角度的提示"""
+        return content + REDIRECT_HINT
+
+    def report(self, planned_rounds: int) -> Dict[str, Any]:
+        """
+        生成收敛报告
+
+        Args:
+            planned_rounds: 计划的轮数
+
+        Returns:
+            实际轮数、节省的轮数、引导次数和每轮新颖度
+        """
+        rounds_run = len(self.novelty)
+        return {
+            "planned_rounds": planned_rounds,
+            "rounds_run": rounds_run,
+            "rounds_saved": max(0, planned_rounds - rounds_run) if self.stopped else 0,
+            "stopped_early": self.stopped,
+            "redirects": self.redirects,
+            "novelty": [round(score, 3) for score in self.novelty]
+        }
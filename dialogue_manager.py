@@ -8,7 +8,12 @@ import os
 import json
 import time
 import logging
-from typing import Dict, List, Optional, Tuple, cast
+import threading
+import itertools
+import contextvars
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional, Tuple, Any, Union, Callable, Iterator, cast
 from datetime import datetime
 
 from efficode_core import (
@@ -19,6 +24,15 @@ from efficode_core import (
     create_ack_packet
 )
 from ai_agent import AIAgent
+from efficode_transport import RemoteAgent
+from convergence import ConvergencePolicy, REDIRECT, STOP
+from request_scheduler import request_context, current_priority, get_default_scheduler
+from cancellation import Cancelled, DeadlineExceeded, CancelToken, cancel_scope, current_token
+from circuit_breaker import CircuitOpenError
+from auth_sessions import SessionTable, authenticate_group, get_default_session_table
+from packet_identity import new_packet_id, SequenceCounter
+from efficode_keywords import extract_keywords, count_terms
+from profiling import DialogueProfiler, attach_thread
 
 # 配置日志
 logging.basicConfig(
@@ -27,41 +41,221 @@ logging.basicConfig(
 )
 logger = logging.getLogger('Dialogue_Manager')
 
+# 流水线模式：回答流式生成时，提问者基于回答前缀提前起草下一个问题
+DRAFT_TRIGGER_CHARS = (300, 800, 1500)  # 回答达到这些长度时各起草一次
+DRAFT_MIN_COVERAGE = 0.6  # 草稿所基于的前缀至少占最终回答的比例
+DRAFT_MAX_NOVEL_KEYWORDS = 1  # 最终回答的关键词中，前缀里未出现的最多允许几个
+STEP_DELAY = 2  # 串行模式下每个步骤之间的间隔（秒），避免频繁API调用
+CIRCUIT_MIN_PAUSE = 1.0  # API熔断时对话每次暂停的最短时间（秒）
+CIRCUIT_MAX_PAUSE = 600.0  # 一次调用因熔断累计暂停超过此时间（秒）时结束对话
+
+class _QuestionDrafts:
+    """
+    一轮回答期间的推测性提问草稿
+
+    回答每增长到一个触发长度，就在后台线程里让提问者基于当前前缀起草问题
+    （不写入提问者的上下文）。回答结束后，选用覆盖最终回答足够多、且没有
+    遗漏主要关键词的最新草稿；未被选用的草稿的令牌计为浪费。
+    """
+
+    def __init__(self, questioner: Union[AIAgent, RemoteAgent], answerer_name: str, executor: ThreadPoolExecutor,
+                 stats: Dict[str, Any], stats_lock: threading.Lock):
+        self.questioner = questioner
+        self.answerer_name = answerer_name
+        self.executor = executor
+        self.stats = stats
+        self.stats_lock = stats_lock
+        self.text_parts: List[str] = []
+        self.length = 0
+        self.drafts: List[Tuple[str, Future, Dict[str, Any]]] = []  # (前缀, 草稿, 令牌用量)
+        self._triggers = list(DRAFT_TRIGGER_CHARS)
+
+    def on_chunk(self, text: str) -> None:
+        """回答的流式回调：达到触发长度时起草问题"""
+        self.text_parts.append(text)
+        self.length += len(text)
+        while self._triggers and self.length >= self._triggers[0]:
+            self._triggers.pop(0)
+            prefix = "".join(self.text_parts)
+            usage: Dict[str, Any] = {}
+            packet = EfficodePacket("DATA", {"content": prefix, "type": "answer"}, self.answerer_name)
+            # 草稿线程沿用当前对话的请求类别和公平排队标识
+            future = self.executor.submit(contextvars.copy_context().run, self._draft, packet, usage)
+            self.drafts.append((prefix, future, usage))
+            with self.stats_lock:
+                self.stats["drafts"] += 1
+            logger.info(f"{self.questioner.name} 基于 {len(prefix)} 字的回答前缀起草问题")
+
+    def _draft(self, packet: EfficodePacket, usage: Dict[str, Any]) -> Optional[str]:
+        """在草稿线程中起草问题，对话开启剖析时该线程一并剖析"""
+        with attach_thread():
+            return self.questioner.send_message(packet, None, False, usage)
+
+    def _matches(self, prefix: str, answer: str) -> bool:
+        """检查基于前缀的草稿是否适用于最终回答"""
+        if not answer or len(prefix) / len(answer) < DRAFT_MIN_COVERAGE:
+            return False
+        prefix_terms = count_terms(prefix)
+        novel = [keyword for keyword in extract_keywords(answer) if keyword not in prefix_terms]
+        return len(novel) <= DRAFT_MAX_NOVEL_KEYWORDS
+
+    def resolve(self) -> Optional[Tuple[str, str]]:
+        """
+        回答结束后选择草稿
+
+        Returns:
+            (草稿响应, 草稿所基于的前缀)，没有可用草稿时返回None
+        """
+        answer = "".join(self.text_parts)
+        chosen = None
+        for prefix, future, _ in reversed(self.drafts):
+            if self._matches(prefix, answer):
+                try:
+                    response = future.result()
+                except CircuitOpenError:
+                    continue
+                if response and not response.startswith("!ERROR"):
+                    chosen = (response, prefix, future)
+                    break
+
+        for prefix, future, usage in self.drafts:
+            if chosen is not None and future is chosen[2]:
+                continue
+            future.add_done_callback(lambda _, usage=usage: self._record_waste(usage))
+
+        with self.stats_lock:
+            self.stats["accepted" if chosen else "rejected_rounds"] += 1
+        return (chosen[0], chosen[1]) if chosen else None
+
+    def discard(self) -> None:
+        """放弃所有草稿（对话提前结束或需要引导换角度时）"""
+        for _, future, usage in self.drafts:
+            future.add_done_callback(lambda _, usage=usage: self._record_waste(usage))
+        with self.stats_lock:
+            self.stats["rejected_rounds"] += 1
+
+    def _record_waste(self, usage: Dict[str, Any]) -> None:
+        """记录未被选用的草稿消耗的令牌"""
+        with self.stats_lock:
+            self.stats["wasted_drafts"] += 1
+            self.stats["wasted_tokens"] += usage.get("total_tokens", 0)
+
 class DialogueManager:
     """对话管理类，负责处理和记录AI智能体之间的对话"""
     
-    def __init__(self, agent1: AIAgent, agent2: AIAgent):
+    def __init__(self, agent1: Union[AIAgent, RemoteAgent], agent2: Union[AIAgent, RemoteAgent],
+                 sessions: Optional[SessionTable] = None):
         """
         初始化对话管理器
         
         Args:
-            agent1: 第一个AI智能体
+            agent1: 第一个AI智能体（本进程的AIAgent，或运行在工作进程中的RemoteAgent代理）
             agent2: 第二个AI智能体
+            sessions: 身份验证会话表，默认使用进程级共享的会话表（会话跨对话和管理器复用）
         """
         self.agent1 = agent1
         self.agent2 = agent2
+        self.sessions = sessions or get_default_session_table()
         self.conversation_history: List[Dict[str, str]] = []
         self.logs_dir = "logs"
+        self.dialogue_id = new_packet_id()
+        self._sequence = SequenceCounter()
+        self.round_seconds: List[float] = []  # 每轮的耗时（秒）
+        self.speculation_stats: Optional[Dict[str, Any]] = None  # 流水线模式的草稿统计
+        self._reasoning_baseline: Dict[str, int] = {}  # 对话开始时各智能体已剥离的推理令牌数
+        self.convergence_report: Optional[Dict[str, Any]] = None  # 收敛检测报告（每轮新颖度、节省的轮数）
+        self.cancel_token = CancelToken()  # 当前对话的取消令牌，cancel()可从其他线程中止对话
+        self.cancellation: Optional[Dict[str, Any]] = None  # 对话被取消、超时或中断时的记录
+        self.round_timeouts: List[float] = []  # 交互模式中超时跳过的每轮已花费的时间（秒）
+        self.circuit_pauses = {"pauses": 0, "seconds": 0.0}  # API熔断导致的暂停
+        self._round_started: Optional[float] = None
+        self._stats_lock = threading.Lock()
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []  # 对话事件（消息、流式数据块）的监听者
+        self.profile: Optional[str] = None  # 性能剖析模式（sample或cprofile），设置后剖析每次对话
+        self.profile_report: Optional[Dict[str, Any]] = None  # 上次对话的剖析报告（输出文件、各子系统耗时）
+        self.saved_path: Optional[str] = None  # 上次对话保存的对话记录文件
         
         # 确保日志目录存在
         if not os.path.exists(self.logs_dir):
             os.makedirs(self.logs_dir)
             logger.info(f"创建日志目录: {self.logs_dir}")
     
-    def run_auto_conversation(self, topic: str, rounds: int = 5, user_input: Optional[str] = None) -> List[Dict[str, str]]:
+    def run_auto_conversation(self, topic: str, rounds: int = 5, user_input: Optional[str] = None,
+                              pipelined: bool = False, early_stop: bool = True, timeout: Optional[float] = None,
+                              round_timeout: Optional[float] = None) -> List[Dict[str, str]]:
         """
         运行自动对话模式 - 一问一答式高认知探索
         
         Args:
             topic: 对话主题
-            rounds: 对话轮数
+            rounds: 对话轮数（上限）
             user_input: 用户输入（可选）
+            pipelined: 流水线模式，回答流式生成的同时提问者基于回答前缀提前起草下一个问题
+            early_stop: 问答连续高度重复时先引导换角度，仍重复则提前结束
+            timeout: 整个对话的时限（秒），超时后中止进行中的调用并保存已完成的部分
+            round_timeout: 每轮的时限（秒）
             
         Returns:
             对话历史记录
         """
-        logger.info(f"开始自动对话, 主题: {topic}, 轮数: {rounds}")
         self.conversation_history = []
+        self._start_dialogue(timeout)
+        # API请求按自动对话类别（批量运行时沿用batch）排队，同类别内按对话公平分配
+        with self._profiling("exploration"), request_context(current_priority() or "auto", self.dialogue_id), \
+                cancel_scope(self.cancel_token):
+            return self._run_auto_conversation(topic, rounds, user_input, pipelined, early_stop, round_timeout)
+    
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        注册对话事件的监听者，在对话线程中调用，应尽快返回
+        
+        事件:
+            {"type": "message", "dialogue_id": ..., "message": {...}}  记录一条消息（与conversation_history中的相同）
+            {"type": "chunk", "dialogue_id": ..., "sender": ..., "text": ..., "offset": ...}  回复内容的一段，
+            offset为这段之前该回复已流式输出的字符数；有监听者时智能体调用以流式方式进行
+        """
+        self._listeners.append(listener)
+    
+    def _emit(self, event: Dict[str, Any]) -> None:
+        """通知监听者，监听者出错不影响对话"""
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"对话事件监听者出错: {str(e)}")
+    
+    @contextlib.contextmanager
+    def _profiling(self, mode: str) -> Iterator[None]:
+        """设置了profile时剖析本次对话，结束后把剖析结果写到对话记录旁边"""
+        if not self.profile:
+            yield
+            return
+        profiler = DialogueProfiler(self.profile)
+        try:
+            with profiler:
+                yield
+        finally:
+            if self.saved_path:
+                base = os.path.splitext(self.saved_path)[0]
+            else:
+                base = f"{self.logs_dir}/dialogue_{mode}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.profile_report = profiler.write(base, title=f"对话 {self.dialogue_id}")
+    
+    def cancel(self, reason: str = "已取消") -> None:
+        """从其他线程取消进行中的对话：中止进行中的API调用，对话保存已完成的部分后返回"""
+        self.cancel_token.cancel(reason)
+    
+    def _run_auto_conversation(self, topic: str, rounds: int, user_input: Optional[str],
+                               pipelined: bool, early_stop: bool,
+                               round_timeout: Optional[float]) -> List[Dict[str, str]]:
+        """自动对话的主体，参数见run_auto_conversation"""
+        logger.info(f"开始自动对话, 主题: {topic}, 轮数: {rounds}{'，流水线模式' if pipelined else ''}")
+        executor: Optional[ThreadPoolExecutor] = None
+        if pipelined:
+            self.speculation_stats = {"drafts": 0, "accepted": 0, "rejected_rounds": 0,
+                                      "wasted_drafts": 0, "wasted_tokens": 0}
+            executor = ThreadPoolExecutor(max_workers=len(DRAFT_TRIGGER_CHARS), thread_name_prefix="question-draft")
+        policy = ConvergencePolicy() if early_stop else None
         
         try:
             # 身份验证
@@ -92,124 +286,184 @@ class DialogueManager:
             initial_message = user_input if user_input is not None else f"关于'{topic}'的探索和思考"
             
             # 创建初始主题请求 - 普通文本，不加密
-            initial_packet = create_request_packet(
+            initial_packet = self._stamp_packet(create_request_packet(
                 content=initial_message,
                 req_type="exploration",
                 sender="用户"
-            )
+            ))
             
             # 记录初始消息
             print(f"\n[用户]: {initial_message}")
-            self._record_message("用户", initial_message)
+            self._record_message("用户", initial_message, initial_packet)
             
             # 发送到提问者，让其生成第一个问题
             print(f"\n[系统] {questioner.name} 正在思考第一个问题...")
             # API会返回加密的Efficode格式消息
-            encrypted_response = questioner.process_message(initial_packet)
+            encrypted_response = self._process(questioner, initial_packet)
             
             if not encrypted_response:
                 print(f"{questioner.name} 无法生成问题，对话终止")
                 return self.conversation_history
                 
             # 将字符串响应解析为EfficodePacket对象
-            first_question_packet = EfficodePacket.from_string(encrypted_response, questioner.name)
+            first_question_packet = self._stamp_packet(EfficodePacket.from_string(encrypted_response, questioner.name))
             
             # 解压并显示第一个问题
             first_question_packet = first_question_packet.decompress_content()
             if first_question_packet.op_code == "REQ" and "content" in first_question_packet.params:
                 question = first_question_packet.params.get("content", "")
                 print(f"\n[{questioner.name}]: {question}")
-                self._record_message(questioner.name, question)
+                self._record_message(questioner.name, question, first_question_packet)
             else:
                 question = first_question_packet.to_string()
                 print(f"\n[{questioner.name}]: {question}")
-                self._record_message(questioner.name, question)
+                self._record_message(questioner.name, question, first_question_packet)
             
             # 当前处理中的消息
             current_packet = first_question_packet
             
             # 进行对话轮次
             for i in range(rounds):
+                self._begin_round(round_timeout)
                 # 间隔一段时间再继续，避免频繁API调用
-                time.sleep(2)
+                self.cancel_token.sleep(STEP_DELAY)
                 
                 # 答案阶段: 回答者处理问题并给出回答
                 print(f"\n[系统] {answerer.name} 正在思考回答...")
+                # 流水线模式下回答流式返回，提问者同时起草下一个问题（最后一轮不需要）
+                drafts = None
+                if executor is not None and i < rounds - 1:
+                    drafts = _QuestionDrafts(questioner, answerer.name, executor,
+                                             self.speculation_stats, self._stats_lock)
                 # API会返回加密的Efficode格式消息
-                encrypted_answer = answerer.process_message(current_packet)
+                encrypted_answer = self._process(answerer, current_packet,
+                                                 on_chunk=drafts.on_chunk if drafts else None)
                 
                 if not encrypted_answer:
                     print(f"{answerer.name} 无法生成回答，对话终止")
                     break
                 
                 # 解析响应
-                answer_packet = EfficodePacket.from_string(encrypted_answer, answerer.name)
+                answer_packet = self._stamp_packet(EfficodePacket.from_string(encrypted_answer, answerer.name))
                 
                 # 解压并显示回答
                 answer_packet = answer_packet.decompress_content()
                 if answer_packet.op_code == "DATA" and "content" in answer_packet.params:
                     answer = answer_packet.params.get("content", "")
                     print(f"\n[{answerer.name}]: {answer}")
-                    self._record_message(answerer.name, answer)
+                    self._record_message(answerer.name, answer, answer_packet)
                 else:
                     answer = answer_packet.to_string()
                     print(f"\n[{answerer.name}]: {answer}")
-                    self._record_message(answerer.name, answer)
+                    self._record_message(answerer.name, answer, answer_packet)
+                
+                # 收敛检测: 本轮问答与近几轮高度重复时引导换角度或提前结束
+                action = policy.observe_round([(questioner.name, question), (answerer.name, answer)]) if policy else None
+                if action == STOP and i < rounds - 1:
+                    print(f"\n[系统] 最近几轮问答高度重复，对话已收敛，提前结束（节省 {rounds - i - 1} 轮）")
+                    if drafts:
+                        drafts.discard()
+                    self._finish_round()
+                    break
                 
                 # 如果已经是最后一轮，则结束对话
                 if i == rounds - 1:
+                    self._finish_round()
                     break
                 
-                # 间隔一段时间再继续
-                time.sleep(2)
+                if action == REDIRECT:
+                    # 草稿基于重复的方向起草，不再采用；提示提问者换一个角度
+                    print(f"\n[系统] 最近几轮问答开始重复，引导 {questioner.name} 换一个角度")
+                    if drafts:
+                        drafts.discard()
+                        drafts = None
+                    if isinstance(answer_packet.params.get("content"), str):
+                        answer_packet.params["content"] = policy.redirect(answer_packet.params["content"])
                 
-                # 提问阶段: 提问者基于回答生成新的问题
-                print(f"\n[系统] {questioner.name} 正在思考下一个问题...")
-                # API会返回加密的Efficode格式消息
-                encrypted_question = questioner.process_message(answer_packet)
+                # 提问阶段: 优先采用与最终回答相符的草稿，否则提问者基于完整回答生成新的问题
+                draft = drafts.resolve() if drafts else None
+                if draft:
+                    encrypted_question = draft[0]
+                    print(f"\n[系统] {questioner.name} 已基于回答前缀提前拟好下一个问题")
+                else:
+                    # 间隔一段时间再继续
+                    self.cancel_token.sleep(STEP_DELAY)
+                    print(f"\n[系统] {questioner.name} 正在思考下一个问题...")
+                    # API会返回加密的Efficode格式消息
+                    encrypted_question = self._process(questioner, answer_packet)
                 
                 if not encrypted_question:
                     print(f"{questioner.name} 无法生成问题，对话终止")
                     break
                 
                 # 解析响应
-                question_packet = EfficodePacket.from_string(encrypted_question, questioner.name)
+                question_packet = self._stamp_packet(EfficodePacket.from_string(encrypted_question, questioner.name))
                 
                 # 解压并显示新问题
                 question_packet = question_packet.decompress_content()
                 if question_packet.op_code == "REQ" and "content" in question_packet.params:
                     question = question_packet.params.get("content", "")
                     print(f"\n[{questioner.name}]: {question}")
-                    self._record_message(questioner.name, question)
+                    self._record_message(questioner.name, question, question_packet)
                 else:
                     question = question_packet.to_string()
                     print(f"\n[{questioner.name}]: {question}")
-                    self._record_message(questioner.name, question)
+                    self._record_message(questioner.name, question, question_packet)
+                
+                if draft:
+                    # 草稿调用没有写入上下文，采用后以完整回答补记
+                    questioner.commit_exchange(answer, question)
                 
                 # 更新当前处理的消息
                 current_packet = question_packet
+                self._finish_round()
             
             print("\n==== 高认知探索对话结束 ====")
+            if policy:
+                self.convergence_report = policy.report(rounds)
+            
+            # 等待仍在进行的草稿结束，使浪费的令牌统计完整
+            if executor is not None:
+                executor.shutdown(wait=True)
+            self._print_timing_report()
             
             # 保存对话历史
             self._save_conversation("exploration")
             
+        except (Cancelled, KeyboardInterrupt) as e:
+            self._abort(e, "exploration")
+            if isinstance(e, KeyboardInterrupt):
+                raise
         except Exception as e:
             logger.error(f"自动对话过程中出错: {str(e)}")
             logger.exception("详细错误信息")
             print(f"\n对话过程中发生错误: {str(e)}")
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
         
         return self.conversation_history
     
-    def run_interactive_conversation(self) -> List[Dict[str, str]]:
+    def run_interactive_conversation(self, round_timeout: Optional[float] = None) -> List[Dict[str, str]]:
         """
         运行交互式对话模式
         
+        Args:
+            round_timeout: 每轮（用户的一条消息及两个智能体的回复）的时限（秒），超时的一轮被跳过
+            
         Returns:
             对话历史记录
         """
-        logger.info("开始交互式对话")
         self.conversation_history = []
+        self._start_dialogue()
+        # 用户在等待回复，API请求优先于后台的自动和批量对话
+        with self._profiling("interactive"), request_context("interactive", self.dialogue_id), \
+                cancel_scope(self.cancel_token):
+            return self._run_interactive_conversation(round_timeout)
+    
+    def _run_interactive_conversation(self, round_timeout: Optional[float]) -> List[Dict[str, str]]:
+        """交互式对话的主体"""
+        logger.info("开始交互式对话")
         
         try:
             # 身份验证
@@ -228,64 +482,25 @@ class DialogueManager:
                 if user_input.lower() in ['exit', 'quit']:
                     break
                 
-                # 记录用户消息
-                self._record_message("用户", user_input)
-                
-                # 创建请求包 - 普通文本，不加密
-                user_packet = create_request_packet(
-                    content=user_input,
-                    req_type="dialogue",
-                    sender="用户"
-                )
-                
-                # 发送给第一个智能体
-                print(f"\n[系统] {self.agent1.name} 正在思考...")
-                # API会返回加密的Efficode格式消息
-                encrypted_response1 = self.agent1.process_message(user_packet)
-                
-                if encrypted_response1:
-                    # 解析响应
-                    agent1_response = EfficodePacket.from_string(encrypted_response1, self.agent1.name)
-                    
-                    # 解压并显示回答
-                    agent1_response = agent1_response.decompress_content()
-                    if agent1_response.op_code == "DATA" and "content" in agent1_response.params:
-                        agent1_message = agent1_response.params.get("content", "")
-                        print(f"\n[{self.agent1.name}]: {agent1_message}")
-                        self._record_message(self.agent1.name, agent1_message)
-                        
-                        # 发送给第二个智能体
-                        print(f"\n[系统] {self.agent2.name} 正在思考...")
-                        # API会返回加密的Efficode格式消息
-                        encrypted_response2 = self.agent2.process_message(agent1_response)
-                        if encrypted_response2:
-                            # 解析响应
-                            agent2_response = EfficodePacket.from_string(encrypted_response2, self.agent2.name)
-                            
-                            # 解压并显示回答
-                            agent2_response = agent2_response.decompress_content()
-                            if agent2_response.op_code == "DATA" and "content" in agent2_response.params:
-                                agent2_message = agent2_response.params.get("content", "")
-                                print(f"\n[{self.agent2.name}]: {agent2_message}")
-                                self._record_message(self.agent2.name, agent2_message)
-                            else:
-                                message = agent2_response.to_string()
-                                print(f"\n[{self.agent2.name}]: {message}")
-                                self._record_message(self.agent2.name, message)
-                        else:
-                            print(f"\n{self.agent2.name} 无法处理消息")
-                    else:
-                        message = agent1_response.to_string()
-                        print(f"\n[{self.agent1.name}]: {message}")
-                        self._record_message(self.agent1.name, message)
-                else:
-                    print(f"\n{self.agent1.name} 无法处理您的请求。请重试。")
+                self._begin_round(round_timeout)
+                try:
+                    self._interactive_round(user_input)
+                except DeadlineExceeded as e:
+                    wasted = self._finish_round(completed=False)
+                    self.round_timeouts.append(round(wasted, 3))
+                    print(f"\n[系统] 本轮{e}（已花费 {wasted:.1f} 秒），已跳过，请重试或换一个问题。")
+                    continue
+                self._finish_round()
             
             print("\n=== 对话结束 ===\n")
             
             # 保存对话历史
             self._save_conversation("interactive")
             
+        except (Cancelled, KeyboardInterrupt) as e:
+            self._abort(e, "interactive")
+            if isinstance(e, KeyboardInterrupt):
+                raise
         except Exception as e:
             logger.error(f"交互式对话过程中出错: {str(e)}")
             logger.exception("详细错误信息")
@@ -293,57 +508,226 @@ class DialogueManager:
         
         return self.conversation_history
     
-    def _authenticate_agents(self) -> bool:
-        """身份验证过程"""
-        try:
-            logger.info("开始身份验证...")
-            
-            # Agent1 向 Agent2 发送身份验证
-            auth_packet1 = EfficodePacket(
-                op_code="DID",
-                params={"value": self.agent1.did},
-                sender=self.agent1.name
-            )
-            response1_str = self.agent2.process_message(auth_packet1)
-            if response1_str:
-                # 将字符串响应解析为EfficodePacket
-                response1 = EfficodePacket.from_string(response1_str, self.agent2.name)
-                if response1.op_code == "ACK":
-                    logger.info(f"{self.agent1.name} 向 {self.agent2.name} 的身份验证成功")
-                else:
-                    logger.error(f"{self.agent1.name} 向 {self.agent2.name} 的身份验证失败")
-                    return False
-            else:
-                logger.error(f"{self.agent1.name} 向 {self.agent2.name} 的身份验证失败")
-                return False
-            
-            # Agent2 向 Agent1 发送身份验证
-            auth_packet2 = EfficodePacket(
-                op_code="DID",
-                params={"value": self.agent2.did},
-                sender=self.agent2.name
-            )
-            response2_str = self.agent1.process_message(auth_packet2)
-            if response2_str:
-                # 将字符串响应解析为EfficodePacket
-                response2 = EfficodePacket.from_string(response2_str, self.agent1.name)
-                if response2.op_code == "ACK":
-                    logger.info(f"{self.agent2.name} 向 {self.agent1.name} 的身份验证成功")
+    def _interactive_round(self, user_input: str) -> None:
+        """交互式对话的一轮：用户消息依次交给两个智能体"""
+        # 创建请求包 - 普通文本，不加密
+        user_packet = self._stamp_packet(create_request_packet(
+            content=user_input,
+            req_type="dialogue",
+            sender="用户"
+        ))
+        
+        # 记录用户消息
+        self._record_message("用户", user_input, user_packet)
+        
+        # 发送给第一个智能体
+        print(f"\n[系统] {self.agent1.name} 正在思考...")
+        # API会返回加密的Efficode格式消息
+        encrypted_response1 = self._process(self.agent1, user_packet)
+        
+        if encrypted_response1:
+            # 解析响应
+            agent1_response = self._stamp_packet(EfficodePacket.from_string(encrypted_response1, self.agent1.name))
+            
+            # 解压并显示回答
+            agent1_response = agent1_response.decompress_content()
+            if agent1_response.op_code == "DATA" and "content" in agent1_response.params:
+                agent1_message = agent1_response.params.get("content", "")
+                print(f"\n[{self.agent1.name}]: {agent1_message}")
+                self._record_message(self.agent1.name, agent1_message, agent1_response)
+                
+                # 发送给第二个智能体
+                print(f"\n[系统] {self.agent2.name} 正在思考...")
+                # API会返回加密的Efficode格式消息
+                encrypted_response2 = self._process(self.agent2, agent1_response)
+                if encrypted_response2:
+                    # 解析响应
+                    agent2_response = self._stamp_packet(EfficodePacket.from_string(encrypted_response2, self.agent2.name))
+                    
+                    # 解压并显示回答
+                    agent2_response = agent2_response.decompress_content()
+                    if agent2_response.op_code == "DATA" and "content" in agent2_response.params:
+                        agent2_message = agent2_response.params.get("content", "")
+                        print(f"\n[{self.agent2.name}]: {agent2_message}")
+                        self._record_message(self.agent2.name, agent2_message, agent2_response)
+                    else:
+                        message = agent2_response.to_string()
+                        print(f"\n[{self.agent2.name}]: {message}")
+                        self._record_message(self.agent2.name, message, agent2_response)
                 else:
-                    logger.error(f"{self.agent2.name} 向 {self.agent1.name} 的身份验证失败")
-                    return False
+                    print(f"\n{self.agent2.name} 无法处理消息")
             else:
-                logger.error(f"{self.agent2.name} 向 {self.agent1.name} 的身份验证失败")
-                return False
+                message = agent1_response.to_string()
+                print(f"\n[{self.agent1.name}]: {message}")
+                self._record_message(self.agent1.name, message, agent1_response)
+        else:
+            print(f"\n{self.agent1.name} 无法处理您的请求。请重试。")
+    
+    def _process(self, agent: Union[AIAgent, RemoteAgent], packet: EfficodePacket,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        让智能体处理数据包；API熔断期间暂停对话，熔断器可以放行探测请求时重试
+        
+        暂停受对话和本轮的截止时间限制（超时即结束对话），也可被cancel()打断；
+        一次调用累计暂停超过CIRCUIT_MAX_PAUSE秒时结束对话。
+        
+        Args:
+            agent: 智能体
+            packet: 数据包
+            on_chunk: 流式回调
             
-            return True
+        Returns:
+            智能体的响应
+        """
+        paused = 0.0
+        while True:
+            # 监听者收到的offset按每次尝试从0开始，重试时客户端据此丢弃上一次的部分内容
+            callback = self._stream_to_listeners(agent.name, on_chunk) if self._listeners else on_chunk
+            try:
+                return agent.process_message(packet, on_chunk=callback)
+            except CircuitOpenError as e:
+                wait = max(e.retry_after, CIRCUIT_MIN_PAUSE)
+                if paused + wait > CIRCUIT_MAX_PAUSE:
+                    raise Cancelled(f"API持续不可用（已暂停 {paused:.0f} 秒）")
+                print(f"\n[系统] API暂时不可用（{e}），对话暂停 {wait:.0f} 秒后继续")
+                started = time.monotonic()
+                try:
+                    self.cancel_token.sleep(wait)
+                finally:
+                    elapsed = time.monotonic() - started
+                    paused += elapsed
+                    self.circuit_pauses["pauses"] += 1
+                    self.circuit_pauses["seconds"] = round(self.circuit_pauses["seconds"] + elapsed, 3)
+    
+    def _stream_to_listeners(self, sender: str,
+                             on_chunk: Optional[Callable[[str], None]]) -> Callable[[str], None]:
+        """包装流式回调，把每段回复内容同时作为chunk事件发给监听者"""
+        streamed = 0
+        
+        def forward(text: str) -> None:
+            nonlocal streamed
+            self._emit({"type": "chunk", "dialogue_id": self.dialogue_id, "sender": sender,
+                        "text": text, "offset": streamed})
+            streamed += len(text)
+            if on_chunk is not None:
+                on_chunk(text)
+        return forward
+    
+    def _authenticate_agents(self) -> bool:
+        """身份验证过程：会话表中已有有效会话时不再握手"""
+        try:
+            logger.info("开始身份验证...")
+            if authenticate_group([self.agent1, self.agent2], self.sessions):
+                logger.info(f"{self.agent1.name} 与 {self.agent2.name} 的身份验证成功")
+                return True
+            logger.error(f"{self.agent1.name} 与 {self.agent2.name} 的身份验证失败")
+            return False
             
         except Exception as e:
             logger.error(f"身份验证过程中出错: {str(e)}")
             logger.exception("详细错误信息")
             return False
     
-    def _record_message(self, sender: str, content: str) -> None:
+    def _start_dialogue(self, timeout: Optional[float] = None) -> None:
+        """为新的一次对话分配对话ID、创建取消令牌并重置序列号和统计"""
+        self.dialogue_id = new_packet_id()
+        self._sequence = SequenceCounter()
+        # 外层（例如批量对话）设置的令牌作为上级令牌，其取消和截止时间同样生效
+        self.cancel_token = CancelToken(timeout, parent=current_token())
+        self.cancellation = None
+        self.round_timeouts = []
+        self.circuit_pauses = {"pauses": 0, "seconds": 0.0}
+        self._round_started = None
+        self.round_seconds = []
+        self.speculation_stats = None
+        self.convergence_report = None
+        self.profile_report = None
+        self.saved_path = None
+        self._reasoning_baseline = {agent.name: agent.usage_stats.get("reasoning_tokens", 0)
+                                    for agent in (self.agent1, self.agent2)}
+    
+    def _begin_round(self, round_timeout: Optional[float]) -> None:
+        """开始一轮：记录开始时间并设置本轮的截止时间"""
+        self._round_started = time.monotonic()
+        self.cancel_token.limit(round_timeout)
+    
+    def _finish_round(self, completed: bool = True) -> float:
+        """结束一轮并返回其耗时，completed为False时不计入每轮耗时"""
+        elapsed = time.monotonic() - self._round_started if self._round_started is not None else 0.0
+        if completed:
+            self.round_seconds.append(elapsed)
+        self._round_started = None
+        self.cancel_token.limit(None)
+        return elapsed
+    
+    def _abort(self, error: BaseException, mode: str) -> None:
+        """
+        对话被取消、超时或被用户中断：中止仍在进行的调用，记录浪费的时间并保存已完成的部分
+        
+        Args:
+            error: Cancelled、DeadlineExceeded或KeyboardInterrupt
+            mode: 对话模式，用于保存的文件名
+        """
+        reason = "被用户中断" if isinstance(error, KeyboardInterrupt) else (str(error) or "已取消")
+        # 其他线程中的调用（例如流水线草稿）共用同一个令牌，取消后随之中止
+        self.cancel_token.cancel(reason)
+        partial_round = self._finish_round(completed=False)
+        self.cancellation = {
+            "reason": reason,
+            "deadline_exceeded": isinstance(error, DeadlineExceeded),
+            "elapsed_seconds": round(time.monotonic() - self.cancel_token.created, 3),
+            "rounds_completed": len(self.round_seconds),
+            "partial_round_seconds": round(partial_round, 3),  # 未完成的一轮已花费的时间，其结果被丢弃
+            "aborted_call_seconds": round(self.cancel_token.wasted_seconds, 3)  # 被中止的API调用已花费的时间
+        }
+        logger.warning(f"对话{reason}: {self.cancellation}")
+        print(f"\n[系统] 对话{reason}，已完成 {len(self.round_seconds)} 轮；未完成的一轮浪费 {partial_round:.1f} 秒"
+              f"（其中被中止的API调用 {self.cancel_token.wasted_seconds:.1f} 秒），已保存已完成的部分")
+        self._save_conversation(mode)
+    
+    def _reasoning_savings(self) -> Dict[str, int]:
+        """本次对话中各智能体剥离、未转发给对端的推理令牌数"""
+        return {agent.name: agent.usage_stats.get("reasoning_tokens", 0) - self._reasoning_baseline.get(agent.name, 0)
+                for agent in (self.agent1, self.agent2)}
+    
+    def _print_timing_report(self) -> None:
+        """打印每轮耗时、流水线模式的草稿统计、收敛检测和推理剥离节省的令牌"""
+        if self.round_seconds:
+            average = sum(self.round_seconds) / len(self.round_seconds)
+            print(f"\n每轮平均耗时: {average:.1f} 秒 (共 {len(self.round_seconds)} 轮)")
+        if self.speculation_stats:
+            stats = self.speculation_stats
+            print(f"提问草稿: 起草 {stats['drafts']} 次，采用 {stats['accepted']} 轮，"
+                  f"未采用 {stats['rejected_rounds']} 轮，浪费 {stats['wasted_drafts']} 份草稿 / "
+                  f"{stats['wasted_tokens']} 令牌")
+        queueing = {name: stats for name, stats in get_default_scheduler().stats().items() if stats["granted"]}
+        if any(stats["max_delay"] > 0 for stats in queueing.values()):
+            print("API排队延迟: " + "，".join(
+                f"{name} 平均 {stats['avg_delay']:.2f} 秒 / p95 {stats['p95_delay']:.2f} 秒"
+                for name, stats in queueing.items()))
+        if self.circuit_pauses["pauses"]:
+            print(f"API熔断: 对话暂停 {self.circuit_pauses['pauses']} 次，共 {self.circuit_pauses['seconds']:.1f} 秒")
+        if self.convergence_report:
+            report = self.convergence_report
+            print(f"收敛检测: 计划 {report['planned_rounds']} 轮，实际 {report['rounds_run']} 轮，"
+                  f"引导换角度 {report['redirects']} 次，节省 {report['rounds_saved']} 轮")
+        savings = self._reasoning_savings()
+        if any(savings.values()):
+            print(f"推理内容剥离: 对端提示词少用约 {sum(savings.values())} 令牌 "
+                  f"({', '.join(f'{name} {tokens}' for name, tokens in savings.items())})")
+    
+    def _circuit_breakers(self) -> List[Dict[str, Any]]:
+        """本进程中智能体所用提供方池各成员的熔断器状态和状态变化（远端智能体的池不在此列）"""
+        pools = {id(agent.client.pool): agent.client.pool for agent in (self.agent1, self.agent2)
+                 if isinstance(agent, AIAgent)}
+        return [dict(member["circuit"], member=member["name"])
+                for pool in pools.values() for member in pool.stats()]
+    
+    def _stamp_packet(self, packet: EfficodePacket) -> EfficodePacket:
+        """为对话中流转的数据包分配序列号并写入元数据"""
+        return packet.add_metadata(seq=self._sequence.next())
+    
+    def _record_message(self, sender: str, content: str, packet: Optional[EfficodePacket] = None) -> None:
         """记录消息"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         message = {
@@ -351,8 +735,12 @@ class DialogueManager:
             "content": content,
             "timestamp": timestamp
         }
+        if packet is not None:
+            message["packet_id"] = packet.packet_id
+            message["seq"] = packet.seq
         self.conversation_history.append(message)
         logger.debug(f"记录消息: {sender} -> {content[:50]}...")
+        self._emit({"type": "message", "dialogue_id": self.dialogue_id, "message": message})
     
     def _save_conversation(self, mode: str) -> None:
         """保存对话历史到文件"""
@@ -362,14 +750,29 @@ class DialogueManager:
             
             conversation_data = {
                 "mode": mode,
+                "dialogue_id": self.dialogue_id,
                 "agent1": {
                     "name": self.agent1.name,
-                    "role": self.agent1.role["description"]
+                    "role": self.agent1.role["description"],
+                    "model_profile": self.agent1.model_profile["name"],
+                    "usage": self.agent1.usage_stats
                 },
                 "agent2": {
                     "name": self.agent2.name,
-                    "role": self.agent2.role["description"]
+                    "role": self.agent2.role["description"],
+                    "model_profile": self.agent2.model_profile["name"],
+                    "usage": self.agent2.usage_stats
                 },
+                "model_stats": self.agent1.router.stats(),
+                "round_seconds": [round(seconds, 3) for seconds in self.round_seconds],
+                "speculation": self.speculation_stats,
+                "convergence": self.convergence_report,
+                "request_queueing": get_default_scheduler().stats(),
+                "cancellation": self.cancellation,
+                "round_timeouts": self.round_timeouts,
+                "circuit_pauses": self.circuit_pauses,
+                "circuit_breakers": self._circuit_breakers(),
+                "reasoning_tokens_stripped": self._reasoning_savings(),
                 "timestamp": datetime.now().isoformat(),
                 "messages": self.conversation_history
             }
@@ -377,6 +780,7 @@ class DialogueManager:
             with open(filename, 'w', encoding='utf-8') as f:
                 json.dump(conversation_data, f, ensure_ascii=False, indent=2)
             
+            self.saved_path = filename
             logger.info(f"对话历史已保存至: {filename}")
             
             # 保存SPL格式
@@ -401,4 +805,50 @@ class DialogueManager:
             logger.info(f"对话历史已保存为SPL格式: {filename}")
             
         except Exception as e:
-            logger.error(f"保存SPL格式对话历史时出错: {str(e)}") 
\ No newline at end of file
+            logger.error(f"保存SPL格式对话历史时出错: {str(e)}") 
+
+def run_dialogue_batch(agents: List[Union[AIAgent, RemoteAgent]], topic: str, rounds: int = 3,
+                       pairs: Optional[List[Tuple[int, int]]] = None,
+                       sessions: Optional[SessionTable] = None, timeout: Optional[float] = None,
+                       round_timeout: Optional[float] = None, profile: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    在一组智能体之间批量运行自动对话
+    
+    开始前对整个群组做一次批量握手（每个智能体一次往返），之后每组对话的身份验证
+    都直接命中会话表。
+    
+    Args:
+        agents: 智能体列表
+        topic: 对话主题
+        rounds: 每组对话的轮数
+        pairs: 参与对话的智能体下标对，默认为所有两两组合
+        sessions: 身份验证会话表，默认使用进程级共享的会话表
+        timeout: 每组对话的时限（秒）
+        round_timeout: 每轮的时限（秒）
+        profile: 性能剖析模式（sample或cprofile），每组对话分别写出剖析结果
+        
+    Returns:
+        每组对话的结果: {"agents": [名称, 名称], "dialogue_id": ..., "history": [...], "cancellation": ...,
+        "profile": 剖析报告或None}
+    """
+    sessions = sessions or get_default_session_table()
+    if not authenticate_group(agents, sessions):
+        logger.error("群组身份验证失败，批量对话终止")
+        return []
+    
+    results = []
+    for i, j in pairs or list(itertools.combinations(range(len(agents)), 2)):
+        manager = DialogueManager(agents[i], agents[j], sessions)
+        manager.profile = profile
+        # 批量对话的API请求排在交互式和自动对话之后
+        with request_context("batch"):
+            history = manager.run_auto_conversation(topic, rounds, timeout=timeout, round_timeout=round_timeout)
+        results.append({
+            "agents": [agents[i].name, agents[j].name],
+            "dialogue_id": manager.dialogue_id,
+            "history": history,
+            "cancellation": manager.cancellation,
+            "profile": manager.profile_report
+        })
+    logger.info(f"批量对话完成: {len(results)} 组，会话统计: {sessions.snapshot()}")
+    return results
@@ -0,0 +1,794 @@
+"""
+对话服务模块
+
+Vue前端（src/services/api.js、AgentDialog.vue）期望在8080端口上有REST API和WebSocket，
+而main.py只是阻塞在input()上的命令行程序。这个模块用asyncio（只依赖标准库）
+把DialogueManager暴露给前端：
+
+- REST: POST /api/dialogues 启动自动对话，GET /api/dialogues[/<id>] 查询状态和消息，
+  POST /api/dialogues/<id>/cancel 取消对话，GET /api/server/stats 查看连接和投递统计；
+- WebSocket: /ws?dialogue_id=<id> 订阅一个对话，不带dialogue_id（例如前端的
+  /ws?agent_id=0）时订阅全部对话；连接后也可以发送
+  {"type": "subscribe"|"unsubscribe", "dialogue_id": ...} 调整订阅。
+  推送的事件: new_message（DialogueManager记录的每条消息，格式与前端一致）、
+  chunk（回复内容的流式数据块）、dialogue_status（对话状态变化）、
+  dialogue_snapshot（订阅时已有的消息，供中途加入的客户端补齐）。
+
+对话在线程池中运行，事件通过call_soon_threadsafe交给事件循环，每个事件只序列化、
+分帧一次，再放入各订阅连接的发送队列。每个连接的发送队列有上限（背压）：
+队列超过一半时丢弃chunk事件（客户端可按offset发现缺口，完整内容随new_message到达），
+队列已满时断开这个过慢的连接（关闭码1013），不影响其他连接和对话线程。
+
+用法:
+    python dialogue_server.py --port 8080
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import struct
+import asyncio
+import hashlib
+import functools
+import argparse
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from typing import Optional, Dict, Any, List, Callable, Set, Tuple
+
+from ai_agent import AIAgent, AGENT_ROLES
+from api_client import ApiClient, get_default_client
+from dialogue_manager import DialogueManager
+from cancellation import CancelToken, cancel_scope
+from packet_identity import new_packet_id
+from profiling import SAMPLE, PROFILE_MODES
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Dialogue_Server')
+
+# 常量定义
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080  # 前端连接的端口
+SEND_QUEUE_SIZE = 256  # 每个WebSocket连接的发送队列容量（帧），与Go版本的Send通道相同
+CHUNK_DROP_RATIO = 0.5  # 发送队列超过此比例时丢弃chunk事件
+SEND_BATCH = 64  # 发送循环一次最多合并写入的帧数
+SEND_TIMEOUT = 10.0  # 一帧写入超过此时间（秒）视为连接卡死，断开
+WRITE_BUFFER_HIGH = 64 * 1024  # 每个连接在事件循环中的写缓冲上限（字节），超过后发送循环等待
+SOCKET_SEND_BUFFER = 64 * 1024  # 每个连接的内核发送缓冲（字节），避免本机连接自动调大到数MB
+PING_INTERVAL = 30.0  # 连接空闲多久（秒）发送一次ping
+SHUTDOWN_GRACE = 1.0  # 关闭服务时等待连接发出关闭帧的时间（秒）
+KEEPALIVE_TIMEOUT = 30.0  # HTTP长连接空闲超时（秒）
+MAX_HEADER_SIZE = 16 * 1024  # 请求头上限（字节）
+MAX_BODY_SIZE = 1024 * 1024  # 请求体上限（字节）
+MAX_WS_MESSAGE_SIZE = 64 * 1024  # 客户端WebSocket消息上限（字节）
+MAX_CONNECTIONS = 10000  # WebSocket连接数上限
+LISTEN_BACKLOG = 2048
+MAX_RUNNING_DIALOGUES = 8  # 同时运行的对话数（对话线程数）
+MAX_QUEUED_DIALOGUES = 64  # 等待运行的对话数上限，超过时返回503
+MAX_FINISHED_DIALOGUES = 200  # 保留的已结束对话数
+MAX_ROUNDS = 20
+DEFAULT_DIALOGUE_TIMEOUT = 900  # 对话时限（秒），与main.py相同
+DEFAULT_ROUND_TIMEOUT = 240
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+HTTP_REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+    431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable"
+}
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type"
+}
+
+class HttpError(Exception):
+    """以指定状态码响应的请求错误"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+class WebSocketError(Exception):
+    """WebSocket协议错误"""
+
+def websocket_accept(key: str) -> str:
+    """根据客户端的Sec-WebSocket-Key计算Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+
+def encode_frame(opcode: int, payload: bytes, mask: bool = False) -> bytes:
+    """
+    编码一个完整的WebSocket帧
+
+    Args:
+        opcode: 操作码
+        payload: 负载
+        mask: 是否掩码（客户端发出的帧必须掩码，服务端发出的帧不掩码）
+
+    Returns:
+        帧的字节
+    """
+    length = len(payload)
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, mask_bit | length)
+    elif length < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, mask_bit | 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, mask_bit | 127, length)
+    if not mask:
+        return header + payload
+    key = os.urandom(4)
+    return header + key + _apply_mask(payload, key)
+
+def _apply_mask(payload: bytes, key: bytes) -> bytes:
+    """按4字节掩码异或负载（整数运算，避免逐字节循环）"""
+    if not payload:
+        return payload
+    repeated = (key * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(repeated, 'little')).to_bytes(len(payload), 'little')
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int) -> Tuple[bool, int, bytes]:
+    """
+    读取一个WebSocket帧
+
+    Args:
+        reader: 流
+        max_size: 负载上限（字节）
+
+    Returns:
+        (是否为消息的最后一帧, 操作码, 去掩码后的负载)
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', await reader.readexactly(8))[0]
+    if length > max_size:
+        raise WebSocketError(f"帧过大: {length} 字节")
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    return bool(first & 0x80), first & 0x0F, _apply_mask(payload, key) if key else payload
+
+async def read_message(reader: asyncio.StreamReader, max_size: int,
+                       on_control: Callable[[int, bytes], None]) -> Optional[Tuple[int, bytes]]:
+    """
+    读取一条完整的WebSocket消息（合并分片，控制帧交给on_control处理）
+
+    Returns:
+        (操作码, 负载)，收到关闭帧时为None
+    """
+    opcode, parts, size = None, [], 0
+    while True:
+        fin, frame_opcode, payload = await read_frame(reader, max_size)
+        if frame_opcode >= OP_CLOSE:
+            if frame_opcode == OP_CLOSE:
+                return None
+            on_control(frame_opcode, payload)
+            continue
+        if frame_opcode != OP_CONTINUATION:
+            opcode = frame_opcode
+        elif opcode is None:
+            raise WebSocketError("没有起始帧的分片")
+        size += len(payload)
+        if size > max_size:
+            raise WebSocketError(f"消息过大: {size} 字节")
+        parts.append(payload)
+        if fin:
+            return opcode, b"".join(parts)
+
+def close_frame(code: int, reason: str = "") -> bytes:
+    """关闭帧"""
+    return encode_frame(OP_CLOSE, struct.pack('>H', code) + reason.encode('utf-8')[:120])
+
+class WebSocketConnection:
+    """
+    一个WebSocket连接的发送端
+
+    事件循环中的所有发布者只把帧放入有界的发送队列，由发送循环写入套接字，
+    套接字写不动时（写缓冲超过WRITE_BUFFER_HIGH）发送循环等待，队列随之积压。
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int = SEND_QUEUE_SIZE):
+        """
+        初始化连接
+
+        Args:
+            writer: 流
+            queue_size: 发送队列容量（帧）
+        """
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self.chunk_limit = int(queue_size * CHUNK_DROP_RATIO)
+        self.dialogues: Optional[Set[str]] = None  # 订阅的对话，None表示全部
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self.stats = {"sent": 0, "dropped_chunks": 0}
+
+    def offer(self, frame: bytes, droppable: bool = False) -> bool:
+        """
+        放入一帧，不等待
+
+        Args:
+            frame: 帧
+            droppable: 可丢弃的帧（chunk事件），队列超过一半时丢弃
+
+        Returns:
+            是否已放入；队列已满的不可丢弃帧会使连接被断开
+        """
+        if self.closed:
+            return False
+        if droppable and self.queue.qsize() >= self.chunk_limit:
+            self.stats["dropped_chunks"] += 1
+            return False
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.close(1013, "发送队列已满")
+            return False
+        return True
+
+    def close(self, code: int = 1000, reason: str = "") -> None:
+        """丢弃未发送的帧，发送关闭帧后结束发送循环"""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason or None
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(close_frame(code, reason))
+        self.queue.put_nowait(None)
+
+    async def send_loop(self) -> None:
+        """把发送队列中的帧写入套接字，空闲时发送ping"""
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(self.queue.get(), PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    frame = encode_frame(OP_PING, b"")
+                if frame is None:
+                    break
+                # 积压的帧合并为一次写入，减少系统调用
+                frames = [frame]
+                while not self.queue.empty() and len(frames) < SEND_BATCH:
+                    frames.append(self.queue.get_nowait())
+                finished = frames[-1] is None
+                if finished:
+                    frames.pop()
+                self.writer.write(b"".join(frames))
+                await asyncio.wait_for(self.writer.drain(), SEND_TIMEOUT)
+                self.stats["sent"] += len(frames)
+                if finished:
+                    break
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket连接 {self.peer} 写入超时，断开")
+            self.closed = True
+            self.close_reason = "写入超时"
+        except (ConnectionError, OSError):
+            self.closed = True
+        finally:
+            self.writer.close()
+
+class _DialogueSession:
+    """服务端的一个对话"""
+
+    def __init__(self, dialogue_id: str, manager: DialogueManager, params: Dict[str, Any]):
+        self.dialogue_id = dialogue_id  # 服务端的对话ID（DialogueManager每次运行会分配新的内部ID）
+        self.manager = manager
+        self.params = params
+        self.status = "queued"  # queued -> running -> finished/cancelled/failed
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.token = CancelToken()  # 对话令牌的上级令牌，排队中的对话同样可以取消
+
+    def summary(self) -> Dict[str, Any]:
+        manager = self.manager
+        return {
+            "dialogue_id": self.dialogue_id,
+            "status": self.status,
+            "topic": self.params["topic"],
+            "rounds": self.params["rounds"],
+            "agents": [manager.agent1.name, manager.agent2.name],
+            "messages": len(manager.conversation_history),
+            "created_at": self.created,
+            "finished_at": self.finished,
+            "error": self.error,
+            "cancellation": manager.cancellation,
+            "profile": manager.profile_report
+        }
+
+def agent_manager_factory(client: ApiClient) -> Callable[[Dict[str, Any]], DialogueManager]:
+    """
+    创建对话管理器工厂：每个对话使用一对新的AIAgent（各自的对话上下文），共享API客户端
+
+    Args:
+        client: 共享的API客户端
+
+    Returns:
+        工厂函数，参数为请求参数（questioner、answerer为角色名称）
+    """
+    def create(params: Dict[str, Any]) -> DialogueManager:
+        names = (params.get("questioner") or "智谋", params.get("answerer") or "慧眼")
+        for name in names:
+            if name not in AGENT_ROLES:
+                raise HttpError(400, f"未知的智能体角色: {name}")
+        if names[0] == names[1]:
+            raise HttpError(400, "提问者和回答者不能是同一个角色")
+        return DialogueManager(AIAgent(names[0], client=client), AIAgent(names[1], client=client))
+    return create
+
+class DialogueServer:
+    """对话服务：REST启动和查询对话，WebSocket推送对话事件"""
+
+    def __init__(self, manager_factory: Callable[[Dict[str, Any]], DialogueManager],
+                 host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 queue_size: int = SEND_QUEUE_SIZE, max_running: int = MAX_RUNNING_DIALOGUES,
+                 profile: Optional[str] = None):
+        """
+        初始化服务
+
+        Args:
+            manager_factory: 根据请求参数创建对话管理器（可以抛出HttpError拒绝请求）
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+            queue_size: 每个WebSocket连接的发送队列容量（帧）
+            max_running: 同时运行的对话数
+            profile: 性能剖析模式（sample或cprofile），设置后每个对话的剖析结果写到其对话记录旁边
+        """
+        self.manager_factory = manager_factory
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.max_running = max_running
+        self.profile = profile
+        self.sessions: 'OrderedDict[str, _DialogueSession]' = OrderedDict()
+        self.connections: Set[WebSocketConnection] = set()
+        self._subscribers: Dict[str, Set[WebSocketConnection]] = {}
+        self._all_subscribers: Set[WebSocketConnection] = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="dialogue")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+        self.stats = {"http_requests": 0, "ws_accepted": 0, "ws_peak": 0, "events": 0,
+                      "frames_queued": 0, "dropped_chunks": 0, "slow_disconnects": 0}
+
+    async def start(self) -> 'DialogueServer':
+        """开始监听，port为0时更新为实际端口"""
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit=MAX_HEADER_SIZE, backlog=LISTEN_BACKLOG)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"对话服务已启动: http://{self.host}:{self.port}/api, ws://{self.host}:{self.port}/ws")
+        return self
+
+    async def serve_forever(self) -> None:
+        """持续服务直到被取消"""
+        await self._server.serve_forever()
+
+    async def stop(self) -> None:
+        """取消进行中的对话，关闭所有连接"""
+        for session in self.sessions.values():
+            if session.status in ("queued", "running"):
+                self._cancel(session, "服务关闭")
+        if self._server is not None:
+            self._server.close()
+        for connection in list(self.connections):
+            connection.close(1001, "服务关闭")
+        if self._handlers:
+            # 给发送循环一点时间发出关闭帧，仍写不动的连接直接中断
+            await asyncio.wait(list(self._handlers), timeout=SHUTDOWN_GRACE)
+            for connection in list(self.connections):
+                connection.writer.transport.abort()
+            if self._handlers:
+                await asyncio.wait(list(self._handlers))
+        if self._server is not None:
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    # ---- 事件发布 ----
+
+    def _listener(self, dialogue_id: str, event: Dict[str, Any]) -> None:
+        """DialogueManager的监听者，在对话线程中调用，事件改用服务端的对话ID"""
+        self._loop.call_soon_threadsafe(self._publish, dict(event, dialogue_id=dialogue_id), time.time())
+
+    def _publish(self, event: Dict[str, Any], emitted: Optional[float] = None) -> None:
+        """
+        把对话事件发给订阅者（在事件循环中调用），每个事件只编码一次
+
+        Args:
+            event: 对话事件
+            emitted: 事件在对话线程中产生的时间，作为推送事件的time字段（客户端可计算投递延迟）
+        """
+        self.stats["events"] += 1
+        dialogue_id = event["dialogue_id"]
+        subscribers = self._subscribers.get(dialogue_id)
+        if not subscribers and not self._all_subscribers:
+            return
+        payload = dict(self._client_event(event), time=emitted or time.time())
+        frame = encode_frame(OP_TEXT, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        droppable = event["type"] == "chunk"
+        for targets in (subscribers or (), self._all_subscribers):
+            for connection in list(targets):
+                self._offer(connection, frame, droppable)
+
+    def _offer(self, connection: WebSocketConnection, frame: bytes, droppable: bool) -> None:
+        if connection.closed:
+            return
+        if connection.offer(frame, droppable):
+            self.stats["frames_queued"] += 1
+        elif not connection.closed:
+            self.stats["dropped_chunks"] += 1
+        else:
+            self.stats["slow_disconnects"] += 1
+            logger.warning(f"WebSocket连接 {connection.peer} 接收过慢，已断开")
+            self._unsubscribe_all(connection)
+
+    @staticmethod
+    def _client_event(event: Dict[str, Any]) -> Dict[str, Any]:
+        """把对话事件转换为前端的消息格式"""
+        if event["type"] != "message":
+            return event
+        message = event["message"]
+        return {
+            "type": "new_message",
+            "message": {
+                "id": message.get("packet_id") or message.get("seq"),
+                "conversation_id": event["dialogue_id"],
+                "sender": message["sender"],
+                "content": message["content"],
+                "content_type": "text",
+                "created_at": message["timestamp"],
+                "seq": message.get("seq")
+            }
+        }
+
+    def _set_status(self, session: _DialogueSession, status: str) -> None:
+        """更新对话状态并通知订阅者（在事件循环中调用）"""
+        session.status = status
+        if status not in ("queued", "running"):
+            session.finished = time.time()
+            self._prune_sessions()
+        self._publish({"type": "dialogue_status", "dialogue_id": session.dialogue_id,
+                       "status": status, "error": session.error,
+                       "cancellation": session.manager.cancellation})
+
+    def _prune_sessions(self) -> None:
+        """只保留最近MAX_FINISHED_DIALOGUES个已结束的对话"""
+        finished = [key for key, session in self.sessions.items() if session.finished is not None]
+        for key in finished[:max(0, len(finished) - MAX_FINISHED_DIALOGUES)]:
+            del self.sessions[key]
+            self._subscribers.pop(key, None)
+
+    # ---- 对话 ----
+
+    def _start_dialogue(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """排队启动一个对话，返回对话摘要"""
+        pending = sum(1 for session in self.sessions.values() if session.status in ("queued", "running"))
+        if pending >= self.max_running + MAX_QUEUED_DIALOGUES:
+            raise HttpError(503, f"进行中的对话过多（{pending}），请稍后重试")
+        manager = self.manager_factory(params)
+        if self.profile:
+            manager.profile = self.profile
+        session = _DialogueSession(new_packet_id(), manager, params)
+        summary = session.summary()  # 提交前生成，出错时不会留下已在运行的对话
+        manager.add_listener(functools.partial(self._listener, session.dialogue_id))
+        self.sessions[session.dialogue_id] = session
+        future = self._loop.run_in_executor(self._executor, self._run_dialogue, session)
+        future.add_done_callback(lambda f: self._set_status(session, "cancelled" if f.cancelled() else f.result()))
+        logger.info(f"对话 {session.dialogue_id} 已排队: {params['topic']}（{params['rounds']} 轮）")
+        return summary
+
+    def _run_dialogue(self, session: _DialogueSession) -> str:
+        """在对话线程中运行对话，返回结束状态"""
+        if session.token.cancelled:
+            return "cancelled"
+        self._loop.call_soon_threadsafe(self._set_status, session, "running")
+        params = session.params
+        try:
+            with cancel_scope(session.token):
+                session.manager.run_auto_conversation(params["topic"], params["rounds"],
+                                                      pipelined=params["pipelined"],
+                                                      timeout=params["timeout"],
+                                                      round_timeout=params["round_timeout"])
+        except Exception as e:
+            logger.error(f"对话 {session.dialogue_id} 出错: {str(e)}")
+            session.error = str(e)
+            return "failed"
+        return "cancelled" if session.manager.cancellation else "finished"
+
+    @staticmethod
+    def _cancel(session: _DialogueSession, reason: str) -> None:
+        session.token.cancel(reason)
+
+    @staticmethod
+    def _dialogue_params(body: Dict[str, Any]) -> Dict[str, Any]:
+        """校验启动对话的请求体"""
+        topic = body.get("topic")
+        if not isinstance(topic, str) or not topic.strip():
+            raise HttpError(400, "缺少对话主题(topic)")
+        rounds = body.get("rounds", 5)
+        if not isinstance(rounds, int) or not 1 <= rounds <= MAX_ROUNDS:
+            raise HttpError(400, f"对话轮数(rounds)应为1到{MAX_ROUNDS}之间的整数")
+        params = {"topic": topic.strip(), "rounds": rounds, "pipelined": bool(body.get("pipelined", False)),
+                  "questioner": body.get("questioner"), "answerer": body.get("answerer")}
+        for name, default in (("timeout", DEFAULT_DIALOGUE_TIMEOUT), ("round_timeout", DEFAULT_ROUND_TIMEOUT)):
+            value = body.get(name, default)
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise HttpError(400, f"{name} 应为正数")
+            params[name] = value
+        return params
+
+    # ---- HTTP ----
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """一个TCP连接：HTTP长连接，或升级为WebSocket"""
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except HttpError as e:
+                    writer.write(self._response(e.status, {"error": str(e)}, keep_alive=False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                self.stats["http_requests"] += 1
+                if request["headers"].get("upgrade", "").lower() == "websocket":
+                    await self._serve_websocket(request, reader, writer)
+                    return
+                keep_alive = request["headers"].get("connection", "").lower() != "close"
+                try:
+                    status, body = self._route(request)
+                except HttpError as e:
+                    status, body = e.status, {"error": str(e)}
+                except Exception as e:
+                    logger.exception("处理请求时出错")
+                    status, body = 500, {"error": str(e)}
+                writer.write(self._response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            self._handlers.discard(task)
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+        """读取一个HTTP请求，连接在请求之间关闭时返回None"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "请求头过大")
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "无效的请求行")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "无效的Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return {"method": method.upper(), "path": url.path.rstrip("/") or "/",
+                "query": {key: values[0] for key, values in parse_qs(url.query).items()},
+                "headers": headers, "body": body}
+
+    @staticmethod
+    def _response(status: int, body: Optional[Dict[str, Any]], keep_alive: bool = True) -> bytes:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body is not None else b""
+        headers = dict(CORS_HEADERS)
+        headers["Content-Length"] = str(len(data))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        if body is not None:
+            headers["Content-Type"] = "application/json; charset=utf-8"
+        if status == 503:
+            headers["Retry-After"] = "5"
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + data
+
+    def _route(self, request: Dict[str, Any]) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """处理REST请求，返回(状态码, 响应体)"""
+        method, parts = request["method"], request["path"].strip("/").split("/")
+        if method == "OPTIONS":
+            return 204, None
+        if parts[:2] == ["api", "server"] and parts[2:] == ["stats"] and method == "GET":
+            return 200, self.server_stats()
+        if parts[:2] != ["api", "dialogues"] or len(parts) > 4:
+            raise HttpError(404, f"未知的路径: {request['path']}")
+        if len(parts) == 2:
+            if method == "GET":
+                return 200, {"dialogues": [session.summary() for session in self.sessions.values()]}
+            if method == "POST":
+                try:
+                    body = json.loads(request["body"] or b"{}")
+                except ValueError:
+                    raise HttpError(400, "请求体不是有效的JSON")
+                if not isinstance(body, dict):
+                    raise HttpError(400, "请求体应为JSON对象")
+                return 201, self._start_dialogue(self._dialogue_params(body))
+            raise HttpError(405, f"不支持的方法: {method}")
+        session = self.sessions.get(parts[2])
+        if session is None:
+            raise HttpError(404, f"对话不存在: {parts[2]}")
+        if len(parts) == 4 and parts[3] != "cancel":
+            raise HttpError(404, f"未知的路径: {request['path']}")
+        if len(parts) == 3 and method == "GET":
+            return 200, dict(session.summary(), history=list(session.manager.conversation_history))
+        if len(parts) == 4 and method == "POST":
+            if session.status not in ("queued", "running"):
+                raise HttpError(409, f"对话已结束: {session.status}")
+            self._cancel(session, "客户端取消")
+            return 200, session.summary()
+        raise HttpError(405, f"不支持的方法: {method}")
+
+    def server_stats(self) -> Dict[str, Any]:
+        """连接、事件投递和对话统计"""
+        statuses: Dict[str, int] = {}
+        for session in self.sessions.values():
+            statuses[session.status] = statuses.get(session.status, 0) + 1
+        return dict(self.stats, ws_connections=len(self.connections), dialogues=statuses)
+
+    # ---- WebSocket ----
+
+    async def _serve_websocket(self, request: Dict[str, Any], reader: asyncio.StreamReader,
+                               writer: asyncio.StreamWriter) -> None:
+        """完成握手，之后读取客户端消息直到连接关闭"""
+        headers = request["headers"]
+        key = headers.get("sec-websocket-key")
+        if request["path"] != "/ws" or not key or headers.get("sec-websocket-version") != "13":
+            writer.write(self._response(400, {"error": "无效的WebSocket握手"}, keep_alive=False))
+            await writer.drain()
+            return
+        dialogue_id = request["query"].get("dialogue_id")
+        if dialogue_id is not None and dialogue_id not in self.sessions:
+            writer.write(self._response(404, {"error": f"对话不存在: {dialogue_id}"}, keep_alive=False))
+            await writer.drain()
+            return
+        if len(self.connections) >= MAX_CONNECTIONS:
+            writer.write(self._response(503, {"error": "连接数已达上限"}, keep_alive=False))
+            await writer.drain()
+            return
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {websocket_accept(key)}\r\n\r\n").encode('latin-1'))
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_SEND_BUFFER)
+        connection = WebSocketConnection(writer, self.queue_size)
+        self.connections.add(connection)
+        self.stats["ws_accepted"] += 1
+        self.stats["ws_peak"] = max(self.stats["ws_peak"], len(self.connections))
+        sender = asyncio.ensure_future(connection.send_loop())
+        self._subscribe(connection, dialogue_id)
+        try:
+            await self._receive_loop(connection, reader)
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        except WebSocketError as e:
+            connection.close(1009, str(e))
+        finally:
+            connection.close()
+            self._unsubscribe_all(connection)
+            self.connections.discard(connection)
+            await sender
+
+    async def _receive_loop(self, connection: WebSocketConnection, reader: asyncio.StreamReader) -> None:
+        def on_control(opcode: int, payload: bytes) -> None:
+            if opcode == OP_PING:
+                connection.offer(encode_frame(OP_PONG, payload))
+
+        while not connection.closed:
+            message = await read_message(reader, MAX_WS_MESSAGE_SIZE, on_control)
+            if message is None:
+                return
+            opcode, payload = message
+            try:
+                command = json.loads(payload) if opcode == OP_TEXT else None
+            except ValueError:
+                command = None
+            if not isinstance(command, dict) or command.get("type") not in ("subscribe", "unsubscribe"):
+                continue
+            dialogue_id = command.get("dialogue_id")
+            if command["type"] == "subscribe":
+                self._subscribe(connection, dialogue_id)
+            elif dialogue_id is None:
+                self._unsubscribe_all(connection)
+            else:
+                self._subscribers.get(dialogue_id, set()).discard(connection)
+                if connection.dialogues is not None:
+                    connection.dialogues.discard(dialogue_id)
+
+    def _subscribe(self, connection: WebSocketConnection, dialogue_id: Optional[str]) -> None:
+        """
+        订阅一个对话（None为全部对话），并发送该对话已有的消息
+
+        订阅全部和订阅单个对话互斥，避免同一事件向一个连接推送两次：订阅全部时退订各个
+        对话，订阅单个对话时不再订阅全部。
+        """
+        if dialogue_id is None:
+            for subscribed in connection.dialogues or ():
+                self._subscribers.get(subscribed, set()).discard(connection)
+            self._all_subscribers.add(connection)
+            connection.dialogues = None
+            return
+        session = self.sessions.get(dialogue_id)
+        if session is None:
+            connection.offer(encode_frame(OP_TEXT, json.dumps(
+                {"type": "error", "error": f"对话不存在: {dialogue_id}"}, ensure_ascii=False).encode('utf-8')))
+            return
+        self._all_subscribers.discard(connection)
+        self._subscribers.setdefault(dialogue_id, set()).add(connection)
+        if connection.dialogues is not None:
+            connection.dialogues.add(dialogue_id)
+        else:
+            connection.dialogues = {dialogue_id}
+        snapshot = dict(session.summary(), type="dialogue_snapshot",
+                        history=list(session.manager.conversation_history))
+        connection.offer(encode_frame(OP_TEXT, json.dumps(snapshot, ensure_ascii=False).encode('utf-8')))
+
+    def _unsubscribe_all(self, connection: WebSocketConnection) -> None:
+        self._all_subscribers.discard(connection)
+        for dialogue_id in connection.dialogues or ():
+            self._subscribers.get(dialogue_id, set()).discard(connection)
+
+async def _serve(args: argparse.Namespace) -> None:
+    client = get_default_client()
+    server = await DialogueServer(agent_manager_factory(client), args.host, args.port,
+                                  max_running=args.max_dialogues, profile=args.profile).start()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.stop()
+
+def main(argv: List[str]) -> None:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="Efficode对话服务（REST + WebSocket）")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="监听端口（Go后端占用8080时可改用其他端口）")
+    parser.add_argument("--max-dialogues", type=int, default=MAX_RUNNING_DIALOGUES, help="同时运行的对话数")
+    parser.add_argument("--profile", nargs="?", const=SAMPLE, choices=PROFILE_MODES,
+                        help="剖析每个对话（默认sample采样，cprofile为确定性剖析），结果写到logs目录")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        print("\n服务已停止。")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,292 @@
+"""
+Efficode分块传输模块
+
+这个模块将大型DATA数据包拆分为带序号和校验和的分片，并在接收端重组。
+重组缓冲区容忍乱序到达，有超时和内存上限，且在收到连续的前缀分片后
+即可开始流式解压，不必等待最后一个分片。
+
+这是供收发两端直接调用的库接口：DialogueManager和efficode_transport的传输
+目前不会自动分片发送或重组数据包。
+"""
+
+import time
+import zlib
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Union, Iterator, Iterable, Callable, IO
+
+from efficode_core import (
+    EfficodePacket,
+    StreamDecompressor,
+    compress_stream,
+    default_stream_method,
+    STREAM_CHUNK_SIZE
+)
+from packet_identity import new_packet_id, SeenPacketCache
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Efficode_Chunking')
+
+# 常量定义
+CHUNK_TYPE = "chunk"  # 分片数据包的type参数
+DEFAULT_CHUNK_SIZE = 256 * 1024  # 每个分片携带的Base64字符数
+DEFAULT_REASSEMBLY_TIMEOUT = 120.0  # 未完成消息的超时时间（秒）
+DEFAULT_REASSEMBLY_MAX_BYTES = 64 * 1024 * 1024  # 重组缓冲区的内存上限（字节）
+
+def chunk_checksum(fragment: str) -> str:
+    """计算分片的CRC32校验和"""
+    return f"{zlib.crc32(fragment.encode('ascii')) & 0xFFFFFFFF:08x}"
+
+def _regroup(pieces: Iterable[str], chunk_size: int) -> Iterator[str]:
+    """将任意长度的Base64片段重新切分为定长分片（长度为4的倍数）"""
+    chunk_size = max(4, chunk_size - chunk_size % 4)
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[chunk_size:]
+    if buffer:
+        yield buffer
+
+def iter_chunk_packets(source: Union[str, IO, Iterable[Union[str, bytes]]], data_type: str, sender: str,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE, method: Optional[str] = None,
+                       msg_id: Optional[str] = None) -> Iterator[EfficodePacket]:
+    """
+    将内容流式压缩并生成分片数据包
+
+    分片在压缩的同时逐个生成，最后一个分片带有total参数。
+
+    Args:
+        source: 字符串、文件对象或块迭代器
+        data_type: 原始数据类型
+        sender: 发送者
+        chunk_size: 每个分片的Base64字符数
+        method: 压缩方法，默认zstd（已安装时）或zlib
+        msg_id: 消息ID，默认自动生成
+
+    Yields:
+        分片数据包
+    """
+    method = method or default_stream_method()
+    msg_id = msg_id or new_packet_id()
+    pieces = _regroup(compress_stream(source, method, chunk_size=STREAM_CHUNK_SIZE), chunk_size)
+
+    seq = 0
+    fragment = next(pieces, '')
+    while True:
+        next_fragment = next(pieces, None)
+        params: Dict[str, Any] = {
+            "content": fragment,
+            "type": CHUNK_TYPE,
+            "msg_id": msg_id,
+            "seq": seq,
+            "checksum": chunk_checksum(fragment),
+            "codec": method,
+            "original_type": data_type
+        }
+        if next_fragment is None:
+            params["total"] = seq + 1
+        yield EfficodePacket("DATA", params, sender)
+        if next_fragment is None:
+            break
+        fragment = next_fragment
+        seq += 1
+
+def split_data_packet(packet: EfficodePacket, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[EfficodePacket]:
+    """
+    将DATA数据包拆分为分片数据包，消息ID沿用原数据包的ID
+
+    Args:
+        packet: 原始数据包（content须为未压缩的字符串）
+        chunk_size: 每个分片的Base64字符数
+
+    Returns:
+        分片数据包列表
+    """
+    packet = packet.decompress_if_needed()
+    return list(iter_chunk_packets(
+        packet.get_content(),
+        packet.params.get("type", "text"),
+        packet.sender,
+        chunk_size=chunk_size,
+        msg_id=packet.packet_id
+    ))
+
+def is_chunk_packet(packet: EfficodePacket) -> bool:
+    """检查数据包是否为分片"""
+    return packet.op_code == "DATA" and packet.params.get("type") == CHUNK_TYPE and "msg_id" in packet.params
+
+class _PendingMessage:
+    """重组中的单条消息"""
+
+    def __init__(self, msg_id: str, sender: str, codec: str, data_type: str):
+        self.msg_id = msg_id
+        self.sender = sender
+        self.data_type = data_type
+        self.created = time.monotonic()
+        self.total: Optional[int] = None
+        self.next_seq = 0  # 下一个待解压的分片序号
+        self.out_of_order: Dict[int, str] = {}  # 提前到达、尚不能解压的分片
+        self.decoder = StreamDecompressor(codec)
+        self.text_parts: List[str] = []  # 保留的已解压文本（流式交出时不保留）
+        self.text_length = 0  # 已解出的字符数
+        self.buffered_bytes = 0
+
+class ReassemblyBuffer:
+    """
+    分片重组缓冲区
+
+    连续到达的分片立即送入流式解压器并释放，只有乱序分片会被暂存。
+    超时的消息和超出内存上限时最早的消息会被丢弃。
+    设置了on_text时解出的文本交给回调后不再保留，也不计入内存上限，
+    重组完成的数据包只带有元数据（content为空，streamed为True）。
+    """
+
+    def __init__(self, timeout: float = DEFAULT_REASSEMBLY_TIMEOUT,
+                 max_bytes: int = DEFAULT_REASSEMBLY_MAX_BYTES,
+                 on_text: Optional[Callable[[str, str], None]] = None,
+                 keep_text: Optional[bool] = None):
+        """
+        初始化重组缓冲区
+
+        Args:
+            timeout: 未完成消息的超时时间（秒）
+            max_bytes: 缓冲区内存上限（字节，按暂存分片与保留的已解压文本估算）
+            on_text: 每解出一段文本时的回调(msg_id, text)，用于边收边处理
+            keep_text: 是否保留已解压文本并在重组完成时返回，默认只在没有on_text时保留
+        """
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.on_text = on_text
+        self.keep_text = on_text is None if keep_text is None else keep_text
+        self._pending: "OrderedDict[str, _PendingMessage]" = OrderedDict()
+        self._dropped = SeenPacketCache()  # 已完成或已丢弃的消息，其后续分片直接忽略
+        self.buffered_bytes = 0
+        self.stats = {"chunks": 0, "completed": 0, "checksum_errors": 0, "expired": 0, "evicted": 0}
+
+    def add(self, packet: EfficodePacket) -> Optional[EfficodePacket]:
+        """
+        接收一个分片
+
+        Args:
+            packet: 分片数据包
+
+        Returns:
+            消息完整时返回重组后的DATA数据包，否则返回None
+        """
+        self.expire()
+        params = packet.params
+        msg_id = str(params["msg_id"])
+        seq = int(params["seq"])
+        fragment = params.get("content", "")
+
+        if chunk_checksum(fragment) != params.get("checksum"):
+            self.stats["checksum_errors"] += 1
+            logger.warning(f"分片校验失败，已丢弃: msg_id={msg_id}, seq={seq}")
+            return None
+        self.stats["chunks"] += 1
+
+        if msg_id in self._dropped:
+            return None
+
+        message = self._pending.get(msg_id)
+        if message is None:
+            message = _PendingMessage(msg_id, packet.sender, params.get("codec", "zlib"),
+                                      params.get("original_type", "text"))
+            self._pending[msg_id] = message
+        if "total" in params:
+            message.total = int(params["total"])
+
+        if seq < message.next_seq or seq in message.out_of_order:
+            # 重复分片
+            return None
+        if seq == message.next_seq:
+            self._feed(message, fragment)
+            # 依次解压此前乱序到达的后续分片
+            while message.next_seq in message.out_of_order:
+                buffered = message.out_of_order.pop(message.next_seq)
+                self._account(message, -len(buffered))
+                self._feed(message, buffered)
+        else:
+            message.out_of_order[seq] = fragment
+            self._account(message, len(fragment))
+
+        if message.total is not None and message.next_seq >= message.total:
+            return self._complete(message)
+
+        self._enforce_limit()
+        return None
+
+    def _feed(self, message: _PendingMessage, fragment: str) -> None:
+        """将连续分片送入流式解压器"""
+        text = message.decoder.feed(fragment)
+        message.next_seq += 1
+        self._emit(message, text)
+
+    def _emit(self, message: _PendingMessage, text: str) -> None:
+        """保存并回调新解出的文本"""
+        if not text:
+            return
+        message.text_length += len(text)
+        if self.keep_text:
+            message.text_parts.append(text)
+            self._account(message, len(text.encode('utf-8')))
+        if self.on_text:
+            self.on_text(message.msg_id, text)
+
+    def _account(self, message: _PendingMessage, delta: int) -> None:
+        """更新内存占用统计"""
+        message.buffered_bytes += delta
+        self.buffered_bytes += delta
+
+    def _complete(self, message: _PendingMessage) -> EfficodePacket:
+        """结束解压并生成完整的数据包"""
+        self._emit(message, message.decoder.finish())
+        self._drop(message.msg_id)
+        self.stats["completed"] += 1
+        params: Dict[str, Any] = {"content": "".join(message.text_parts), "type": message.data_type}
+        if not self.keep_text:
+            params.update({"streamed": True, "length": message.text_length})
+        packet = EfficodePacket("DATA", params, message.sender)
+        packet.packet_id = message.msg_id
+        logger.info(f"消息 {message.msg_id} 重组完成，共 {message.total} 个分片")
+        return packet
+
+    def _drop(self, msg_id: str) -> None:
+        """移除一条消息，并记录下来以忽略其后续分片"""
+        message = self._pending.pop(msg_id, None)
+        if message is not None:
+            self.buffered_bytes -= message.buffered_bytes
+        self._dropped.add(msg_id)
+
+    def _enforce_limit(self) -> None:
+        """超出内存上限时丢弃最早的消息"""
+        while self.buffered_bytes > self.max_bytes and self._pending:
+            msg_id = next(iter(self._pending))
+            logger.warning(f"重组缓冲区超出上限 ({self.max_bytes} 字节)，丢弃消息 {msg_id}")
+            self._drop(msg_id)
+            self.stats["evicted"] += 1
+
+    def expire(self) -> List[str]:
+        """
+        丢弃超时的消息
+
+        Returns:
+            被丢弃的消息ID列表
+        """
+        now = time.monotonic()
+        expired = [msg_id for msg_id, message in self._pending.items() if now - message.created > self.timeout]
+        for msg_id in expired:
+            logger.warning(f"消息 {msg_id} 重组超时，已丢弃")
+            self._drop(msg_id)
+            self.stats["expired"] += 1
+        return expired
+
+    def pending_ids(self) -> List[str]:
+        """获取重组中的消息ID"""
+        return list(self._pending.keys())
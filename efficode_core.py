@@ -12,7 +12,17 @@ import base64
 import re
 import gzip
 import io
-from typing import Optional, Dict, Any, List, Union, Tuple
+import os
+import codecs
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Union, Tuple, Iterable, Iterator, IO
+
+from packet_identity import new_packet_id
+from efficode_keywords import extract_keywords
 
 # 配置日志
 logging.basicConfig(
@@ -24,6 +34,464 @@ logger = logging.getLogger('Efficode_Core')
 # 常量定义
 COMPRESSION_THRESHOLD = 500  # 大于此字节大小的内容才进行压缩
 COMPRESSION_METHODS = ['zlib', 'gzip']  # 支持的压缩方法
+STREAM_CHUNK_SIZE = 64 * 1024  # 流式压缩每次读取的块大小
+STREAMING_THRESHOLD = 1024 * 1024  # 超过此长度的内容走流式压缩，不再逐个尝试所有算法
+CLASSIFY_PREFIX_LIMIT = 4096  # 内容类型检测最多检查的字符数
+QUESTION_MAX_LENGTH = 200  # 短于此长度且含问号的文本视为问题
+TRANSMISSION_CACHE_SIZE = 256  # optimize_for_transmission结果缓存的容量
+
+# 操作码与前缀的对应关系
+OP_CODE_PREFIXES = {
+    "DID": "@",
+    "REQ": "#",
+    "DATA": "#",
+    "ACK": "!",
+    "ERROR": "!"
+}
+PREFIX_OP_CODES = {
+    '@': ['DID'],
+    '#': ['REQ', 'DATA'],
+    '!': ['ACK', 'ERROR']
+}
+
+# 旧版线格式(ai_communication)使用的压缩标记
+LEGACY_COMPRESSED_KEY = '_compressed'
+LEGACY_ORIGINAL_TYPE_KEY = '_original_type'
+
+def _decompress_bytes(compressed_data: bytes, compression_method: str) -> str:
+    """按压缩方法解压字节数据并解码为字符串"""
+    if compression_method == 'zlib':
+        return zlib.decompress(compressed_data).decode('utf-8')
+    elif compression_method == 'gzip':
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed_data), mode='rb') as f:
+            return f.read().decode('utf-8')
+    elif compression_method == 'zstd':
+        try:
+            import zstandard as zstd
+            decompressor = zstd.ZstdDecompressor()
+            return decompressor.decompress(compressed_data).decode('utf-8')
+        except ImportError:
+            raise Exception("zstandard库未安装，无法解压zstd压缩的内容")
+    elif compression_method == 'brotli':
+        try:
+            import brotli # type: ignore
+            return brotli.decompress(compressed_data).decode('utf-8')
+        except ImportError:
+            raise Exception("brotli库未安装，无法解压brotli压缩的内容")
+    # 尝试zlib解压（默认）
+    return zlib.decompress(compressed_data).decode('utf-8')
+
+def default_stream_method() -> str:
+    """流式压缩默认使用的算法：已安装zstandard时用zstd，否则用zlib"""
+    try:
+        import zstandard  # noqa: F401
+        return 'zstd'
+    except ImportError:
+        return 'zlib'
+
+class _BrotliStreamAdapter:
+    """将brotli的process/finish接口适配为compress/decompress/flush"""
+    
+    def __init__(self, engine):
+        self._engine = engine
+    
+    def compress(self, data: bytes) -> bytes:
+        return self._engine.process(data)
+    
+    def decompress(self, data: bytes) -> bytes:
+        return self._engine.process(data)
+    
+    def flush(self) -> bytes:
+        finish = getattr(self._engine, 'finish', None)
+        result = finish() if finish else b''
+        return result if isinstance(result, bytes) else b''
+
+def _new_stream_compressor(method: str):
+    """创建支持compress()/flush()的增量压缩器"""
+    if method == 'zlib':
+        return zlib.compressobj(9)
+    elif method == 'gzip':
+        # wbits=31 输出gzip格式，头部mtime为0，结果可复现
+        return zlib.compressobj(9, zlib.DEFLATED, 31)
+    elif method == 'zstd':
+        import zstandard as zstd
+        return zstd.ZstdCompressor(level=19).compressobj()
+    elif method == 'brotli':
+        import brotli # type: ignore
+        return _BrotliStreamAdapter(brotli.Compressor(quality=11))
+    raise ValueError(f"不支持的流式压缩方法: {method}")
+
+def _new_stream_decompressor(method: str):
+    """创建支持decompress()的增量解压器"""
+    if method == 'gzip':
+        return zlib.decompressobj(31)
+    elif method == 'zstd':
+        import zstandard as zstd
+        return zstd.ZstdDecompressor().decompressobj()
+    elif method == 'brotli':
+        import brotli # type: ignore
+        return _BrotliStreamAdapter(brotli.Decompressor())
+    return zlib.decompressobj()
+
+def _iter_source_bytes(source: Union[str, bytes, IO, Iterable[Union[str, bytes]]],
+                       chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """将字符串、文件对象或块迭代器统一转换为UTF-8字节块"""
+    if isinstance(source, str):
+        # 按块编码，避免一次性生成整段内容的UTF-8副本
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size].encode('utf-8')
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+    else:
+        for chunk in source:
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+def compress_stream(source: Union[str, bytes, IO, Iterable[Union[str, bytes]]], method: str = 'zlib',
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """
+    流式压缩并增量Base64编码
+    
+    每次只处理一个块，峰值内存由块大小决定。各输出片段直接拼接即为
+    完整内容的Base64编码。
+    
+    Args:
+        source: 字符串、字节、文件对象或字符串/字节块迭代器
+        method: 压缩方法
+        chunk_size: 读取块大小
+        
+    Yields:
+        Base64编码片段
+    """
+    compressor = _new_stream_compressor(method)
+    pending = b''
+    for chunk in _iter_source_bytes(source, chunk_size):
+        pending += compressor.compress(chunk)
+        # Base64按3字节一组编码，剩余字节留到下一块
+        usable = len(pending) - len(pending) % 3
+        if usable:
+            yield base64.b64encode(pending[:usable]).decode('ascii')
+            pending = pending[usable:]
+    pending += compressor.flush()
+    if pending:
+        yield base64.b64encode(pending).decode('ascii')
+
+class StreamDecompressor:
+    """
+    推送式的增量Base64解码与解压器
+    
+    编码片段可在任意位置切分，按顺序调用feed()即可逐步得到解压后的文本。
+    """
+    
+    def __init__(self, method: str = 'zlib'):
+        """
+        Args:
+            method: 压缩方法
+        """
+        self.method = method
+        self._decompressor = _new_stream_decompressor(method)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._pending = ''
+    
+    def feed(self, chunk: str) -> str:
+        """输入一个Base64编码片段，返回当前可解出的文本"""
+        self._pending += chunk
+        # Base64按4字符一组解码，剩余字符留到下一块
+        usable = len(self._pending) - len(self._pending) % 4
+        if not usable:
+            return ''
+        data = base64.b64decode(self._pending[:usable])
+        self._pending = self._pending[usable:]
+        return self._text_decoder.decode(self._decompressor.decompress(data))
+    
+    def finish(self) -> str:
+        """结束输入，返回剩余文本"""
+        tail = self._decompressor.decompress(base64.b64decode(self._pending)) if self._pending else b''
+        self._pending = ''
+        if hasattr(self._decompressor, 'flush'):
+            tail += self._decompressor.flush()
+        return self._text_decoder.decode(tail, final=True)
+
+def decompress_stream(encoded_chunks: Iterable[str], method: str = 'zlib') -> Iterator[str]:
+    """
+    流式Base64解码并解压
+    
+    输入片段可在任意位置切分，接收方可以在收齐全部数据前开始输出文本。
+    
+    Args:
+        encoded_chunks: Base64编码片段
+        method: 压缩方法
+        
+    Yields:
+        解压后的文本片段
+    """
+    decoder = StreamDecompressor(method)
+    for chunk in encoded_chunks:
+        text = decoder.feed(chunk)
+        if text:
+            yield text
+    text = decoder.finish()
+    if text:
+        yield text
+
+# 代码特征：每个模式都不含可回溯的 .*，成对特征按行查找，匹配时间与输入长度成线性关系
+_CODE_KEYWORD_PATTERN = re.compile(r'\bclass\s+\w+|\bimport\s+\w+')  # 类定义 / 导入语句
+_CODE_LINE_PAIRS = [
+    (re.compile(r'\bdef\s+\w+\s*\('), re.compile(r'\)\s*(?:->[^\n:]{0,100})?:')),  # Python函数
+    (re.compile(r'\bfunction\s+\w+\s*\('), re.compile(r'\)')),  # JavaScript函数
+    (re.compile(r'<\w+>'), re.compile(r'</\w+>')),  # HTML标签
+]
+
+def _has_line_pair(opening_pattern: 're.Pattern', closing_pattern: 're.Pattern', text: str) -> bool:
+    """检查是否存在同一行内先出现开始特征、后出现结束特征的情况，每行最多扫描两遍"""
+    position = 0
+    while True:
+        opening = opening_pattern.search(text, position)
+        if not opening:
+            return False
+        line_end = text.find('\n', opening.end())
+        if line_end < 0:
+            line_end = len(text)
+        if closing_pattern.search(text, opening.end(), line_end):
+            return True
+        position = line_end + 1
+
+def classify_content(text: str, max_inspect: int = CLASSIFY_PREFIX_LIMIT) -> str:
+    """
+    检测文本内容类型: json/url/code/question/plain_text
+    
+    只检查前max_inspect个字符（首尾为花括号的文本另用json.loads完整验证），
+    所有模式都是线性的，长文本和构造的恶意输入都不会引起回溯爆炸。
+    
+    Args:
+        text: 要检测的文本
+        max_inspect: 最多检查的字符数
+        
+    Returns:
+        内容类型
+    """
+    head = text[:max_inspect]
+    stripped_head = head.lstrip()
+    
+    # 检测是否是JSON：首尾字符为花括号且能完整解析（C实现的解析器，线性时间）
+    if stripped_head.startswith('{') and text[-max_inspect:].rstrip().endswith('}'):
+        try:
+            json.loads(text)
+            return "json"
+        except ValueError:
+            pass
+    
+    # 检测是否是URL
+    if head.startswith(('http://', 'https://')):
+        return "url"
+    
+    # 检测是否是代码
+    if _CODE_KEYWORD_PATTERN.search(head):
+        return "code"
+    for opening_pattern, closing_pattern in _CODE_LINE_PAIRS:
+        if _has_line_pair(opening_pattern, closing_pattern, head):
+            return "code"
+    
+    # 检测是否是问题
+    if len(text) < QUESTION_MAX_LENGTH and ('?' in text or '？' in text):
+        return "question"
+    
+    # 默认为普通文本
+    return "plain_text"
+
+class _ResultCache:
+    """
+    线程安全的LRU结果缓存（按输入指纹记忆计算结果）
+
+    与SeenPacketCache不同，查询不计入重复数据包统计。
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """查询结果，未缓存时返回None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """记录结果，超过容量时淘汰最久未用的"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+# optimize_for_transmission派生出的参数：分析结果与压缩形式
+_DERIVED_PARAM_KEYS = ('_metadata', '_semantic')
+_OPTIMIZED_PARAM_KEYS = _DERIVED_PARAM_KEYS + ('content', 'compressed', 'original_type')
+
+# 输入参数指纹 -> 优化后的参数，同一内容在多跳转发中只分析和压缩一次
+_transmission_cache = _ResultCache(TRANSMISSION_CACHE_SIZE)
+
+def _transmission_fingerprint(op_code: str, params: Dict[str, Any]) -> str:
+    """
+    计算优化输入的指纹
+
+    排除每跳都会变化的metadata和由内容派生的_metadata/_semantic，
+    因此解压后转发的数据包与首次发送时的指纹相同；其余任何参数变化都会使指纹失效。
+    """
+    inputs = {k: v for k, v in params.items() if k != 'metadata' and k not in _DERIVED_PARAM_KEYS}
+    serialized = json.dumps([op_code, inputs], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=16).hexdigest()
+
+def clear_transmission_cache() -> None:
+    """清空optimize_for_transmission的结果缓存"""
+    global _transmission_cache
+    _transmission_cache = _ResultCache(TRANSMISSION_CACHE_SIZE)
+
+# 自解压数据包的前导(preamble)：解压器与语法说明，修改内容时递增版本号
+PREAMBLE_VERSION = 1
+SELF_EXTRACTING_CODECS = ('zlib', 'gzip')  # 浏览器端pako.inflate可直接解压的压缩方法
+SELF_EXTRACTING_CACHE_SIZE = 64  # 自解压压缩结果缓存的容量
+
+# 简化版解压器 (JavaScript)
+SELF_EXTRACTING_DECOMPRESSOR_JS = """
+function efficodeDecompress(base64Data) {
+    // 1. 将Base64转为字节数组
+    const binaryString = atob(base64Data);
+    const bytes = new Uint8Array(binaryString.length);
+    for (let i = 0; i < binaryString.length; i++) {
+        bytes[i] = binaryString.charCodeAt(i);
+    }
+    
+    // 2. 使用pako.js解压 (需要引入pako库)，自动识别zlib和gzip格式
+    // <script src="https://cdn.jsdelivr.net/npm/pako@2.0.4/dist/pako.min.js"></script>
+    return pako.inflate(bytes, { to: 'string' });
+}
+
+// 使用方法: efficodeDecompress(packet.params.compressed_data);
+"""
+
+# Efficode语法结构说明
+EFFICODE_SYNTAX_GUIDE = """
+Efficode协议格式说明：
+1. 基本格式: <前缀><操作码>[?<参数>]
+   - 前缀: @ (身份验证), # (请求/数据), ! (确认/错误)
+   - 操作码: DID (身份), REQ (请求), DATA (数据), ACK (确认), ERROR (错误)
+   - 参数: 以key=value形式提供，多个参数用&连接
+
+2. 压缩数据: 当content参数长度超过500字节时，将自动压缩
+   - 压缩格式: content=<BASE64编码的压缩数据>&compressed=<压缩方法>
+   - 支持的压缩方法: zlib, gzip, zstd, brotli (自动选择最优)
+
+3. 示例:
+   - 请求: #REQ?content=请求内容&type=question
+   - 数据: #DATA?content=数据内容&type=answer
+   - 压缩: #DATA?content=<压缩数据>&compressed=zlib&type=answer
+
+4. 自解压数据包: compressed_data为Base64编码的压缩内容，codec为压缩方法，
+   preamble_id引用解压器与本说明，同一会话内只在首次发送时附带preamble
+"""
+
+def _preamble_id() -> str:
+    """根据前导内容计算版本化的ID，内容变化时ID随之变化"""
+    digest = hashlib.sha256(
+        (SELF_EXTRACTING_DECOMPRESSOR_JS + EFFICODE_SYNTAX_GUIDE).encode('utf-8')
+    ).hexdigest()
+    return f"v{PREAMBLE_VERSION}-{digest[:16]}"
+
+PREAMBLE_ID = _preamble_id()
+
+def get_preamble() -> Dict[str, Any]:
+    """获取自解压数据包的前导"""
+    return {
+        "id": PREAMBLE_ID,
+        "version": PREAMBLE_VERSION,
+        "decompressor": SELF_EXTRACTING_DECOMPRESSOR_JS,
+        "syntax_guide": EFFICODE_SYNTAX_GUIDE
+    }
+
+class PreambleSession:
+    """
+    前导发送会话
+    
+    发送端记录已向哪些对端发送过当前版本的前导；接收端记录收到的前导，
+    以便解析只带preamble_id的后续数据包。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sent: set = set()  # (对端, 前导ID)
+        self._received: Dict[str, Dict[str, Any]] = {PREAMBLE_ID: get_preamble()}
+    
+    def needs_preamble(self, peer: str) -> bool:
+        """检查是否需要向对端发送前导"""
+        with self._lock:
+            return (peer, PREAMBLE_ID) not in self._sent
+    
+    def claim(self, peer: str) -> bool:
+        """
+        原子地检查并记录前导发送，并发的发送者中只有一个会得到True
+        
+        Returns:
+            是否需要由本次调用向对端发送前导
+        """
+        with self._lock:
+            key = (peer, PREAMBLE_ID)
+            if key in self._sent:
+                return False
+            self._sent.add(key)
+            return True
+    
+    def reset(self, peer: Optional[str] = None) -> None:
+        """重置对端（默认全部）的发送记录，例如对端重新连接后"""
+        with self._lock:
+            if peer is None:
+                self._sent.clear()
+            else:
+                self._sent = {entry for entry in self._sent if entry[0] != peer}
+    
+    def remember(self, preamble: Dict[str, Any]) -> None:
+        """记录收到的前导"""
+        with self._lock:
+            self._received[preamble["id"]] = preamble
+    
+    def resolve(self, preamble_id: str) -> Optional[Dict[str, Any]]:
+        """根据ID查找前导，未知时返回None"""
+        with self._lock:
+            return self._received.get(preamble_id)
+
+default_preamble_session = PreambleSession()
+
+# 内容指纹 -> zlib压缩后的Base64内容
+_self_extracting_cache = _ResultCache(SELF_EXTRACTING_CACHE_SIZE)
+
+def open_self_extracting_packet(packet: Dict[str, Any], session: Optional[PreambleSession] = None) -> str:
+    """
+    在Python端解开自解压数据包
+    
+    Args:
+        packet: create_self_extracting_packet生成的字典
+        session: 接收端会话，用于记录和解析前导
+        
+    Returns:
+        原始内容
+    """
+    session = session or default_preamble_session
+    params = packet["params"]
+    if "preamble" in params:
+        session.remember(params["preamble"])
+    elif session.resolve(params.get("preamble_id", "")) is None:
+        logger.warning(f"未知的前导ID: {params.get('preamble_id')}，需要对端重新发送前导")
+    return _decompress_bytes(base64.b64decode(params["compressed_data"]), params.get("codec", "zlib"))
 
 class EfficodePacket:
     """Efficode数据包类"""
@@ -41,17 +509,13 @@ class EfficodePacket:
         self.params = params
         self.sender = sender
         self.timestamp = time.time()  # 时间戳
+        self.packet_id = new_packet_id()  # 单调递增的唯一ID
+        self.seq: Optional[int] = None  # 对话内序列号
     
     def to_string(self) -> str:
         """将数据包转换为字符串格式"""
         # 为不同操作码选择不同的前缀
-        prefix = {
-            "DID": "@",
-            "REQ": "#",
-            "DATA": "#",
-            "ACK": "!",
-            "ERROR": "!"
-        }.get(self.op_code, "#")
+        prefix = OP_CODE_PREFIXES.get(self.op_code, "#")
         
         # 处理参数字符串
         if not self.params:
@@ -71,64 +535,58 @@ class EfficodePacket:
     
     @classmethod
     def from_string(cls, packet_str: str, sender: str) -> 'EfficodePacket':
-        """从字符串解析数据包"""
+        """
+        从字符串解析数据包
+        
+        同时兼容两种线格式:
+        - 标准格式: <前缀><操作码>?k=v&k=v，压缩标记为 compressed=<方法>
+        - 旧版格式: DID/ACK/ERROR 使用 <前缀><操作码>:<JSON参数>，
+          压缩标记为 _compressed/_original_type (仅zlib)
+        """
         try:
             if not packet_str:
                 logger.error("解析数据包失败: 空字符串")
                 return cls("ERROR", {"message": "空数据包"}, sender)
                 
-            prefix = packet_str[0] if packet_str else '#'
+            prefix = packet_str[0]
+            body = packet_str[1:]
             
             # 基于前缀判断可能的操作码
-            possible_ops = {
-                '@': ['DID'],
-                '#': ['REQ', 'DATA'],
-                '!': ['ACK', 'ERROR']
-            }.get(prefix, ['DATA'])
-            
-            # 尝试解压缩数据包
-            if 'compressed=' in packet_str:
-                logger.info("检测到压缩数据包，尝试解压...")
-                packet_str = cls._decompress_packet_string(packet_str)
-            
-            # 分离操作码和参数
-            if '?' in packet_str:
-                main_part, params_str = packet_str[1:].split('?', 1)
-            else:
-                main_part, params_str = packet_str[1:], ""
-            
-            # 确定操作码
+            possible_ops = PREFIX_OP_CODES.get(prefix, ['DATA'])
             op_code = None
             for op in possible_ops:
-                if main_part.startswith(op):
+                if body.startswith(op):
                     op_code = op
                     break
-                    
-            if not op_code:
-                op_code = "DATA"  # 默认为DATA
             
             # 解析参数
-            params = {}
-            if params_str:
-                param_pairs = params_str.split('&')
-                for pair in param_pairs:
-                    if '=' in pair:
-                        key, value = pair.split('=', 1)
-                        # 尝试解析JSON
-                        try:
-                            if (value.startswith('{') and value.endswith('}')) or \
-                               (value.startswith('[') and value.endswith(']')):
-                                params[key] = json.loads(value)
-                            else:
-                                params[key] = value
-                        except json.JSONDecodeError:
-                            params[key] = value
+            params: Dict[str, Any] = {}
+            if op_code:
+                rest = body[len(op_code):]
+                if rest.startswith(':'):
+                    # 旧版格式: 参数整体为JSON
+                    params = cls._parse_json_params(rest[1:])
+                elif '?' in rest:
+                    params = cls._parse_query_params(rest.split('?', 1)[1])
+            else:
+                op_code = "DATA"  # 默认为DATA
+                if '?' in body:
+                    params = cls._parse_query_params(body.split('?', 1)[1])
             
             # 创建实例
             packet = cls(op_code, params, sender)
             
-            # 如果还有压缩内容，尝试解压
-            if 'compressed' in packet.params and packet.params['compressed'] != 'false':
+            # 沿用线上携带的标识，使重传的数据包可被识别
+            metadata = params.get("metadata")
+            if isinstance(metadata, dict):
+                if metadata.get("id"):
+                    packet.packet_id = str(metadata["id"])
+                if metadata.get("seq") is not None:
+                    packet.seq = int(metadata["seq"])
+            
+            # 如果内容被压缩（任一格式），解压
+            if packet.is_compressed():
+                logger.info("检测到压缩数据包，尝试解压...")
                 packet = packet.decompress_content()
             
             return packet
@@ -138,49 +596,67 @@ class EfficodePacket:
             return cls("ERROR", {"message": f"解析错误: {str(e)}"}, sender)
     
     @staticmethod
-    def _decompress_packet_string(packet_str: str) -> str:
-        """从字符串中解压数据包"""
+    def _parse_query_params(params_str: str) -> Dict[str, Any]:
+        """解析 k=v&k=v 形式的参数，值为JSON对象/数组时自动解析"""
+        params: Dict[str, Any] = {}
+        if not params_str:
+            return params
+        for pair in params_str.split('&'):
+            if '=' in pair:
+                key, value = pair.split('=', 1)
+                # 尝试解析JSON
+                try:
+                    if (value.startswith('{') and value.endswith('}')) or \
+                       (value.startswith('[') and value.endswith(']')):
+                        params[key] = json.loads(value)
+                    else:
+                        params[key] = value
+                except json.JSONDecodeError:
+                    params[key] = value
+        return params
+    
+    @staticmethod
+    def _parse_json_params(params_str: str) -> Dict[str, Any]:
+        """解析旧版格式中的JSON参数，无法解析时作为value保存"""
         try:
-            # 提取编码和压缩算法
-            pattern = r'content=([^&]+)&compressed=([^&]+)'
-            match = re.search(pattern, packet_str)
-            if match:
-                encoded = match.group(1)
-                compression_method = match.group(2)
-                
-                # 解码Base64
-                compressed_data = base64.b64decode(encoded)
-                
-                # 根据压缩方法解压
-                if compression_method == 'zlib':
-                    content = zlib.decompress(compressed_data).decode('utf-8')
-                elif compression_method == 'gzip':
-                    with gzip.GzipFile(fileobj=io.BytesIO(compressed_data), mode='rb') as f:
-                        content = f.read().decode('utf-8')
-                else:
-                    # 默认尝试zlib解压
-                    content = zlib.decompress(compressed_data).decode('utf-8')
-                
-                # 替换回原始内容
-                packet_str = re.sub(r'content=[^&]+&compressed=[^&]+', f'content={content}', packet_str)
-            
-            return packet_str
-        except Exception as e:
-            logger.error(f"从字符串解压数据包失败: {str(e)}")
-            return packet_str
+            params = json.loads(params_str)
+            if isinstance(params, dict):
+                return params
+        except json.JSONDecodeError:
+            pass
+        return {"value": params_str}
+    
+    def is_compressed(self) -> bool:
+        """检查content参数是否处于压缩状态（兼容两种压缩标记）"""
+        if 'compressed' in self.params and self.params['compressed'] != 'false':
+            return True
+        return self.params.get(LEGACY_COMPRESSED_KEY) in (True, 'True', 'true')
     
-    def compress_content(self) -> 'EfficodePacket':
-        """智能压缩数据包中的content参数，返回压缩后的数据包"""
+    def compress_content(self, threshold: int = COMPRESSION_THRESHOLD) -> 'EfficodePacket':
+        """
+        智能压缩数据包中的content参数，返回压缩后的数据包
+        
+        Args:
+            threshold: 压缩阈值，小于此大小的内容不压缩
+        """
+        if self.is_compressed():
+            return self
+        
         if 'content' in self.params and isinstance(self.params['content'], str):
             content = self.params['content']
             
             # 小于阈值的内容不压缩
-            if len(content) < COMPRESSION_THRESHOLD:
-                logger.info(f"内容大小 ({len(content)} 字节) 小于阈值 ({COMPRESSION_THRESHOLD} 字节)，跳过压缩")
+            if len(content) < threshold:
+                logger.info(f"内容大小 ({len(content)} 字节) 小于阈值 ({threshold} 字节)，跳过压缩")
                 return self
             
-            # 尝试多种压缩方法，选择最佳效果
-            best_result = self._find_best_compression(content)
+            # 超大内容直接流式压缩，避免同时持有多份完整副本
+            if len(content) > STREAMING_THRESHOLD:
+                method = default_stream_method()
+                best_result = (method, "".join(compress_stream(content, method)))
+            else:
+                # 尝试多种压缩方法，选择最佳效果
+                best_result = self._find_best_compression(content)
             
             if best_result:
                 method, encoded = best_result
@@ -210,7 +686,8 @@ class EfficodePacket:
         # gzip压缩
         try:
             gzip_buffer = io.BytesIO()
-            with gzip.GzipFile(fileobj=gzip_buffer, mode='wb', compresslevel=9) as f:
+            # 固定mtime，保证相同内容的压缩结果一致
+            with gzip.GzipFile(fileobj=gzip_buffer, mode='wb', compresslevel=9, mtime=0) as f:
                 f.write(content_bytes)
             gzip_compressed = gzip_buffer.getvalue()
             gzip_encoded = base64.b64encode(gzip_compressed).decode('utf-8')
@@ -254,34 +731,21 @@ class EfficodePacket:
     
     def decompress_content(self) -> 'EfficodePacket':
         """解压数据包中的content参数，返回解压后的数据包"""
+        if self.params.get(LEGACY_COMPRESSED_KEY) in (True, 'True', 'true'):
+            return self._decompress_legacy_content()
+        
         if 'compressed' in self.params and self.params['compressed'] != 'false':
             try:
                 encoded = self.params['content']
                 compression_method = self.params['compressed']
-                compressed_data = base64.b64decode(encoded)
-                
-                # 根据不同的压缩方法解压
-                if compression_method == 'zlib':
-                    content = zlib.decompress(compressed_data).decode('utf-8')
-                elif compression_method == 'gzip':
-                    with gzip.GzipFile(fileobj=io.BytesIO(compressed_data), mode='rb') as f:
-                        content = f.read().decode('utf-8')
-                elif compression_method == 'zstd':
-                    try:
-                        import zstandard as zstd
-                        decompressor = zstd.ZstdDecompressor()
-                        content = decompressor.decompress(compressed_data).decode('utf-8')
-                    except ImportError:
-                        raise Exception("zstandard库未安装，无法解压zstd压缩的内容")
-                elif compression_method == 'brotli':
-                    try:
-                        import brotli # type: ignore
-                        content = brotli.decompress(compressed_data).decode('utf-8')
-                    except ImportError:
-                        raise Exception("brotli库未安装，无法解压brotli压缩的内容")
+                if len(encoded) > STREAMING_THRESHOLD:
+                    # 分块解码解压，不必同时持有完整的压缩字节
+                    content = "".join(decompress_stream(
+                        (encoded[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(encoded), STREAM_CHUNK_SIZE)),
+                        compression_method
+                    ))
                 else:
-                    # 尝试zlib解压（默认）
-                    content = zlib.decompress(compressed_data).decode('utf-8')
+                    content = _decompress_bytes(base64.b64decode(encoded), compression_method)
                 
                 # 恢复内容
                 self.params['content'] = content
@@ -295,12 +759,39 @@ class EfficodePacket:
                 logger.error(f"解压内容失败: {str(e)}")
                 logger.exception("详细错误信息")
         return self
+    
+    def _decompress_legacy_content(self) -> 'EfficodePacket':
+        """解压旧版格式(_compressed/_original_type标记，zlib)的content参数"""
+        try:
+            content = zlib.decompress(base64.b64decode(self.params['content'])).decode('utf-8')
+            
+            # 根据原始类型恢复内容
+            if self.params.get(LEGACY_ORIGINAL_TYPE_KEY) == "json":
+                self.params['content'] = json.loads(content)
+            else:
+                self.params['content'] = content
+            
+            # 移除压缩标记
+            self.params.pop(LEGACY_COMPRESSED_KEY, None)
+            self.params.pop(LEGACY_ORIGINAL_TYPE_KEY, None)
+            logger.info(f"旧版格式内容已解压，解压后大小: {len(content)} 字节")
+        except Exception as e:
+            logger.error(f"解压旧版格式内容失败: {str(e)}")
+        return self
+    
+    def decompress_if_needed(self) -> 'EfficodePacket':
+        """如果数据包内容被压缩则解压（兼容ai_communication的旧接口）"""
+        if self.is_compressed():
+            return self.decompress_content()
+        return self
 
     def get_content(self) -> str:
         """获取数据包的内容部分（如果有）"""
         # 如果是压缩的，先解压
-        if 'compressed' in self.params and self.params['compressed'] != 'false':
+        if self.is_compressed():
             packet = self.decompress_content()
+            if packet.is_compressed():
+                return ""
             return packet.get_content()
         
         if self.op_code in ["REQ", "DATA"] and "content" in self.params:
@@ -319,88 +810,262 @@ class EfficodePacket:
         """检查是否为确认数据包"""
         return self.op_code == "ACK"
 
-    def add_metadata(self) -> 'EfficodePacket':
-        """添加元数据到数据包"""
+    def add_metadata(self, seq: Optional[int] = None) -> 'EfficodePacket':
+        """
+        添加元数据到数据包
+        
+        Args:
+            seq: 对话内序列号（可选）
+        """
+        if seq is not None:
+            self.seq = seq
         if self.op_code in ["REQ", "DATA"]:
-            self.params["metadata"] = {
+            metadata = {
                 "timestamp": self.timestamp,
                 "sender": self.sender,
-                "id": f"{int(self.timestamp)}_{self.sender}"
+                "id": self.packet_id
             }
+            if self.seq is not None:
+                metadata["seq"] = self.seq
+            self.params["metadata"] = metadata
         return self
     
     def optimize(self) -> 'EfficodePacket':
         """优化数据包，压缩内容并添加元数据"""
         return self.add_metadata().compress_content()
-    
-    def create_self_extracting_packet(self) -> Dict[str, Any]:
-        """创建自解压数据包，可直接在浏览器或其他环境中解压"""
-        if self.op_code not in ["REQ", "DATA"] or "content" not in self.params:
-            return {"error": "只有REQ和DATA类型的数据包支持自解压"}
+
+    def add_content_metadata(self) -> 'EfficodePacket':
+        """
+        添加内容元数据(_metadata)，增强自解释能力
+        
+        Returns:
+            添加元数据后的数据包
+        """
+        if self.op_code == "DATA" and "content" in self.params and not self.is_compressed():
+            content = self.params["content"]
             
-        content = self.params["content"]
-        if not isinstance(content, str):
-            content = json.dumps(content, ensure_ascii=False)
+            # 添加内容类型元数据
+            if isinstance(content, dict):
+                # 提取结构信息
+                schema = {k: type(v).__name__ for k, v in content.items()}
+                self.params["_metadata"] = {
+                    "type": "json",
+                    "schema": schema,
+                    "keys": list(content.keys())
+                }
+            elif isinstance(content, str):
+                # 尝试检测内容类型
+                content_type = self._detect_content_type(content)
+                self.params["_metadata"] = {
+                    "type": "text",
+                    "content_type": content_type,
+                    "length": len(content)
+                }
+        
+        return self
+    
+    def _detect_content_type(self, text: str) -> str:
+        """
+        检测文本内容类型
+        
+        Args:
+            text: 要检测的文本
             
-        # 压缩内容 (使用zlib，兼容性最好)
-        compressed = zlib.compress(content.encode('utf-8'), level=9)
-        encoded = base64.b64encode(compressed).decode('utf-8')
-        
-        # 创建简化版解压器 (JavaScript)
-        decompressor_js = """
-        function efficodeDecompress(base64Data) {
-            // 1. 将Base64转为字节数组
-            const binaryString = atob(base64Data);
-            const bytes = new Uint8Array(binaryString.length);
-            for (let i = 0; i < binaryString.length; i++) {
-                bytes[i] = binaryString.charCodeAt(i);
-            }
+        Returns:
+            内容类型
+        """
+        return classify_content(text)
+    
+    def extract_semantic_info(self) -> 'EfficodePacket':
+        """
+        提取语义信息(_semantic)，增强自解释能力
+        
+        Returns:
+            添加语义信息后的数据包
+        """
+        if self.op_code == "REQ":
+            # 提取请求意图
+            req_type = self.params.get("type", "")
+            if req_type:
+                self.params["_semantic"] = {
+                    "intent": f"request_{req_type}",
+                    "expected_response": "data"
+                }
+        
+        elif self.op_code == "DATA" and "content" in self.params and not self.is_compressed():
+            content = self.params.get("content", "")
+            if isinstance(content, str):
+                # 提取关键词
+                keywords = self._extract_keywords(content)
+                if keywords:
+                    if "_semantic" not in self.params:
+                        self.params["_semantic"] = {}
+                    self.params["_semantic"]["keywords"] = keywords
+        
+        return self
+    
+    def _extract_keywords(self, text: str) -> List[str]:
+        """
+        从文本中提取关键词（中文按二元组/分词，英文按单词，支持TF-IDF权重）
+        
+        Args:
+            text: 要提取关键词的文本
             
-            // 2. 使用pako.js解压 (需要引入pako库)
-            // <script src="https://cdn.jsdelivr.net/npm/pako@2.0.4/dist/pako.min.js"></script>
-            const decompressed = pako.inflate(bytes, { to: 'string' });
-            return decompressed;
-        }
+        Returns:
+            关键词列表
+        """
+        return extract_keywords(text)
+    
+    def optimize_for_transmission(self) -> 'EfficodePacket':
+        """
+        优化数据包以提高传输效率: 添加内容元数据、提取语义信息并压缩内容
+        
+        Returns:
+            优化后的数据包
+        """
+        # 已压缩的数据包已经优化过，无需重复分析
+        if self.is_compressed():
+            return self
+        
+        # 相同输入已优化过（例如上一跳解压后转发的数据包），直接套用缓存的结果
+        fingerprint = _transmission_fingerprint(self.op_code, self.params)
+        # 派生参数不计入指纹，传入的旧值（例如上一跳留下的_semantic）不能影响结果，
+        # 否则缓存命中与重新计算的结果会不同
+        for key in _DERIVED_PARAM_KEYS:
+            self.params.pop(key, None)
+        optimized = _transmission_cache.get(fingerprint)
+        if optimized is not None:
+            # 覆盖全部派生参数，而不是与已有参数合并
+            for key in _OPTIMIZED_PARAM_KEYS:
+                self.params.pop(key, None)
+            self.params.update(copy.deepcopy(optimized))
+            logger.debug(f"数据包 {self.packet_id} 命中优化缓存")
+            return self
+        
+        self.add_content_metadata()
+        self.extract_semantic_info()
+        self.compress_content()
         
-        // 使用方法: efficodeDecompress('${encodedData}');
+        _transmission_cache.put(fingerprint, copy.deepcopy(
+            {k: self.params[k] for k in _OPTIMIZED_PARAM_KEYS if k in self.params}
+        ))
+        return self
+    
+    def create_self_extracting_packet(self, peer: Optional[str] = None,
+                                      session: Optional['PreambleSession'] = None) -> Dict[str, Any]:
         """
+        创建自解压数据包，可直接在浏览器或其他环境中解压
         
-        # Efficode语法结构说明
-        syntax_guide = """
-        Efficode协议格式说明：
-        1. 基本格式: <前缀><操作码>[?<参数>]
-           - 前缀: @ (身份验证), # (请求/数据), ! (确认/错误)
-           - 操作码: DID (身份), REQ (请求), DATA (数据), ACK (确认), ERROR (错误)
-           - 参数: 以key=value形式提供，多个参数用&连接
-        
-        2. 压缩数据: 当content参数长度超过500字节时，将自动压缩
-           - 压缩格式: content=<BASE64编码的压缩数据>&compressed=<压缩方法>
-           - 支持的压缩方法: zlib, gzip, zstd, brotli (自动选择最优)
-        
-        3. 示例:
-           - 请求: #REQ?content=请求内容&type=question
-           - 数据: #DATA?content=数据内容&type=answer
-           - 压缩: #DATA?content=<压缩数据>&compressed=zlib&type=answer
+        解压器和语法说明作为版本化的前导(preamble)发送：未指定对端时每个包都内嵌前导；
+        指定对端时同一会话内只在首次发送，之后只携带preamble_id引用。
+        
+        Args:
+            peer: 接收方名称，None表示独立的数据包（总是内嵌前导）
+            session: 记录前导发送情况的会话，默认使用进程级会话
+            
+        Returns:
+            自解压数据包字典
         """
+        if self.op_code not in ["REQ", "DATA"] or "content" not in self.params:
+            return {"error": "只有REQ和DATA类型的数据包支持自解压"}
         
-        # 创建自解压包
-        self_extracting_packet = {
+        # 已压缩的数据包的原始类型保存在original_type中
+        data_type = self.params.get("original_type", self.params.get("type", "text"))
+        encoded, codec, original_size = self._self_extracting_payload()
+        
+        params: Dict[str, Any] = {
+            "compressed_data": encoded,
+            "codec": codec,
+            "type": data_type,
+            "preamble_id": PREAMBLE_ID,
+            "compressed_size": len(encoded)
+        }
+        if original_size is not None:
+            params["original_size"] = original_size
+            params["compression_ratio"] = len(encoded) / original_size if original_size > 0 else 0
+        
+        session = session or default_preamble_session
+        if peer is None or session.claim(peer):
+            params["preamble"] = get_preamble()
+        
+        return {
             "op_code": self.op_code,
-            "params": {
-                "compressed_data": encoded,
-                "type": self.params.get("type", "text"),
-                "decompressor": decompressor_js.replace('${encodedData}', encoded),
-                "syntax_guide": syntax_guide,
-                "original_size": len(content),
-                "compressed_size": len(encoded),
-                "compression_ratio": len(encoded) / len(content) if len(content) > 0 else 0
-            },
+            "params": params,
             "sender": self.sender,
             "timestamp": self.timestamp,
             "self_extracting": True
         }
+    
+    def _self_extracting_payload(self) -> Tuple[str, str, Optional[int]]:
+        """
+        获取自解压数据包的压缩内容，返回(Base64内容, 压缩方法, 原始长度)
+        
+        已用zlib/gzip压缩的内容直接复用（浏览器端pako均可解压），原始长度此时未知；
+        其他内容用zlib压缩，相同内容的结果会被缓存。
+        """
+        if self.params.get(LEGACY_COMPRESSED_KEY) in (True, 'True', 'true'):
+            return self.params["content"], 'zlib', None
+        if self.params.get('compressed') in SELF_EXTRACTING_CODECS:
+            return self.params["content"], self.params['compressed'], None
+        
+        if self.is_compressed():
+            # 在副本上解压，不改变调用方的数据包
+            content = EfficodePacket(self.op_code, dict(self.params), self.sender).get_content()
+        else:
+            content = self.get_content()
+        digest = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+        encoded = _self_extracting_cache.get(digest)
+        if encoded is None:
+            # 压缩内容 (使用zlib，兼容性最好)，超大内容流式编码避免持有完整的UTF-8副本
+            if len(content) > STREAMING_THRESHOLD:
+                encoded = "".join(compress_stream(content, 'zlib'))
+            else:
+                encoded = base64.b64encode(zlib.compress(content.encode('utf-8'), 9)).decode('utf-8')
+            _self_extracting_cache.put(digest, encoded)
+        return encoded, 'zlib', len(content)
+
+def _batch_workers(count: int, max_workers: Optional[int]) -> int:
+    """计算批处理使用的线程数"""
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(max_workers, count))
+
+def compress_many(packets: List[EfficodePacket], max_workers: Optional[int] = None,
+                  threshold: int = COMPRESSION_THRESHOLD) -> List[EfficodePacket]:
+    """
+    批量压缩数据包
+    
+    zlib/gzip/zstd/brotli在压缩时会释放GIL，因此批量数据包在线程池中并行压缩
+    可以利用多核。每个数据包的压缩结果与单独调用compress_content一致。
+    
+    Args:
+        packets: 待压缩的数据包列表
+        max_workers: 线程数，默认为CPU核数
+        threshold: 压缩阈值
+        
+    Returns:
+        压缩后的数据包列表，顺序与输入一致
+    """
+    if len(packets) <= 1:
+        return [packet.compress_content(threshold) for packet in packets]
+    with ThreadPoolExecutor(max_workers=_batch_workers(len(packets), max_workers)) as executor:
+        return list(executor.map(lambda packet: packet.compress_content(threshold), packets))
+
+def decompress_many(packets: List[EfficodePacket], max_workers: Optional[int] = None) -> List[EfficodePacket]:
+    """
+    批量解压数据包
+    
+    Args:
+        packets: 待解压的数据包列表
+        max_workers: 线程数，默认为CPU核数
         
-        return self_extracting_packet
+    Returns:
+        解压后的数据包列表，顺序与输入一致
+    """
+    if len(packets) <= 1:
+        return [packet.decompress_if_needed() for packet in packets]
+    with ThreadPoolExecutor(max_workers=_batch_workers(len(packets), max_workers)) as executor:
+        return list(executor.map(lambda packet: packet.decompress_if_needed(), packets))
 
 def create_request_packet(content: str, req_type: str, sender: str) -> EfficodePacket:
     """
@@ -425,18 +1090,32 @@ def create_request_packet(content: str, req_type: str, sender: str) -> EfficodeP
     # 智能压缩内容
     return packet.compress_content()
 
-def create_data_packet(content: str, data_type: str, sender: str) -> EfficodePacket:
+def create_data_packet(content: Union[str, IO], data_type: str, sender: str) -> EfficodePacket:
     """
     创建数据数据包
     
     Args:
-        content: 数据内容
+        content: 数据内容，可以是字符串或文件对象；文件对象按块流式压缩，
+            不会整体读入内存
         data_type: 数据类型
         sender: 发送者
         
     Returns:
         EfficodePacket对象
     """
+    if hasattr(content, 'read'):
+        method = default_stream_method()
+        return EfficodePacket(
+            op_code="DATA",
+            params={
+                "content": "".join(compress_stream(content, method)),
+                "type": data_type,
+                "compressed": method,
+                "original_type": data_type
+            },
+            sender=sender
+        )
+    
     packet = EfficodePacket(
         op_code="DATA",
         params={
@@ -496,7 +1175,8 @@ def create_ack_packet(status: str, message: str, sender: str) -> EfficodePacket:
         return packet.compress_content()
     return packet
 
-def create_self_extracting_packet(content: str, data_type: str, sender: str) -> Dict[str, Any]:
+def create_self_extracting_packet(content: str, data_type: str, sender: str, peer: Optional[str] = None,
+                                  session: Optional[PreambleSession] = None) -> Dict[str, Any]:
     """
     创建自解压数据包
     
@@ -504,6 +1184,8 @@ def create_self_extracting_packet(content: str, data_type: str, sender: str) ->
         content: 内容
         data_type: 数据类型
         sender: 发送者
+        peer: 接收方名称，指定时同一会话内只首次附带前导
+        session: 前导发送会话，默认使用进程级会话
         
     Returns:
         自解压数据包字典
@@ -516,4 +1198,4 @@ def create_self_extracting_packet(content: str, data_type: str, sender: str) ->
         },
         sender=sender
     )
-    return packet.create_self_extracting_packet() 
\ No newline at end of file
+    return packet.create_self_extracting_packet(peer, session)
@@ -0,0 +1,254 @@
+"""
+Efficode关键词提取模块
+
+这个模块提供面向中英文混合文本的关键词提取：英文按单词切分，中文按
+字符二元组(bigram)切分（安装了jieba时使用jieba分词），过滤两种语言的
+停用词后用堆选出前k个关键词。可选地从对话日志学习TF-IDF权重。
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter
+from operator import itemgetter
+from typing import Optional, Dict, List, Iterable
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Efficode_Keywords')
+
+# 常量定义
+DEFAULT_TOP_K = 5
+
+ENGLISH_STOPWORDS = frozenset({
+    'the', 'and', 'for', 'with', 'that', 'this', 'are', 'was', 'were', 'but', 'not',
+    'you', 'your', 'they', 'their', 'them', 'his', 'her', 'she', 'him', 'its', 'our',
+    'from', 'have', 'has', 'had', 'will', 'would', 'can', 'could', 'should', 'may',
+    'might', 'been', 'being', 'into', 'onto', 'about', 'than', 'then', 'there', 'here',
+    'what', 'which', 'who', 'whom', 'when', 'where', 'why', 'how', 'all', 'any', 'some',
+    'such', 'also', 'just', 'very', 'more', 'most', 'other', 'only', 'over', 'these',
+    'those', 'each', 'does', 'did', 'doing', 'because', 'while', 'both', 'between',
+})
+
+# 中文虚词，包含这些字的二元组不作为关键词
+CHINESE_STOP_CHARS = frozenset('的了和是在也就都而及与着或之其这那吗呢吧啊么个你我他她它们有被把让给对为以于')
+
+CHINESE_STOPWORDS = frozenset({
+    '我们', '你们', '他们', '她们', '它们', '这个', '那个', '这些', '那些', '什么', '怎么',
+    '为什么', '如何', '可以', '一个', '没有', '因为', '所以', '如果', '就是', '这样',
+    '那样', '自己', '还是', '但是', '而且', '或者', '以及', '已经', '非常', '可能',
+    '需要', '进行', '通过', '关于', '对于', '一些', '一种', '不是', '只是', '其实',
+})
+
+STOPWORDS = ENGLISH_STOPWORDS | CHINESE_STOPWORDS
+
+_CJK_RANGES = [(0x3400, 0x4DBF), (0x4E00, 0x9FFF)]
+
+def _cjk_char_class(excluded: Iterable[str]) -> str:
+    """构造不含指定字符的中文字符集正则片段"""
+    excluded_points = sorted(ord(char) for char in excluded)
+    parts = []
+    for low, high in _CJK_RANGES:
+        start = low
+        for point in excluded_points:
+            if low <= point <= high:
+                if start <= point - 1:
+                    parts.append((start, point - 1))
+                start = point + 1
+        if start <= high:
+            parts.append((start, high))
+    return "".join(f"\\u{a:04x}-\\u{b:04x}" if a != b else f"\\u{a:04x}" for a, b in parts)
+
+# 中文虚词之外的中文字符，连续片段用于分词
+_CJK_CLASS = _cjk_char_class(CHINESE_STOP_CHARS)
+_CJK_FIRST, _CJK_LAST = chr(_CJK_RANGES[0][0]), chr(_CJK_RANGES[-1][1])
+
+# 中文以外的单词（至少3个字符，含带重音符号的拉丁字母等Unicode字母）
+_WORD_CLASS = "^\\W" + "".join(f"\\u{low:04x}-\\u{high:04x}" for low, high in _CJK_RANGES)
+
+# 中文片段和单词一次扫描取出（中文为主的文本中先匹配中文片段更快）
+_TOKEN_PATTERN = re.compile(f"[{_CJK_CLASS}]{{2,}}|[{_WORD_CLASS}]{{3,}}")
+
+def _load_segmenter():
+    """加载可选的jieba分词器"""
+    try:
+        import jieba # type: ignore
+        jieba.setLogLevel(logging.WARNING)
+        return jieba
+    except ImportError:
+        logger.debug("jieba库未安装，中文使用二元组切分")
+        return None
+
+_segmenter = _load_segmenter()
+
+def _split_run(run: str) -> List[str]:
+    """切分一个中文片段（片段中不含虚词）"""
+    if _segmenter is None:
+        return [run[i:i + 2] for i in range(len(run) - 1)]
+    return [word for word in _segmenter.cut(run) if len(word) >= 2]
+
+def count_terms(text: str) -> Counter:
+    """
+    统计文本中候选关键词的词频，已过滤停用词
+
+    一次扫描取出单词和中文片段并先按片段计数：重复出现的片段（常见词组、被虚词隔开的
+    短语）只切分一次，按出现次数展开后在C实现的Counter中统计。
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        词 -> 出现次数
+    """
+    terms: List[str] = []
+    for token, count in Counter(_TOKEN_PATTERN.findall(text.lower())).items():
+        if _CJK_FIRST <= token[0] <= _CJK_LAST:
+            terms += _split_run(token) * count
+        else:
+            terms += [token] * count
+    counts = Counter(terms)
+    for stopword in STOPWORDS:
+        counts.pop(stopword, None)
+    return counts
+
+class KeywordModel:
+    """TF-IDF关键词权重模型"""
+
+    def __init__(self, idf: Optional[Dict[str, float]] = None, documents: int = 0):
+        """
+        初始化模型
+
+        Args:
+            idf: 词 -> 逆文档频率
+            documents: 训练文档数
+        """
+        self.idf: Dict[str, float] = idf or {}
+        self.documents = documents
+        # 未登录词视为只在一篇文档中出现
+        self.default_idf = math.log((1 + documents) / 2) + 1 if documents else 1.0
+
+    @classmethod
+    def fit(cls, documents: Iterable[str]) -> 'KeywordModel':
+        """
+        从文档集合学习IDF
+
+        Args:
+            documents: 文本集合
+
+        Returns:
+            训练好的模型
+        """
+        document_frequency: Counter = Counter()
+        count = 0
+        for document in documents:
+            document_frequency.update(count_terms(document).keys())
+            count += 1
+        idf = {term: math.log((1 + count) / (1 + df)) + 1 for term, df in document_frequency.items()}
+        logger.info(f"关键词模型训练完成，文档数: {count}，词数: {len(idf)}")
+        return cls(idf, count)
+
+    @classmethod
+    def from_logs(cls, logs_dir: str = "logs") -> 'KeywordModel':
+        """
+        从DialogueManager保存的对话日志(dialogue_*.json)学习IDF，每条消息视为一篇文档
+
+        Args:
+            logs_dir: 日志目录
+
+        Returns:
+            训练好的模型
+        """
+        def iter_messages() -> Iterable[str]:
+            if not os.path.isdir(logs_dir):
+                return
+            for filename in sorted(os.listdir(logs_dir)):
+                if not (filename.startswith("dialogue_") and filename.endswith(".json")):
+                    continue
+                try:
+                    with open(os.path.join(logs_dir, filename), 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    logger.warning(f"读取对话日志失败 {filename}: {str(e)}")
+                    continue
+                for message in data.get("messages", []):
+                    content = message.get("content")
+                    if isinstance(content, str):
+                        yield content
+
+        return cls.fit(iter_messages())
+
+    def weight(self, term: str) -> float:
+        """获取词的IDF权重"""
+        return self.idf.get(term, self.default_idf)
+
+    def save(self, path: str) -> None:
+        """保存模型到JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"documents": self.documents, "idf": self.idf}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'KeywordModel':
+        """从JSON文件加载模型"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get("idf", {}), data.get("documents", 0))
+
+_default_model: Optional[KeywordModel] = None
+
+def set_default_model(model: Optional[KeywordModel]) -> None:
+    """设置extract_keywords默认使用的TF-IDF模型，None表示只按词频"""
+    global _default_model
+    _default_model = model
+
+def get_default_model() -> Optional[KeywordModel]:
+    """获取extract_keywords默认使用的TF-IDF模型"""
+    return _default_model
+
+def load_default_model(logs_dir: str = "logs") -> Optional[KeywordModel]:
+    """
+    启动时从对话日志学习TF-IDF模型并设为默认模型
+
+    Args:
+        logs_dir: 日志目录
+
+    Returns:
+        学习到的模型；没有可用的对话日志时返回None（仍只按词频）
+    """
+    try:
+        model = KeywordModel.from_logs(logs_dir)
+    except Exception as e:
+        logger.warning(f"加载关键词模型失败，关键词按词频提取: {str(e)}")
+        return None
+    if not model.documents:
+        return None
+    set_default_model(model)
+    return model
+
+def extract_keywords(text: str, top_k: int = DEFAULT_TOP_K, model: Optional[KeywordModel] = None) -> List[str]:
+    """
+    提取关键词
+
+    Args:
+        text: 输入文本
+        top_k: 返回的关键词数量
+        model: TF-IDF模型，默认使用set_default_model设置的模型；没有模型时按词频排序
+
+    Returns:
+        关键词列表，按权重从高到低，权重相同时按首次出现顺序
+    """
+    counts = count_terms(text)
+    if not counts:
+        return []
+    model = model or _default_model
+    if model is None:
+        top = heapq.nlargest(top_k, counts.items(), key=itemgetter(1))
+    else:
+        top = heapq.nlargest(top_k, ((term, tf * model.weight(term)) for term, tf in counts.items()),
+                             key=itemgetter(1))
+    return [term for term, _ in top]
@@ -0,0 +1,592 @@
+"""
+Efficode传输模块
+
+这个模块让智能体之间的数据包交换不再局限于同一进程内的方法调用：
+提供进程内队列、Unix域套接字和TCP三种传输方式，统一使用长度前缀分帧，
+客户端复用连接并限制并发连接数（背压）。AgentServer把一个智能体暴露在
+某个传输上，RemoteAgent是其客户端代理，接口与AIAgent一致，DialogueManager
+可以直接驱动运行在其他进程或主机上的智能体。
+
+用法（在独立进程中运行智能体）:
+    python efficode_transport.py serve --name 慧眼 --address tcp://127.0.0.1:9100
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import multiprocessing
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, List, Callable, Union, Tuple
+
+from efficode_core import EfficodePacket
+from efficode_keywords import KeywordModel, get_default_model, set_default_model
+from cancellation import Cancelled, DeadlineExceeded, CancelToken, cancel_scope, current_token
+from circuit_breaker import CircuitOpenError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Efficode_Transport')
+
+# 常量定义
+FRAME_HEADER = struct.Struct('>I')  # 4字节大端长度前缀
+MAX_FRAME_SIZE = 64 * 1024 * 1024  # 单帧上限（字节），超过视为协议错误
+SMALL_FRAME_SIZE = 64 * 1024  # 小于此大小的帧与长度前缀合并为一次发送
+DEFAULT_QUEUE_SIZE = 64  # 进程内传输每个方向的队列容量（帧）
+DEFAULT_MAX_CONNECTIONS = 4  # 客户端到同一服务端的最大并发连接数
+DEFAULT_CONNECT_TIMEOUT = 10.0  # 客户端等待服务端就绪的时间（秒）
+
+class ConnectionClosed(Exception):
+    """连接已被对端关闭"""
+
+class RemoteError(Exception):
+    """远端智能体处理请求时出错"""
+
+class Connection(ABC):
+    """双向的帧连接"""
+
+    @abstractmethod
+    def send_frame(self, payload: bytes) -> None:
+        """发送一帧"""
+
+    @abstractmethod
+    def recv_frame(self) -> bytes:
+        """接收一帧，连接关闭时抛出ConnectionClosed"""
+
+    @abstractmethod
+    def close(self) -> None:
+        """关闭连接，唤醒阻塞的读取"""
+
+class SocketConnection(Connection):
+    """基于流式套接字的帧连接：每帧为4字节长度前缀加负载"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._reader = sock.makefile('rb')
+
+    def send_frame(self, payload: bytes) -> None:
+        if len(payload) > MAX_FRAME_SIZE:
+            raise ValueError(f"帧大小 {len(payload)} 超过上限 {MAX_FRAME_SIZE}")
+        header = FRAME_HEADER.pack(len(payload))
+        if len(payload) < SMALL_FRAME_SIZE:
+            self.sock.sendall(header + payload)
+        else:
+            # 大帧分两次发送，避免为拼接复制整个负载
+            self.sock.sendall(header)
+            self.sock.sendall(payload)
+
+    def _read_exact(self, size: int) -> bytes:
+        data = self._reader.read(size)
+        if data is None or len(data) < size:
+            raise ConnectionClosed("连接已关闭")
+        return data
+
+    def recv_frame(self) -> bytes:
+        (size,) = FRAME_HEADER.unpack(self._read_exact(FRAME_HEADER.size))
+        if size > MAX_FRAME_SIZE:
+            raise ConnectionClosed(f"帧大小 {size} 超过上限 {MAX_FRAME_SIZE}，断开连接")
+        return self._read_exact(size)
+
+    def close(self) -> None:
+        try:
+            # 先关闭读写方向，唤醒其他线程中阻塞的读取（取消时从其他线程关闭连接）
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self._reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+_CLOSED = object()  # 进程内队列的关闭标记
+
+class QueueConnection(Connection):
+    """进程内的帧连接：每个方向一个有界队列，队列满时发送方阻塞（背压）"""
+
+    def __init__(self, inbox: queue.Queue, outbox: queue.Queue):
+        self.inbox = inbox
+        self.outbox = outbox
+
+    def send_frame(self, payload: bytes) -> None:
+        self.outbox.put(payload)
+
+    def recv_frame(self) -> bytes:
+        payload = self.inbox.get()
+        if payload is _CLOSED:
+            raise ConnectionClosed("连接已关闭")
+        return payload
+
+    def close(self) -> None:
+        self.outbox.put(_CLOSED)
+        try:
+            # 唤醒本端阻塞的读取
+            self.inbox.put_nowait(_CLOSED)
+        except queue.Full:
+            pass
+
+class Transport(ABC):
+    """传输方式：客户端用connect()建立连接，服务端用serve()接受连接"""
+
+    address = ""
+
+    @abstractmethod
+    def connect(self) -> Connection:
+        """建立到服务端的连接"""
+
+    @abstractmethod
+    def serve(self, handle_connection: Callable[[Connection], None]) -> None:
+        """在后台线程中接受连接，每个连接交给handle_connection在独立线程中处理"""
+
+    def close(self) -> None:
+        """停止接受新连接"""
+
+class InProcessTransport(Transport):
+    """进程内传输，用于测试和单进程部署，与套接字传输走相同的分帧和编解码路径"""
+
+    address = "inproc"
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._handler: Optional[Callable[[Connection], None]] = None
+
+    def connect(self) -> Connection:
+        if self._handler is None:
+            raise ConnectionRefusedError("进程内传输尚未有服务端")
+        to_server: queue.Queue = queue.Queue(self.queue_size)
+        to_client: queue.Queue = queue.Queue(self.queue_size)
+        server_side = QueueConnection(to_server, to_client)
+        threading.Thread(target=self._handler, args=(server_side,), daemon=True).start()
+        return QueueConnection(to_client, to_server)
+
+    def serve(self, handle_connection: Callable[[Connection], None]) -> None:
+        self._handler = handle_connection
+
+    def close(self) -> None:
+        self._handler = None
+
+class _SocketTransport(Transport):
+    """套接字传输的公共实现"""
+
+    family = socket.AF_INET
+
+    def __init__(self):
+        self._listener: Optional[socket.socket] = None
+
+    @abstractmethod
+    def _bind_address(self) -> Any:
+        """套接字地址"""
+
+    def _configure(self, sock: socket.socket) -> None:
+        """连接建立后的套接字选项"""
+
+    def connect(self) -> Connection:
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._bind_address())
+        except OSError:
+            sock.close()
+            raise
+        self._configure(sock)
+        return SocketConnection(sock)
+
+    def _listen(self) -> socket.socket:
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.bind(self._bind_address())
+        sock.listen()
+        return sock
+
+    def serve(self, handle_connection: Callable[[Connection], None]) -> None:
+        self._listener = self._listen()
+        listener = self._listener
+
+        def accept_loop() -> None:
+            while True:
+                try:
+                    sock, _ = listener.accept()
+                except OSError:
+                    break  # 监听套接字已关闭
+                self._configure(sock)
+                threading.Thread(target=handle_connection, args=(SocketConnection(sock),), daemon=True).start()
+
+        threading.Thread(target=accept_loop, name=f"accept-{self.address}", daemon=True).start()
+        logger.info(f"正在监听 {self.address}")
+
+    def close(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+class UnixSocketTransport(_SocketTransport):
+    """Unix域套接字传输，用于同一主机上的多个进程"""
+
+    family = getattr(socket, 'AF_UNIX', socket.AF_INET)
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.address = f"unix:{path}"
+
+    def _bind_address(self) -> str:
+        return self.path
+
+    def _listen(self) -> socket.socket:
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # 清理上次异常退出遗留的套接字文件
+        return super()._listen()
+
+    def close(self) -> None:
+        super().close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class TcpTransport(_SocketTransport):
+    """TCP传输，用于跨主机部署"""
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.address = f"tcp://{host}:{port}"
+
+    def _bind_address(self) -> Tuple[str, int]:
+        return (self.host, self.port)
+
+    def _listen(self) -> socket.socket:
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(self._bind_address())
+        sock.listen()
+        if self.port == 0:
+            # 端口0表示由系统分配，记下实际端口供客户端连接
+            self.port = sock.getsockname()[1]
+            self.address = f"tcp://{self.host}:{self.port}"
+        return sock
+
+    def _configure(self, sock: socket.socket) -> None:
+        # 请求/响应式交互，关闭Nagle算法降低延迟
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+def transport_from_address(address: str) -> Transport:
+    """
+    根据地址创建传输
+
+    Args:
+        address: inproc、unix:<路径> 或 tcp://<主机>:<端口>
+
+    Returns:
+        传输对象
+    """
+    if address == "inproc":
+        return InProcessTransport()
+    if address.startswith("unix:"):
+        return UnixSocketTransport(address[len("unix:"):])
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        return TcpTransport(host, int(port))
+    raise ValueError(f"不支持的传输地址: {address}")
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, ensure_ascii=False).encode('utf-8')
+
+def _decode(frame: bytes) -> Dict[str, Any]:
+    return json.loads(frame.decode('utf-8'))
+
+def encode_packet(packet: EfficodePacket) -> Dict[str, Any]:
+    """把数据包编码为线上格式：Efficode字符串加上不在字符串中的身份信息"""
+    return {"wire": packet.to_string(), "sender": packet.sender, "id": packet.packet_id, "seq": packet.seq}
+
+def decode_packet(data: Dict[str, Any]) -> EfficodePacket:
+    """从线上格式还原数据包，保留原数据包的ID和序列号以便接收方去重"""
+    packet = EfficodePacket.from_string(data["wire"], data["sender"])
+    packet.packet_id = data["id"]
+    if data.get("seq") is not None:
+        packet.seq = data["seq"]
+    return packet
+
+class AgentServer:
+    """
+    智能体服务端，把一个智能体暴露在某个传输上
+
+    每个连接上的请求按顺序处理；流式回复以chunk帧逐段返回，最后是result或error帧。
+    """
+
+    def __init__(self, agent: Any, transport: Transport):
+        """
+        初始化服务端
+
+        Args:
+            agent: 智能体（AIAgent或接口兼容的对象）
+            transport: 传输方式
+        """
+        self.agent = agent
+        self.transport = transport
+        self._stopped = threading.Event()
+
+    def start(self) -> 'AgentServer':
+        """开始在后台接受连接"""
+        self.transport.serve(self._handle_connection)
+        return self
+
+    def serve_forever(self) -> None:
+        """开始接受连接并阻塞，直到stop()被调用"""
+        self.start()
+        self._stopped.wait()
+
+    def stop(self) -> None:
+        """停止服务"""
+        self.transport.close()
+        self._stopped.set()
+
+    def _handle_connection(self, connection: Connection) -> None:
+        """处理一个连接上的所有请求"""
+        try:
+            while True:
+                try:
+                    request = _decode(connection.recv_frame())
+                except ConnectionClosed:
+                    break
+                try:
+                    # 客户端传来的剩余时间作为本次调用的截止时间
+                    timeout = request.get("timeout")
+                    with cancel_scope(CancelToken(timeout) if timeout is not None else None):
+                        result = self._dispatch(request, connection)
+                    connection.send_frame(_encode({"result": result}))
+                except Cancelled as e:
+                    connection.send_frame(_encode({"error": str(e), "cancelled": True}))
+                except CircuitOpenError as e:
+                    connection.send_frame(_encode({"error": str(e), "retry_after": e.retry_after}))
+                except Exception as e:
+                    logger.error(f"处理远程请求 {request.get('method')} 出错: {str(e)}")
+                    connection.send_frame(_encode({"error": str(e)}))
+        except OSError as e:
+            logger.warning(f"连接异常断开: {str(e)}")
+        finally:
+            connection.close()
+
+    def _dispatch(self, request: Dict[str, Any], connection: Connection) -> Any:
+        """执行请求对应的智能体方法"""
+        method = request.get("method")
+        args = request.get("args", {})
+        on_chunk = None
+        if args.get("stream"):
+            on_chunk = lambda text: connection.send_frame(_encode({"chunk": text}))
+
+        if method == "process_message":
+            packet = decode_packet(args["packet"])
+            if on_chunk is not None:
+                response = self.agent.process_message(packet, on_chunk=on_chunk)
+            else:
+                response = self.agent.process_message(packet)
+            return response.to_string() if isinstance(response, EfficodePacket) else response
+        if method == "send_message":
+            message = decode_packet(args["packet"]) if "packet" in args else args["text"]
+            usage: Dict[str, Any] = {}
+            response = self.agent.send_message(message, on_chunk, args.get("commit_context", True), usage)
+            return {"response": response, "usage": usage}
+        if method == "commit_exchange":
+            self.agent.commit_exchange(args["user_content"], args["assistant_content"])
+            return None
+        if method == "describe":
+            return {
+                "name": self.agent.name,
+                "did": self.agent.did,
+                "role": self.agent.role,
+                "model_profile": getattr(self.agent, "model_profile", {"name": "default"})
+            }
+        if method == "usage_stats":
+            return getattr(self.agent, "usage_stats", {})
+        if method == "router_stats":
+            router = getattr(self.agent, "router", None)
+            return router.stats() if router is not None else []
+        raise ValueError(f"不支持的远程方法: {method}")
+
+class _RemoteRouter:
+    """远端智能体的模型路由统计代理"""
+
+    def __init__(self, agent: 'RemoteAgent'):
+        self._agent = agent
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return self._agent._call("router_stats")
+
+class RemoteAgent:
+    """
+    远端智能体的客户端代理，接口与AIAgent一致
+
+    线程安全：每次调用从连接池借用一个连接，用完归还以便复用；
+    并发调用数达到max_connections时后续调用阻塞等待（背压）。
+    """
+
+    def __init__(self, transport: Union[Transport, str], max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        """
+        初始化代理并获取远端智能体的身份信息
+
+        Args:
+            transport: 传输对象或地址（unix:<路径> / tcp://<主机>:<端口>）
+            max_connections: 最大并发连接数
+            connect_timeout: 等待服务端就绪的时间（秒）
+        """
+        self.transport = transport_from_address(transport) if isinstance(transport, str) else transport
+        self.connect_timeout = connect_timeout
+        self._idle: List[Connection] = []
+        self._idle_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.router = _RemoteRouter(self)
+
+        info = self._call("describe")
+        self.name: str = info["name"]
+        self.did: str = info["did"]
+        self.role: Dict[str, Any] = info["role"]
+        self.model_profile: Dict[str, Any] = info["model_profile"]
+
+    def _open(self) -> Connection:
+        """建立新连接，服务端尚未就绪时在connect_timeout内重试"""
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                return self.transport.connect()
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _call(self, method: str, on_chunk: Optional[Callable[[str], None]] = None, **args: Any) -> Any:
+        """
+        发送一个请求并等待结果，期间收到的chunk帧交给on_chunk
+
+        当前上下文有取消令牌时，剩余时间随请求发给服务端作为截止时间；
+        取消时关闭连接，中止等待。
+        """
+        if on_chunk is not None:
+            args["stream"] = True
+        request: Dict[str, Any] = {"method": method, "args": args}
+        token = current_token()
+        if token is not None:
+            token.check()
+            request["timeout"] = token.remaining()
+        with self._slots:
+            with self._idle_lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = self._open()
+            unregister = token.on_cancel(connection.close) if token is not None else None
+            try:
+                connection.send_frame(_encode(request))
+                while True:
+                    reply = _decode(connection.recv_frame())
+                    if "chunk" in reply:
+                        if on_chunk is not None:
+                            on_chunk(reply["chunk"])
+                        continue
+                    break
+            except (OSError, ConnectionClosed):
+                connection.close()
+                if token is not None:
+                    token.check()
+                raise
+            except BaseException:
+                # on_chunk出错或被取消时连接上可能还有未读的帧，不能放回空闲连接
+                connection.close()
+                raise
+            finally:
+                if unregister is not None:
+                    unregister()
+            with self._idle_lock:
+                self._idle.append(connection)
+        if reply.get("cancelled"):
+            raise DeadlineExceeded(reply["error"])
+        if "retry_after" in reply:
+            raise CircuitOpenError(reply["error"], reply["retry_after"])
+        if "error" in reply:
+            raise RemoteError(reply["error"])
+        return reply.get("result")
+
+    def process_message(self, packet: EfficodePacket,
+                        on_chunk: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """处理数据包（远端执行），返回Efficode格式的响应字符串"""
+        return self._call("process_message", on_chunk, packet=encode_packet(packet))
+
+    def send_message(self, message: Union[str, EfficodePacket], on_chunk: Optional[Callable[[str], None]] = None,
+                     commit_context: bool = True, usage: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """调用远端智能体的send_message"""
+        args: Dict[str, Any] = {"commit_context": commit_context}
+        if isinstance(message, EfficodePacket):
+            args["packet"] = encode_packet(message)
+        else:
+            args["text"] = message
+        result = self._call("send_message", on_chunk, **args)
+        if usage is not None:
+            usage.update(result.get("usage") or {})
+        return result.get("response")
+
+    def commit_exchange(self, user_content: str, assistant_content: str) -> None:
+        """把一次问答写入远端智能体的对话上下文"""
+        self._call("commit_exchange", user_content=user_content, assistant_content=assistant_content)
+
+    @property
+    def usage_stats(self) -> Dict[str, Any]:
+        """远端智能体的令牌用量统计"""
+        return self._call("usage_stats")
+
+    def close(self) -> None:
+        """关闭所有空闲连接"""
+        with self._idle_lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+def _run_agent_server(name: str, address: str, api_key: Optional[str],
+                      keyword_model: Optional[KeywordModel] = None) -> None:
+    """工作进程入口：沿用父进程的关键词模型，创建智能体并在指定地址上提供服务"""
+    from ai_agent import AIAgent
+    if keyword_model is not None:
+        set_default_model(keyword_model)
+    agent = AIAgent(name, api_key)
+    AgentServer(agent, transport_from_address(address)).serve_forever()
+
+def spawn_agent_process(name: str, address: str, api_key: Optional[str] = None,
+                        max_connections: int = DEFAULT_MAX_CONNECTIONS) -> Tuple[multiprocessing.Process, RemoteAgent]:
+    """
+    在独立的工作进程中运行智能体，返回进程和连接到它的代理
+
+    Args:
+        name: 智能体名称
+        address: 服务地址（unix:<路径> 或 tcp://<主机>:<端口>）
+        api_key: API密钥，环境变量未配置提供方池时使用
+        max_connections: 代理的最大并发连接数
+
+    Returns:
+        (工作进程, 远端智能体代理)
+    """
+    process = multiprocessing.get_context("spawn").Process(
+        target=_run_agent_server, args=(name, address, api_key, get_default_model()), name=f"agent-{name}", daemon=True
+    )
+    process.start()
+    return process, RemoteAgent(address, max_connections=max_connections)
+
+def main(argv: List[str]) -> None:
+    """命令行入口：在当前进程中运行一个智能体服务"""
+    parser = argparse.ArgumentParser(description="Efficode智能体服务")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="运行智能体服务")
+    serve_parser.add_argument("--name", required=True, help="智能体名称")
+    serve_parser.add_argument("--address", required=True, help="unix:<路径> 或 tcp://<主机>:<端口>")
+    args = parser.parse_args(argv)
+    try:
+        _run_agent_server(args.name, args.address, None)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
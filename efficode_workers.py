@@ -0,0 +1,253 @@
+"""
+Efficode工作进程池模块
+
+压缩、Base64编码、关键词提取和JSON处理都受GIL限制，在单个进程中与网络等待
+串行执行。这个模块把CPU密集的数据包处理阶段（优化、压缩、解压）交给工作进程池，
+充分利用多核：
+
+- 交接时只传递操作码和参数字典（内容字符串按原样序列化，不经过Efficode线格式
+  的拼接与解析），处理结果同样以参数字典返回并写回原数据包对象；
+- 小于OFFLOAD_THRESHOLD的内容直接在本进程处理，进程间通信的开销不值得；
+- 监督者在工作进程崩溃(BrokenProcessPool)时重建进程池并重新提交未完成的任务，
+  重启次数超过上限后退化为在本进程中处理。
+
+环境变量EFFICODE_PACKET_WORKERS设为正整数时，进程级默认池使用该数量的工作进程；
+未设置时optimize_packet()等函数直接在本进程中处理。
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any, List, Callable
+
+from efficode_core import EfficodePacket, COMPRESSION_THRESHOLD
+from efficode_keywords import KeywordModel, get_default_model, set_default_model
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Efficode_Workers')
+
+# 常量定义
+PACKET_WORKERS_ENV = "EFFICODE_PACKET_WORKERS"  # 默认池的工作进程数，未设置或为0时不启用
+OFFLOAD_THRESHOLD = 16 * 1024  # 内容长度不小于此值的数据包才交给工作进程
+MAX_RESTARTS = 5  # 进程池崩溃后最多重建的次数，超过后退化为本进程处理
+MAX_TASK_ATTEMPTS = 2  # 单个任务遇到进程池崩溃时最多提交的次数（避免"毒包"反复击垮进程池）
+
+def _stage_optimize(packet: EfficodePacket) -> EfficodePacket:
+    return packet.optimize_for_transmission()
+
+def _stage_compress(packet: EfficodePacket, threshold: int = COMPRESSION_THRESHOLD) -> EfficodePacket:
+    return packet.compress_content(threshold)
+
+def _stage_decompress(packet: EfficodePacket) -> EfficodePacket:
+    return packet.decompress_if_needed()
+
+# 阶段名 -> 处理函数，进程间只传递阶段名
+STAGES: Dict[str, Callable[..., EfficodePacket]] = {
+    "optimize": _stage_optimize,
+    "compress": _stage_compress,
+    "decompress": _stage_decompress,
+}
+
+def _init_worker(log_level: int, keyword_model: Optional[KeywordModel] = None) -> None:
+    """工作进程初始化：沿用父进程的日志级别（避免逐包日志拖慢处理）和关键词模型"""
+    logging.getLogger().setLevel(log_level)
+    set_default_model(keyword_model)
+
+def _noop(_: int) -> None:
+    """预热用的空任务（不重新初始化工作进程，以免覆盖initargs传入的关键词模型）"""
+
+def _run_stage(stage: str, op_code: str, params: Dict[str, Any], sender: str,
+               options: Dict[str, Any]) -> Dict[str, Any]:
+    """工作进程入口：在参数字典上执行一个处理阶段，返回处理后的参数字典"""
+    packet = EfficodePacket(op_code, params, sender)
+    return STAGES[stage](packet, **options).params
+
+def _content_size(packet: EfficodePacket) -> int:
+    content = packet.params.get("content")
+    return len(content) if isinstance(content, str) else 0
+
+class PacketWorkerPool:
+    """
+    数据包处理进程池
+
+    线程安全；submit()返回的Future完成时，原数据包对象已被更新（与直接调用
+    optimize_for_transmission等方法一样原地修改并返回该对象）。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, offload_threshold: int = OFFLOAD_THRESHOLD,
+                 max_restarts: int = MAX_RESTARTS):
+        """
+        初始化进程池（工作进程在首次提交任务时启动）
+
+        Args:
+            max_workers: 工作进程数，默认为CPU核数
+            offload_threshold: 内容长度不小于此值的数据包才交给工作进程
+            max_restarts: 进程池崩溃后最多重建的次数
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.offload_threshold = offload_threshold
+        self.max_restarts = max_restarts
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._generation = 0
+        self._degraded = False
+        self._lock = threading.Lock()
+        self.stats = {"offloaded": 0, "inline": 0, "restarts": 0, "resubmitted": 0, "failed": 0}
+
+    def _current(self) -> Optional[ProcessPoolExecutor]:
+        """获取当前的进程池，必要时创建；已退化时返回None"""
+        with self._lock:
+            if self._degraded:
+                return None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(logging.getLogger().level, get_default_model())
+                )
+            return self._executor
+
+    def _restart(self, broken: ProcessPoolExecutor) -> None:
+        """重建崩溃的进程池（多个任务同时报告同一次崩溃时只重建一次）"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._generation += 1
+            self.stats["restarts"] += 1
+            if self.stats["restarts"] > self.max_restarts:
+                self._degraded = True
+                logger.error(f"工作进程池已崩溃 {self.stats['restarts']} 次，之后改为在本进程中处理数据包")
+            else:
+                logger.warning(f"工作进程崩溃，重建进程池（第 {self.stats['restarts']} 次）")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _run_inline(self, stage: str, packet: EfficodePacket, options: Dict[str, Any], result: Future) -> None:
+        with self._lock:
+            self.stats["inline"] += 1
+        try:
+            result.set_result(STAGES[stage](packet, **options))
+        except Exception as e:
+            result.set_exception(e)
+
+    def submit(self, stage: str, packet: EfficodePacket, **options: Any) -> 'Future[EfficodePacket]':
+        """
+        提交一个处理阶段
+
+        Args:
+            stage: 阶段名（optimize / compress / decompress）
+            packet: 数据包
+            **options: 阶段参数（例如compress的threshold）
+
+        Returns:
+            完成时结果为更新后的原数据包对象
+        """
+        if stage not in STAGES:
+            raise ValueError(f"不支持的处理阶段: {stage}")
+        result: Future = Future()
+        if _content_size(packet) < self.offload_threshold:
+            self._run_inline(stage, packet, options, result)
+        else:
+            self._dispatch(stage, packet, options, result, 1)
+        return result
+
+    def _dispatch(self, stage: str, packet: EfficodePacket, options: Dict[str, Any],
+                  result: Future, attempt: int) -> None:
+        """把任务提交到当前的进程池，进程池已崩溃时重建后重试"""
+        executor = self._current()
+        if executor is None:
+            self._run_inline(stage, packet, options, result)
+            return
+        try:
+            task = executor.submit(_run_stage, stage, packet.op_code, packet.params, packet.sender, options)
+        except (BrokenProcessPool, RuntimeError):
+            # 进程池在提交前已崩溃或被关闭
+            self._restart(executor)
+            self._dispatch(stage, packet, options, result, attempt)
+            return
+        with self._lock:
+            self.stats["offloaded"] += 1
+        task.add_done_callback(
+            lambda done: self._on_done(done, executor, stage, packet, options, result, attempt)
+        )
+
+    def _on_done(self, task: Future, executor: ProcessPoolExecutor, stage: str, packet: EfficodePacket,
+                 options: Dict[str, Any], result: Future, attempt: int) -> None:
+        """任务完成回调：写回结果，或在进程池崩溃时重新提交"""
+        if task.cancelled():
+            error: Optional[BaseException] = BrokenProcessPool("任务随崩溃的进程池一起被取消")
+        else:
+            error = task.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._restart(executor)
+            if attempt < MAX_TASK_ATTEMPTS:
+                with self._lock:
+                    self.stats["resubmitted"] += 1
+                self._dispatch(stage, packet, options, result, attempt + 1)
+                return
+            with self._lock:
+                self.stats["failed"] += 1
+            logger.error(f"数据包 {packet.packet_id} 的 {stage} 阶段使工作进程连续崩溃，放弃处理")
+        if error is not None:
+            result.set_exception(error)
+            return
+        packet.params = task.result()
+        result.set_result(packet)
+
+    def run(self, stage: str, packet: EfficodePacket, **options: Any) -> EfficodePacket:
+        """同步执行一个处理阶段，返回更新后的原数据包对象"""
+        return self.submit(stage, packet, **options).result()
+
+    def map(self, stage: str, packets: List[EfficodePacket], **options: Any) -> List[EfficodePacket]:
+        """批量执行一个处理阶段，返回顺序与输入一致"""
+        futures = [self.submit(stage, packet, **options) for packet in packets]
+        return [future.result() for future in futures]
+
+    def warm_up(self) -> None:
+        """预先启动所有工作进程，避免首批任务承担进程启动开销"""
+        executor = self._current()
+        if executor is not None:
+            list(executor.map(_noop, range(self.max_workers)))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+_default_pool: Optional[PacketWorkerPool] = None
+_default_pool_lock = threading.Lock()
+
+def get_default_pool() -> Optional[PacketWorkerPool]:
+    """获取进程级共享的工作进程池，环境变量EFFICODE_PACKET_WORKERS未设置或为0时返回None"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            workers = int(os.getenv(PACKET_WORKERS_ENV, "0") or 0)
+            if workers > 0:
+                _default_pool = PacketWorkerPool(workers)
+        return _default_pool
+
+def set_default_pool(pool: Optional[PacketWorkerPool]) -> None:
+    """设置进程级共享的工作进程池"""
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = pool
+
+def optimize_packet(packet: EfficodePacket) -> EfficodePacket:
+    """优化数据包以提高传输效率，启用了默认池时在工作进程中执行"""
+    pool = get_default_pool()
+    return pool.run("optimize", packet) if pool is not None else packet.optimize_for_transmission()
+
+def compress_packet(packet: EfficodePacket, threshold: int = COMPRESSION_THRESHOLD) -> EfficodePacket:
+    """压缩数据包内容，启用了默认池时在工作进程中执行"""
+    pool = get_default_pool()
+    return pool.run("compress", packet, threshold=threshold) if pool is not None else packet.compress_content(threshold)
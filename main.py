@@ -6,12 +6,19 @@ Efficode AI通信系统主程序
 
 import os
 import sys
+import tempfile
 import logging
 import argparse
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, Any
+
+import requests
 
 from ai_agent import AIAgent, AGENT_ROLES
+from api_client import ApiClient
 from dialogue_manager import DialogueManager
+from efficode_keywords import load_default_model
+from efficode_transport import spawn_agent_process
+from profiling import SAMPLE, PROFILE_MODES
 
 # 配置日志
 logging.basicConfig(
@@ -20,6 +27,45 @@ logging.basicConfig(
 )
 logger = logging.getLogger('Main')
 
+# 环境变量EFFICODE_AGENT_TRANSPORT设为unix或tcp时，每个智能体运行在独立的工作进程中
+AGENT_TRANSPORT_ENV = "EFFICODE_AGENT_TRANSPORT"
+AGENT_TCP_BASE_PORT = 9100  # tcp模式下第i个智能体监听 127.0.0.1:(9100+i)
+
+# 对话时限（秒）：超时后中止进行中的API调用，已完成的部分照常保存
+DIALOGUE_TIMEOUT = 900
+ROUND_TIMEOUT = 240
+
+def create_agents(names: Tuple[str, str], client: ApiClient, api_key: str) -> list:
+    """
+    创建智能体：默认在本进程中创建，配置了EFFICODE_AGENT_TRANSPORT时在工作进程中创建
+
+    Args:
+        names: 智能体名称
+        client: 本进程共享的API客户端
+        api_key: 工作进程使用的API密钥
+
+    Returns:
+        智能体列表（AIAgent或RemoteAgent代理）
+    """
+    transport = os.getenv(AGENT_TRANSPORT_ENV)
+    if not transport:
+        return [AIAgent(name, client=client) for name in names]
+
+    if transport == "unix":
+        socket_dir = tempfile.mkdtemp(prefix="efficode-")
+        addresses = [f"unix:{os.path.join(socket_dir, f'agent-{i}.sock')}" for i in range(len(names))]
+    elif transport == "tcp":
+        addresses = [f"tcp://127.0.0.1:{AGENT_TCP_BASE_PORT + i}" for i in range(len(names))]
+    else:
+        raise ValueError(f"{AGENT_TRANSPORT_ENV} 只支持 unix 或 tcp，当前为: {transport}")
+
+    agents = []
+    for name, address in zip(names, addresses):
+        _, agent = spawn_agent_process(name, address, api_key)
+        logger.info(f"智能体 {name} 运行在工作进程中: {address}")
+        agents.append(agent)
+    return agents
+
 def get_api_key() -> str:
     """获取API密钥"""
     # 首先尝试从环境变量获取
@@ -39,48 +85,42 @@ def get_api_key() -> str:
         print(f"使用默认密钥: {default_key[:5]}...{default_key[-5:]}")
         return default_key
 
-def test_api_connection(api_key: str) -> bool:
-    """测试API连接是否正常"""
+def test_api_connection(client: ApiClient) -> bool:
+    """测试API连接是否正常：逐个检测提供方池中的成员，失败的成员会计入健康检查"""
     print("\n正在测试API连接...")
-    try:
-        import requests
-        
-        test_headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        test_data = {
-            "model": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
-            "messages": [{"role": "user", "content": "你好"}],
-            "stream": False,
-            "max_tokens": 50
-        }
-        
-        response = requests.post(
-            "https://api.siliconflow.cn/v1/chat/completions",
-            headers=test_headers,
-            json=test_data,
-            timeout=15  # 增加超时时间
-        )
-        
-        if response.status_code == 200:
-            print("✓ API连接测试成功！")
-            return True
-        else:
-            print(f"✗ API连接测试失败: 状态码 {response.status_code}")
-            error_message = response.json().get("error", {}).get("message", "未知错误")
-            print(f"  错误信息: {error_message}")
-            return False
+    test_data = {
+        "model": "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B",
+        "messages": [{"role": "user", "content": "你好"}],
+        "stream": False,
+        "max_tokens": 50
+    }
+    
+    healthy = 0
+    for member in client.pool.members:
+        try:
+            response = client.chat_completion(test_data, timeout=15, member=member)  # 增加超时时间
             
-    except requests.exceptions.Timeout:
-        print("✗ API连接测试失败: 连接超时")
-        return False
-    except requests.exceptions.ConnectionError:
-        print("✗ API连接测试失败: 无法连接到服务器")
-        return False
-    except Exception as e:
-        print(f"✗ API连接测试失败: {str(e)}")
-        return False
+            if response.status_code == 200:
+                print(f"✓ API连接测试成功！({member.name} @ {member.api_base})")
+                healthy += 1
+            else:
+                print(f"✗ API连接测试失败: {member.name} 状态码 {response.status_code}")
+                try:
+                    error_message = response.json().get("error", {}).get("message", "未知错误")
+                except ValueError:
+                    error_message = response.text[:200]
+                print(f"  错误信息: {error_message}")
+                
+        except requests.exceptions.Timeout:
+            print(f"✗ API连接测试失败: {member.name} 连接超时")
+        except requests.exceptions.ConnectionError:
+            print(f"✗ API连接测试失败: {member.name} 无法连接到服务器")
+        except Exception as e:
+            print(f"✗ API连接测试失败: {member.name} {str(e)}")
+    
+    if len(client.pool.members) > 1:
+        print(f"提供方池: {healthy}/{len(client.pool.members)} 个成员可用")
+    return healthy > 0
 
 def select_agents() -> Tuple[str, str]:
     """选择对话智能体"""
@@ -151,8 +191,25 @@ def select_dialogue_mode() -> Tuple[str, Optional[str], Optional[int]]:
         except ValueError:
             print("\n请输入有效的数字。")
 
+def parse_args() -> argparse.Namespace:
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="Efficode 高认知探索对话系统")
+    parser.add_argument("--profile", nargs="?", const=SAMPLE, choices=PROFILE_MODES,
+                        help="剖析对话（默认sample低开销采样，cprofile为确定性剖析），"
+                             "折叠调用栈/pstats文件和耗时摘要写到logs目录的对话记录旁边")
+    return parser.parse_args()
+
+def print_profile_report(report: Dict[str, Any]) -> None:
+    """打印对话剖析报告的子系统耗时和输出文件"""
+    total = sum(report["subsystems"].values()) or 1.0
+    print(f"\n性能剖析（{report['mode']}）: " + "，".join(
+        f"{name} {seconds:.2f} 秒 ({seconds / total:.0%})" for name, seconds in report["subsystems"].items()))
+    for path in report["files"]:
+        print(f"- {path}")
+
 def main():
     """主程序入口"""
+    args = parse_args()
     try:
         print("\n" + "=" * 50)
         print("Efficode 高认知探索对话系统".center(50))
@@ -178,8 +235,11 @@ def main():
         print("\n正在使用默认API密钥...")
         api_key = "sk-dsayvcknhfsoftyaarputmhlbtdmltzwsmziktxahyhwrhup"
         
+        # 创建共享的API客户端（环境变量SILICONFLOW_API_KEYS可配置多个密钥/端点）
+        client = ApiClient.from_env(api_key)
+        
         # 测试API连接
-        connection_ok = test_api_connection(api_key)
+        connection_ok = test_api_connection(client)
         if not connection_ok:
             print("\n警告: API连接测试失败，但仍将继续执行程序。")
         
@@ -190,14 +250,19 @@ def main():
         print(f"- 提问者: {questioner_name}")
         print(f"- 回答者: {answerer_name}")
         
+        # 从已有的对话日志学习关键词权重（智能体工作进程沿用）
+        keyword_model = load_default_model()
+        if keyword_model:
+            print(f"\n已从 {keyword_model.documents} 条历史消息学习关键词权重")
+        
         # 创建智能体实例
         print(f"\n正在初始化智能体...")
-        questioner = AIAgent(questioner_name, api_key)
-        answerer = AIAgent(answerer_name, api_key)
+        questioner, answerer = create_agents((questioner_name, answerer_name), client, api_key)
         print(f"智能体初始化完成！")
         
         # 创建对话管理器
         dialogue_manager = DialogueManager(questioner, answerer)
+        dialogue_manager.profile = args.profile
         
         # 自动设置对话主题和轮数
         topic = "AI与人类的未来"
@@ -208,11 +273,14 @@ def main():
         print(f"开始高认知探索对话 | 主题: {topic} | 轮数: {rounds}")
         print(f"提问者: {questioner_name} | 回答者: {answerer_name}")
         print("=" * 50 + "\n")
-        dialogue_manager.run_auto_conversation(topic, rounds)
+        dialogue_manager.run_auto_conversation(topic, rounds, timeout=DIALOGUE_TIMEOUT, round_timeout=ROUND_TIMEOUT)
+        if dialogue_manager.profile_report:
+            print_profile_report(dialogue_manager.profile_report)
         
         print("\n对话已结束。对话历史已保存到logs目录。")
         
     except KeyboardInterrupt:
+        # 对话进行中被中断时，对话管理器已中止进行中的调用并保存已完成的部分
         print("\n\n程序已被用户中断。")
         sys.exit(0)
     except Exception as e:
@@ -0,0 +1,247 @@
+"""
+内存统计模块
+
+长时间运行的对话（ai_communication默认最多100轮）中，对话记录、智能体上下文、
+已处理数据包缓存中解压后的内容以及重复的日志字符串都会持续增长。这个模块提供:
+
+- MemoryMonitor: 基于tracemalloc每N轮做一次快照，按分配位置把增长的内存归到各子系统
+  （归类规则与profiling模块相同），超过设定上限时调用注册的压缩操作，并生成写入
+  对话元数据的报告；
+- SpilledHistory: 可以把较早的条目转存到磁盘的对话记录列表，遍历时按原顺序依次
+  读出转存的条目和内存中的条目。
+"""
+
+import os
+import json
+import time
+import logging
+import tracemalloc
+from collections import Counter
+from typing import Optional, Dict, Any, List, Callable, Iterator, Tuple
+
+from profiling import classify_stack, module_for_file
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Memory_Monitor')
+
+# 常量定义
+MEMORY_LIMIT_ENV = "EFFICODE_MEMORY_LIMIT_MB"  # 内存上限（MB），超过时压缩
+MEMORY_SNAPSHOT_ROUNDS = 10  # 每多少轮做一次快照
+TRACEBACK_FRAMES = 8  # tracemalloc为每次分配记录的栈帧数，用于按子系统归类
+HISTORY_KEEP_IN_MEMORY = 4  # 转存对话记录时内存中保留的最近条目数
+COMPACTION_HEADROOM = 0.1  # 压缩后仍超过上限时，内存再增长上限的这一比例才再次压缩
+_MB = 1024 * 1024
+
+def limit_from_env() -> Optional[float]:
+    """读取环境变量EFFICODE_MEMORY_LIMIT_MB，未设置或无效时返回None"""
+    value = os.getenv(MEMORY_LIMIT_ENV)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"{MEMORY_LIMIT_ENV} 不是有效的数字: {value}")
+        return None
+
+class SpilledHistory:
+    """
+    可转存到磁盘的对话记录
+
+    用法与列表相同（append、len、遍历）；spill()把较早的条目以JSONL追加到转存文件，
+    只在内存中保留最近的条目。close()删除转存文件（对话记录已完整保存后调用）。
+    """
+
+    def __init__(self, spill_path: str):
+        """
+        初始化对话记录
+
+        Args:
+            spill_path: 转存文件路径，首次转存时创建
+        """
+        self.spill_path = spill_path
+        self.entries: List[Dict[str, Any]] = []
+        self.spilled = 0  # 已转存的条目数
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.entries.append(entry)
+
+    def __len__(self) -> int:
+        return self.spilled + len(self.entries)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.spilled:
+            with open(self.spill_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    yield json.loads(line)
+        yield from list(self.entries)
+
+    def spill(self, keep: int = HISTORY_KEEP_IN_MEMORY) -> int:
+        """
+        把最近keep条以外的条目追加到转存文件
+
+        Returns:
+            本次转存的条目数
+        """
+        count = len(self.entries) - keep
+        if count <= 0:
+            return 0
+        directory = os.path.dirname(self.spill_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            for entry in self.entries[:count]:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        del self.entries[:count]
+        self.spilled += count
+        logger.info(f"已将 {count} 条对话记录转存至: {self.spill_path}")
+        return count
+
+    def close(self) -> None:
+        """删除转存文件"""
+        if self.spilled and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+class MemoryMonitor:
+    """
+    对话的内存统计
+
+    用法: start()后每轮结束调用observe(轮次)，结束时stop()，report()写入对话元数据。
+    已有其他代码在使用tracemalloc时沿用其设置，stop()时也不停止。
+    """
+
+    def __init__(self, every: int = MEMORY_SNAPSHOT_ROUNDS, limit_mb: Optional[float] = None,
+                 frames: int = TRACEBACK_FRAMES):
+        """
+        初始化内存统计
+
+        Args:
+            every: 每多少轮做一次快照，0表示不做快照（仍检查上限）
+            limit_mb: 内存上限（MB），tracemalloc统计的当前内存超过时压缩，None表示不压缩
+            frames: tracemalloc为每次分配记录的栈帧数
+        """
+        self.every = every
+        self.limit_mb = limit_mb
+        self.frames = frames
+        self.snapshots: List[Dict[str, Any]] = []
+        self.compactions: List[Dict[str, Any]] = []
+        self._compactors: List[Tuple[str, Callable[[], Any]]] = []
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._started_tracing = False
+        self._snapshot_seconds = 0.0
+        self._compact_above_mb = limit_mb  # 超过此值时压缩
+        self.peak_mb = 0.0
+
+    def add_compactor(self, name: str, compactor: Callable[[], Any]) -> None:
+        """
+        注册超过上限时调用的压缩操作，按注册顺序调用
+
+        Args:
+            name: 名称，用于报告
+            compactor: 压缩操作，返回值（例如转存的条目数）记入报告
+        """
+        self._compactors.append((name, compactor))
+
+    def start(self) -> None:
+        """开始统计（未在追踪时启动tracemalloc）并记录基线快照"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self._baseline = self._take_snapshot()
+
+    def stop(self) -> None:
+        """结束统计"""
+        if tracemalloc.is_tracing():
+            self.peak_mb = max(self.peak_mb, tracemalloc.get_traced_memory()[1] / _MB)
+            if self._started_tracing:
+                tracemalloc.stop()
+        self._started_tracing = False
+        self._baseline = None
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        started = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        self._snapshot_seconds += time.perf_counter() - started
+        return snapshot
+
+    def observe(self, round_number: int) -> None:
+        """
+        一轮结束：到快照间隔时做快照，超过上限时压缩
+
+        Args:
+            round_number: 已完成的轮数
+        """
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_mb = max(self.peak_mb, peak / _MB)
+        if self.every and round_number % self.every == 0:
+            self.snapshots.append(self._snapshot(round_number))
+        if self._compact_above_mb is not None and current / _MB > self._compact_above_mb:
+            self._compact(round_number, current)
+
+    def _snapshot(self, round_number: int) -> Dict[str, Any]:
+        """做一次快照，按子系统统计相对基线的增长"""
+        snapshot = self._take_snapshot()
+        growth: Counter = Counter()
+        blocks: Counter = Counter()
+        if self._baseline is not None:
+            for stat in snapshot.compare_to(self._baseline, 'traceback'):
+                stack = tuple((module_for_file(frame.filename), "") for frame in stat.traceback)
+                subsystem = classify_stack(stack)
+                growth[subsystem] += stat.size_diff
+                blocks[subsystem] += stat.count_diff
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "round": round_number,
+            "current_mb": round(current / _MB, 3),
+            "peak_mb": round(peak / _MB, 3),
+            "growth_mb": {name: round(size / _MB, 3) for name, size in growth.most_common()},
+            "growth_blocks": dict(blocks)
+        }
+        top = ", ".join(f"{name} {size / _MB:+.2f}MB" for name, size in growth.most_common(3))
+        logger.info(f"内存快照（第 {round_number} 轮）: 当前 {result['current_mb']}MB，"
+                    f"峰值 {result['peak_mb']}MB，增长最多: {top}")
+        return result
+
+    def _compact(self, round_number: int, before: int) -> None:
+        """调用注册的压缩操作并记录释放的内存"""
+        actions = {}
+        for name, compactor in self._compactors:
+            try:
+                actions[name] = compactor()
+            except Exception as e:
+                logger.error(f"内存压缩操作 {name} 出错: {str(e)}")
+                actions[name] = f"出错: {str(e)}"
+        after = tracemalloc.get_traced_memory()[0]
+        # 剩余的内存无法再压缩时，避免每轮都重复压缩
+        self._compact_above_mb = max(self.limit_mb, after / _MB + self.limit_mb * COMPACTION_HEADROOM)
+        self.compactions.append({
+            "round": round_number,
+            "before_mb": round(before / _MB, 3),
+            "after_mb": round(after / _MB, 3),
+            "actions": actions
+        })
+        logger.warning(f"内存 {before / _MB:.2f}MB 超过上限 {self.limit_mb}MB，已压缩至 {after / _MB:.2f}MB: {actions}")
+
+    def report(self) -> Dict[str, Any]:
+        """写入对话元数据的内存报告"""
+        if tracemalloc.is_tracing():
+            self.peak_mb = max(self.peak_mb, tracemalloc.get_traced_memory()[1] / _MB)
+        return {
+            "snapshot_every_rounds": self.every,
+            "limit_mb": self.limit_mb,
+            "peak_mb": round(self.peak_mb, 3),
+            "snapshot_seconds": round(self._snapshot_seconds, 3),  # 做快照本身花费的时间
+            "snapshots": self.snapshots,
+            "compactions": self.compactions
+        }
@@ -0,0 +1,177 @@
+"""
+模型路由模块
+
+这个模块根据角色的模型配置(profile)为每次调用选择模型：配置中列出多个
+候选模型时，按观测到的延迟（EWMA）和令牌用量选择代价最低的模型；每个
+候选模型先各试用几次以获得统计数据，之后偶尔再探索以跟上服务端的变化。
+"""
+
+import time
+import random
+import threading
+import logging
+from typing import Optional, Dict, Any, List, Tuple
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Model_Router')
+
+# 常量定义
+EWMA_ALPHA = 0.3  # 指数加权移动平均的新样本权重
+MIN_SAMPLES = 2  # 每个候选模型至少试用的次数
+EXPLORE_RATE = 0.05  # 统计充分后仍随机尝试其他候选的概率
+FAILURE_PENALTY = 1.0  # 失败调用按超时时间乘以此系数计入延迟
+MODEL_PRICES: Dict[str, float] = {}  # 模型 -> 每百万令牌价格，未列出的模型视为0（只按延迟选择）
+COST_WEIGHT = 1.0  # 价格（每次调用的预计花费）相对于延迟（秒）的权重
+
+class ModelStats:
+    """单个模型的调用统计"""
+
+    def __init__(self, profile: str, model: str):
+        self.profile = profile
+        self.model = model
+        self.calls = 0
+        self.failures = 0
+        self.latency: Optional[float] = None  # 每次调用耗时的EWMA（秒）
+        self.completion_tokens: Optional[float] = None  # 每次调用输出令牌数的EWMA
+        self.total_tokens: Optional[float] = None  # 每次调用总令牌数的EWMA
+        self.tokens_used = 0  # 累计令牌数
+        self.latency_total = 0.0  # 累计耗时（秒）
+
+    @staticmethod
+    def _ewma(current: Optional[float], sample: float) -> float:
+        return sample if current is None else EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * current
+
+    def record(self, latency: float, usage: Optional[Dict[str, Any]]) -> None:
+        """记录一次成功调用"""
+        self.calls += 1
+        self.latency = self._ewma(self.latency, latency)
+        self.latency_total += latency
+        if usage:
+            completion = float(usage.get("completion_tokens", 0))
+            total = float(usage.get("total_tokens", completion + usage.get("prompt_tokens", 0)))
+            self.completion_tokens = self._ewma(self.completion_tokens, completion)
+            self.total_tokens = self._ewma(self.total_tokens, total)
+            self.tokens_used += int(total)
+
+    def record_failure(self, penalty_latency: float) -> None:
+        """记录一次失败调用"""
+        self.calls += 1
+        self.failures += 1
+        self.latency = self._ewma(self.latency, penalty_latency)
+        self.latency_total += penalty_latency
+
+    def expected_cost(self) -> float:
+        """预计单次调用的代价：延迟（秒）加上按权重折算的花费"""
+        price = MODEL_PRICES.get(self.model, 0.0)
+        spend = (self.total_tokens or 0.0) * price / 1_000_000
+        return (self.latency or 0.0) + COST_WEIGHT * spend
+
+    def snapshot(self) -> Dict[str, Any]:
+        """获取统计数据"""
+        return {
+            "profile": self.profile,
+            "model": self.model,
+            "calls": self.calls,
+            "failures": self.failures,
+            "avg_latency": round(self.latency, 3) if self.latency is not None else None,
+            "avg_completion_tokens": round(self.completion_tokens, 1) if self.completion_tokens is not None else None,
+            "tokens_used": self.tokens_used,
+            "latency_total": round(self.latency_total, 3)
+        }
+
+class ModelRouter:
+    """
+    模型路由器
+
+    线程安全，可被多个智能体共享。统计数据按(配置名, 模型)汇总，同一模型在
+    短输出和长输出角色中的表现分开统计，互不干扰。
+    """
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        """
+        初始化模型路由器
+
+        Args:
+            rng: 随机数生成器（便于复现）
+        """
+        self._stats: Dict[Tuple[str, str], ModelStats] = {}
+        self._lock = threading.Lock()
+        self._rng = rng or random.Random()
+
+    def _get_stats(self, profile: str, model: str) -> ModelStats:
+        stats = self._stats.get((profile, model))
+        if stats is None:
+            stats = self._stats[(profile, model)] = ModelStats(profile, model)
+        return stats
+
+    def select(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        为一次调用选择模型
+
+        Args:
+            profile: 角色的模型配置，包含name、model、max_tokens、temperature、timeout，
+                     可选candidates（候选模型列表，按偏好顺序）
+
+        Returns:
+            本次调用的参数: profile、model、max_tokens、temperature、timeout
+        """
+        candidates: List[str] = profile.get("candidates") or [profile["model"]]
+        with self._lock:
+            stats = [self._get_stats(profile["name"], model) for model in candidates]
+            undersampled = [s for s in stats if s.calls < MIN_SAMPLES]
+            if undersampled:
+                # 先让每个候选模型积累足够的样本
+                chosen = min(undersampled, key=lambda s: s.calls)
+            elif len(stats) > 1 and self._rng.random() < EXPLORE_RATE:
+                chosen = self._rng.choice(stats)
+            else:
+                chosen = min(stats, key=lambda s: s.expected_cost())
+        return {
+            "profile": profile["name"],
+            "model": chosen.model,
+            "max_tokens": profile["max_tokens"],
+            "temperature": profile["temperature"],
+            "timeout": profile["timeout"]
+        }
+
+    def record(self, selection: Dict[str, Any], started: float, usage: Optional[Dict[str, Any]] = None) -> None:
+        """
+        记录一次成功调用
+
+        Args:
+            selection: select()的返回值
+            started: 调用开始时间(time.monotonic())
+            usage: API响应中的usage字段
+        """
+        with self._lock:
+            self._get_stats(selection["profile"], selection["model"]).record(time.monotonic() - started, usage)
+
+    def record_failure(self, selection: Dict[str, Any]) -> None:
+        """
+        记录一次失败调用（超时、连接错误或非200响应），按超时时间的倍数计入延迟
+
+        Args:
+            selection: select()的返回值
+        """
+        model = selection["model"]
+        with self._lock:
+            self._get_stats(selection["profile"], model).record_failure(selection["timeout"] * FAILURE_PENALTY)
+        logger.warning(f"模型 {model} 调用失败，已降低其路由优先级")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """获取所有模型的统计数据"""
+        with self._lock:
+            return [stats.snapshot() for stats in self._stats.values()]
+
+_default_router: Optional[ModelRouter] = None
+
+def get_default_router() -> ModelRouter:
+    """获取进程级共享的模型路由器"""
+    global _default_router
+    if _default_router is None:
+        _default_router = ModelRouter()
+    return _default_router
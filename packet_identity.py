@@ -0,0 +1,155 @@
+"""
+数据包标识模块
+
+这个模块为Efficode数据包提供单调递增、无冲突的ID（ULID风格）、
+对话内的序列号，以及用于重传去重的有界已见ID缓存。
+"""
+
+import os
+import time
+import threading
+import itertools
+import logging
+from collections import OrderedDict
+from typing import Any, Tuple, List
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Packet_Identity')
+
+# Crockford Base32字母表（ULID标准）
+_CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+DEFAULT_SEEN_CACHE_SIZE = 4096  # 已见ID缓存的默认容量
+
+def _encode_base32(value: int, length: int) -> str:
+    """将整数编码为定长Crockford Base32字符串"""
+    chars = []
+    for _ in range(length):
+        chars.append(_CROCKFORD_ALPHABET[value & 0x1F])
+        value >>= 5
+    return "".join(reversed(chars))
+
+class PacketIdGenerator:
+    """
+    ULID风格的数据包ID生成器
+
+    ID由48位毫秒时间戳和80位随机数组成，编码为26位字符串。同一毫秒内
+    随机部分递增，时钟回拨时沿用上一个时间戳，因此生成的ID严格单调递增，
+    且字典序与生成顺序一致。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._last_random = 0
+
+    def new_id(self) -> str:
+        """生成一个新的数据包ID"""
+        with self._lock:
+            now_ms = int(time.time() * 1000)
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._last_random = int.from_bytes(os.urandom(10), "big")
+            else:
+                # 同一毫秒或时钟回拨：递增随机部分保证单调
+                if self._last_random >= _RANDOM_MAX:
+                    self._last_ms += 1
+                    self._last_random = 0
+                else:
+                    self._last_random += 1
+            value = (self._last_ms << _RANDOM_BITS) | self._last_random
+        return _encode_base32(value, 26)
+
+_default_generator = PacketIdGenerator()
+
+def new_packet_id() -> str:
+    """使用进程级默认生成器生成数据包ID"""
+    return _default_generator.new_id()
+
+def packet_id_timestamp(packet_id: str) -> float:
+    """从数据包ID中解析出生成时间（秒）"""
+    value = 0
+    for char in packet_id[:10]:
+        value = (value << 5) | _CROCKFORD_ALPHABET.index(char)
+    return value / 1000.0
+
+class SequenceCounter:
+    """对话内的序列号计数器，线程安全，从1开始"""
+
+    def __init__(self, start: int = 1):
+        self._counter = itertools.count(start)
+        self._lock = threading.Lock()
+        self.last = start - 1
+
+    def next(self) -> int:
+        """获取下一个序列号"""
+        with self._lock:
+            self.last = next(self._counter)
+            return self.last
+
+class SeenPacketCache:
+    """
+    有界的已见数据包ID缓存
+
+    按LRU淘汰，查询和插入均为O(1)。可为每个ID附带一个值（例如对该数据包的
+    响应），使重传的数据包得到与首次相同的结果。
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_SEEN_CACHE_SIZE):
+        """
+        初始化缓存
+
+        Args:
+            maxsize: 最多保留的ID数量
+        """
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0  # 命中的重复数据包数
+
+    def __contains__(self, packet_id: str) -> bool:
+        with self._lock:
+            return packet_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, packet_id: str) -> Tuple[bool, Any]:
+        """
+        查询ID是否已见过
+
+        Returns:
+            (是否已见, 记录的值)
+        """
+        with self._lock:
+            if packet_id in self._entries:
+                self._entries.move_to_end(packet_id)
+                self.duplicates += 1
+                return True, self._entries[packet_id]
+            return False, None
+
+    def values(self) -> List[Any]:
+        """缓存中记录的值（快照），从最早到最近"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def add(self, packet_id: str, value: Any = None) -> bool:
+        """
+        记录一个ID
+
+        Returns:
+            如果ID此前未见过返回True，否则返回False
+        """
+        with self._lock:
+            seen = packet_id in self._entries
+            self._entries[packet_id] = value
+            self._entries.move_to_end(packet_id)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return not seen
@@ -0,0 +1,448 @@
+"""
+性能剖析模块
+
+对话变慢时不必再手工用cProfile包裹代码：为一次对话开启剖析后，结束时在对话记录
+旁边写出剖析结果，并把耗时归到各子系统（编解码、HTTP、提示词构建、日志、持久化等）。
+
+两种模式:
+- sample: 低开销的采样剖析。进程内一个后台线程按固定间隔抓取对话线程（以及对话中
+  起草问题等辅助线程）的调用栈，按墙钟时间统计，等待网络的时间同样计入。输出
+  折叠调用栈文件（.collapsed，可直接交给flamegraph.pl、speedscope等生成火焰图）
+  和前N名摘要（.profile.txt）。
+- cprofile: 确定性剖析，统计每个函数的调用次数和CPU上的耗时，开销较大。输出
+  pstats文件（.prof，可用snakeviz、flameprof等查看）和前N名摘要。
+
+子系统按调用栈从最内层向外第一个能归类的帧确定（cprofile模式没有完整调用栈，
+按函数自身所在的模块归类）。
+"""
+
+import os
+import re
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextvars
+import contextlib
+from collections import Counter
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Profiling')
+
+# 常量定义
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+PROFILE_MODES = (SAMPLE, CPROFILE)
+SAMPLE_INTERVAL = 0.005  # 采样间隔（秒）
+MAX_STACK_DEPTH = 128  # 每个样本最多记录的栈帧数（从最内层算起）
+TOP_N = 30  # 摘要中列出的函数数
+OTHER = "other"
+
+# 子系统归类规则，按顺序匹配: (子系统, 模块名（含子模块）, 函数名，None表示模块内所有函数)
+SUBSYSTEM_RULES: List[Tuple[str, Tuple[str, ...], Optional[Tuple[str, ...]]]] = [
+    ("persistence", ("dialogue_manager",), ("_save_conversation", "_save_conversation_to_spl")),
+    ("persistence", ("api_recording",), ("write", "_append")),
+    ("idle", ("cancellation",), ("sleep",)),  # 对话步骤之间的间隔
+    ("logging", ("logging",), None),
+    ("codec", ("efficode_core", "efficode_chunking", "efficode_workers", "zlib", "gzip", "bz2", "lzma",
+               "zstandard", "zstd", "brotli"), None),
+    ("http", ("api_client", "api_recording", "provider_pool", "requests", "urllib3", "http", "ssl",
+              "_ssl", "_socket", "charset_normalizer", "idna"), None),
+    ("transport", ("efficode_transport",), None),  # 与工作进程中的智能体通信
+    ("prompt", ("ai_agent", "model_router"), None),  # 构建提示词、选择模型和整理回复
+    ("scheduling", ("request_scheduler", "cancellation", "circuit_breaker", "auth_sessions"), None),
+    ("analysis", ("efficode_keywords", "convergence", "reasoning"), None),
+    ("dialogue", ("dialogue_manager", "ai_communication"), None),  # 对话流程本身（对话记录等）
+]
+
+# cProfile中C函数的名称，例如 <built-in method zlib.compress>、<method 'recv' of '_socket.socket' objects>
+_BUILTIN_MODULE = re.compile(r"<built-in method (\w+)\.|of '(\w+)\.")
+
+_active_profiler: contextvars.ContextVar[Optional['DialogueProfiler']] = contextvars.ContextVar(
+    "active_profiler", default=None)
+
+@lru_cache(maxsize=4096)
+def classify_frame(module: str, function: str) -> Optional[str]:
+    """
+    按SUBSYSTEM_RULES归类一个栈帧
+
+    Args:
+        module: 模块名
+        function: 函数名（可以是限定名称，例如 CancelToken.sleep）
+
+    Returns:
+        子系统名称，无法归类时返回None
+    """
+    name = function.rsplit(".", 1)[-1]
+    for subsystem, modules, functions in SUBSYSTEM_RULES:
+        if any(module == prefix or module.startswith(prefix + ".") for prefix in modules):
+            if functions is None or name in functions:
+                return subsystem
+    return None
+
+def classify_stack(stack: Tuple[Tuple[str, str], ...]) -> str:
+    """按从最内层向外第一个能归类的栈帧确定调用栈所属的子系统"""
+    for module, function in reversed(stack):
+        subsystem = classify_frame(module, function)
+        if subsystem:
+            return subsystem
+    return OTHER
+
+def _capture(frame: Any) -> Tuple[Tuple[str, str], ...]:
+    """抓取调用栈，返回由外到内的(模块, 函数)"""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((frame.f_globals.get("__name__", "?"), getattr(code, "co_qualname", code.co_name)))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+class StackSampler:
+    """
+    进程级的栈采样器
+
+    所有剖析器共用一个后台线程：按间隔抓取已登记线程的调用栈，分发给登记它们的剖析器。
+    没有登记的线程时后台线程退出，下次登记时重新启动。
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        """
+        初始化采样器
+
+        Args:
+            interval: 采样间隔（秒）
+        """
+        self.interval = interval
+        self._targets: Dict[int, List['DialogueProfiler']] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"ticks": 0, "cpu_seconds": 0.0}  # 采样次数、采样线程自身的CPU时间
+
+    def register(self, ident: int, profiler: 'DialogueProfiler') -> None:
+        """登记一个线程，其样本交给profiler"""
+        with self._lock:
+            self._targets.setdefault(ident, []).append(profiler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="efficode-profiler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, ident: int, profiler: 'DialogueProfiler') -> None:
+        """取消登记"""
+        with self._lock:
+            profilers = self._targets.get(ident, [])
+            if profiler in profilers:
+                profilers.remove(profiler)
+            if not profilers:
+                self._targets.pop(ident, None)
+
+    def _run(self) -> None:
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            cpu_started = time.thread_time()
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                targets = [(ident, list(profilers)) for ident, profilers in self._targets.items()]
+            now = time.monotonic()
+            weight, last = now - last, now  # 样本代表的墙钟时间
+            frames = sys._current_frames()
+            for ident, profilers in targets:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = _capture(frame)
+                for profiler in profilers:
+                    profiler._add_sample(ident, stack, weight)
+            del frames
+            self.stats["ticks"] += 1
+            self.stats["cpu_seconds"] += time.thread_time() - cpu_started
+
+class DialogueProfiler:
+    """
+    一次对话的剖析器
+
+    用法: with DialogueProfiler(mode): 运行对话；结束后write()写出结果。
+    进入时剖析当前线程，对话中的辅助线程用attach_thread()加入。
+    """
+
+    def __init__(self, mode: str = SAMPLE, sampler: Optional[StackSampler] = None, top_n: int = TOP_N):
+        """
+        初始化剖析器
+
+        Args:
+            mode: sample或cprofile
+            sampler: 采样器，默认使用进程级共享的采样器
+            top_n: 摘要中列出的函数数
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"不支持的剖析模式: {mode}，可选: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.sampler = sampler or get_default_sampler()
+        self.top_n = top_n
+        self.started: Optional[float] = None
+        self.elapsed = 0.0
+        self._threads: Dict[int, str] = {}  # 剖析过的线程: 标识 -> 名称
+        self._stacks: Counter = Counter()  # (线程名, 调用栈) -> 样本数
+        self._stack_seconds: Counter = Counter()  # (线程名, 调用栈) -> 样本代表的秒数
+        self._seconds: Counter = Counter()  # 子系统 -> 秒
+        self._classified: Dict[Tuple[Tuple[str, str], ...], str] = {}
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._context_token: Optional[contextvars.Token] = None
+        self._ident: Optional[int] = None
+        self._owner: Optional[Any] = None
+
+    def __enter__(self) -> 'DialogueProfiler':
+        self.started = time.monotonic()
+        self._context_token = _active_profiler.set(self)
+        self._ident = threading.get_ident()
+        self._owner = self._attach()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._detach(self._ident, self._owner)
+        _active_profiler.reset(self._context_token)
+        self.elapsed = time.monotonic() - self.started
+
+    def _attach(self) -> Any:
+        """开始剖析当前线程，返回_detach所需的句柄"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = threading.current_thread().name
+        if self.mode == SAMPLE:
+            self.sampler.register(ident, self)
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # 同一时刻只能有一个cProfile在运行时（Python 3.12起）只剖析最先开始的线程
+            logger.warning(f"无法在线程 {threading.current_thread().name} 中启用cProfile: {str(e)}")
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _detach(self, ident: int, handle: Any) -> None:
+        if self.mode == SAMPLE:
+            self.sampler.unregister(ident, self)
+        elif handle is not None:
+            handle.disable()
+
+    def _add_sample(self, ident: int, stack: Tuple[Tuple[str, str], ...], weight: float) -> None:
+        """采样线程调用：记录一个样本"""
+        with self._lock:
+            subsystem = self._classified.get(stack)
+            if subsystem is None:
+                subsystem = self._classified[stack] = classify_stack(stack)
+            key = (self._threads.get(ident, str(ident)), stack)
+            self._stacks[key] += 1
+            self._stack_seconds[key] += weight
+            self._seconds[subsystem] += weight
+
+    def subsystems(self) -> Dict[str, float]:
+        """各子系统的耗时（秒），从多到少"""
+        if self.mode == CPROFILE:
+            seconds: Counter = Counter()
+            stats = self._cprofile_stats().stats
+            memo: Dict[Tuple[str, int, str], Counter] = {}
+            for key, (_, _, own, _, _) in stats.items():
+                for name, share in _cprofile_shares(stats, key, memo).items():
+                    seconds[name] += own * share
+        else:
+            with self._lock:
+                seconds = Counter(self._seconds)
+        return {name: round(value, 3) for name, value in seconds.most_common()}
+
+    def _cprofile_stats(self) -> pstats.Stats:
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def write(self, base: str, title: str = "") -> Optional[Dict[str, Any]]:
+        """
+        写出剖析结果
+
+        Args:
+            base: 输出文件的路径前缀，例如对话记录去掉.json后的路径
+            title: 摘要的标题
+
+        Returns:
+            剖析报告: {"mode", "elapsed_seconds", "files", "subsystems", "top"}，没有数据时返回None
+        """
+        try:
+            if self.mode == CPROFILE:
+                if not self._profiles:
+                    return None
+                files = self._write_cprofile(base, title)
+            else:
+                with self._lock:
+                    if not self._stacks:
+                        return None
+                files = self._write_samples(base, title)
+        except Exception as e:
+            logger.error(f"写出剖析结果时出错: {str(e)}")
+            return None
+        subsystems = self.subsystems()
+        logger.info(f"剖析结果已保存至: {', '.join(files)}")
+        return {
+            "mode": self.mode,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "files": files,
+            "subsystems": subsystems,
+            "top": self._top_self()[:5]
+        }
+
+    def _top_self(self) -> List[Tuple[str, float]]:
+        """自身耗时最多的函数: [(函数, 秒)]"""
+        if self.mode == CPROFILE:
+            rows = [(_frame_label(*_cprofile_frame(filename, function)), own)
+                    for (filename, _, function), (_, _, own, _, _) in self._cprofile_stats().stats.items()]
+            rows.sort(key=lambda row: row[1], reverse=True)
+            return [(label, round(own, 4)) for label, own in rows[:self.top_n]]
+        own: Counter = Counter()
+        with self._lock:
+            stacks = list(self._stack_seconds.items())
+        for (_, stack), seconds in stacks:
+            own[_frame_label(*stack[-1])] += seconds
+        return [(label, round(seconds, 4)) for label, seconds in own.most_common(self.top_n)]
+
+    def _summary_header(self, title: str) -> List[str]:
+        mode = f"采样，间隔 {self.sampler.interval * 1000:.0f} 毫秒" if self.mode == SAMPLE else "cProfile"
+        lines = [f"{title or '对话'} 性能剖析（{mode}）",
+                 f"耗时 {self.elapsed:.3f} 秒，线程: {', '.join(sorted(set(self._threads.values())))}", "",
+                 "子系统耗时" + ("（墙钟时间，含等待）" if self.mode == SAMPLE else "（函数自身的耗时）") + ":"]
+        subsystems = self.subsystems()
+        total = sum(subsystems.values()) or 1.0
+        for name, seconds in subsystems.items():
+            lines.append(f"  {name:<12}{seconds:>10.3f} 秒{seconds / total:>8.1%}")
+        return lines
+
+    def _write_samples(self, base: str, title: str) -> List[str]:
+        with self._lock:
+            stacks = list(self._stacks.items())
+        collapsed = f"{base}.collapsed"
+        with open(collapsed, 'w', encoding='utf-8') as f:
+            for (thread, stack), count in sorted(stacks, key=lambda item: item[1], reverse=True):
+                frames = ";".join([thread] + [_frame_label(*frame) for frame in stack])
+                f.write(f"{frames} {count}\n")
+
+        total_samples = sum(count for _, count in stacks)
+        with self._lock:
+            weighted = list(self._stack_seconds.items())
+        total_seconds = sum(seconds for _, seconds in weighted) or 1.0
+        inclusive: Counter = Counter()
+        for (_, stack), seconds in weighted:
+            for label in set(_frame_label(*frame) for frame in stack):
+                inclusive[label] += seconds
+        lines = self._summary_header(title)
+        lines.insert(2, f"样本 {total_samples} 个；采样线程自身CPU {self.sampler.stats['cpu_seconds']:.3f} 秒"
+                        f"（进程内所有剖析累计）")
+        lines += ["", f"自身耗时最多的函数（前 {self.top_n}）:"]
+        lines += [f"  {seconds:>10.3f} 秒  {label}" for label, seconds in self._top_self()]
+        lines += ["", f"累计耗时最多的函数（前 {self.top_n}）:"]
+        lines += [f"  {seconds:>10.3f} 秒{seconds / total_seconds:>8.1%}  {label}"
+                  for label, seconds in inclusive.most_common(self.top_n)]
+        summary = f"{base}.profile.txt"
+        with open(summary, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        return [collapsed, summary]
+
+    def _write_cprofile(self, base: str, title: str) -> List[str]:
+        stats = self._cprofile_stats()
+        dump = f"{base}.prof"
+        stats.dump_stats(dump)
+        lines = self._summary_header(title)
+        lines += ["", f"自身耗时最多的函数（前 {self.top_n}）:"]
+        lines += [f"  {seconds:>10.3f} 秒  {label}" for label, seconds in self._top_self()]
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top_n]
+        lines += ["", f"累计耗时最多的函数（前 {self.top_n}）:"]
+        lines += [f"  {cumulative:>10.3f} 秒  {calls:>8} 次  {_frame_label(*_cprofile_frame(filename, function))}"
+                  for (filename, _, function), (_, calls, _, cumulative, _) in rows]
+        summary = f"{base}.profile.txt"
+        with open(summary, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        return [dump, summary]
+
+def _frame_label(module: str, function: str) -> str:
+    return f"{module}:{function}"
+
+def _cprofile_shares(stats: Dict[Tuple[str, int, str], Any], key: Tuple[str, int, str],
+                     memo: Dict[Tuple[str, int, str], Counter], depth: int = 0) -> Counter:
+    """
+    cProfile中函数自身耗时在各子系统间的分配比例：函数本身无法归类时（例如锁等待、json编码），
+    按各调用方的累计耗时把比例分给调用方所属的子系统，与采样模式从最内层向外归类的方式一致
+    """
+    if key in memo:
+        return memo[key]
+    memo[key] = Counter({OTHER: 1.0})  # 递归调用时的占位
+    filename, _, function = key
+    subsystem = classify_frame(*_cprofile_frame(filename, function))
+    callers = stats[key][4] if key in stats else {}
+    if subsystem or not callers or depth >= MAX_STACK_DEPTH:
+        shares = Counter({subsystem or OTHER: 1.0})
+    else:
+        weights = {caller: value[3] for caller, value in callers.items()}
+        total = sum(weights.values())
+        shares = Counter()
+        for caller, weight in weights.items():
+            fraction = weight / total if total > 0 else 1.0 / len(weights)
+            for name, share in _cprofile_shares(stats, caller, memo, depth + 1).items():
+                shares[name] += share * fraction
+    memo[key] = shares
+    return shares
+
+def _cprofile_frame(filename: str, function: str) -> Tuple[str, str]:
+    """把cProfile的(文件名, 函数名)转换为(模块, 函数)"""
+    if filename == "~":
+        match = _BUILTIN_MODULE.search(function)
+        return (match.group(1) or match.group(2) if match else "builtins"), function
+    return module_for_file(filename), function
+
+@lru_cache(maxsize=1024)
+def module_for_file(filename: str) -> str:
+    """源文件路径对应的模块名，找不到已加载的模块时用文件名"""
+    path = os.path.abspath(filename)
+    for name, module in list(sys.modules.items()):
+        if getattr(module, "__file__", None) and os.path.abspath(module.__file__) == path:
+            return name
+    return os.path.splitext(os.path.basename(filename))[0]
+
+@contextlib.contextmanager
+def attach_thread() -> Iterator[None]:
+    """当前上下文中有进行中的对话剖析时，把当前线程（例如起草问题的线程池线程）加入剖析"""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    handle = profiler._attach()
+    try:
+        yield
+    finally:
+        profiler._detach(ident, handle)
+
+_default_sampler: Optional[StackSampler] = None
+_default_sampler_lock = threading.Lock()
+
+def get_default_sampler() -> StackSampler:
+    """获取进程级共享的采样器"""
+    global _default_sampler
+    with _default_sampler_lock:
+        if _default_sampler is None:
+            _default_sampler = StackSampler()
+        return _default_sampler
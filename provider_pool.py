@@ -0,0 +1,328 @@
+"""
+API提供方池模块
+
+这个模块管理多个API密钥/端点组成的提供方池：每个成员有权重、熔断器和
+实时的限流额度，请求按最小负载或二选一(power of two choices)策略分配。
+错误率或慢调用比例过高的成员熔断器打开，暂停分配，打开时长到期后先放行
+探测请求，成功后恢复；所有成员都熔断时直接拒绝请求(CircuitOpenError)。
+"""
+
+import os
+import re
+import time
+import random
+import threading
+import logging
+from typing import Optional, Dict, Any, List, Iterable, Mapping, Callable
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Provider_Pool')
+
+# 常量定义
+DEFAULT_API_BASE = "https://api.siliconflow.cn/v1"  # SiliconFlow API地址
+API_KEYS_ENV = "SILICONFLOW_API_KEYS"  # 多个密钥，逗号分隔，格式: key[@api_base][*weight]
+API_KEY_ENV = "SILICONFLOW_API_KEY"  # 单个密钥
+STRATEGY_P2C = "p2c"  # 按权重随机抽取两个成员，选负载较低者
+STRATEGY_LEAST_LOADED = "least_loaded"  # 选负载最低的成员
+DEFAULT_RATE_LIMIT_SECONDS = 1.0  # 429响应未给出重置时间时的等待时长（秒）
+LOW_BUDGET_REQUESTS = 5  # 剩余请求额度低于此值时按比例提高负载估计
+
+_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    解析限流重置时间，支持秒数("2"、"0.5")和时长格式("1m30s"、"250ms")
+
+    Args:
+        value: 响应头中的值
+
+    Returns:
+        秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    """读取整数响应头"""
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+def mask_key(api_key: str) -> str:
+    """遮盖密钥，用于日志和统计输出"""
+    return f"{api_key[:5]}...{api_key[-4:]}" if len(api_key) > 12 else "***"
+
+class ProviderMember:
+    """提供方池中的一个成员（一个密钥+端点）"""
+
+    def __init__(self, api_key: str, api_base: str = DEFAULT_API_BASE, weight: float = 1.0,
+                 name: Optional[str] = None):
+        """
+        初始化成员
+
+        Args:
+            api_key: API密钥
+            api_base: API地址
+            weight: 权重，权重越高分得的请求越多
+            name: 成员名称，默认使用遮盖后的密钥
+        """
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.weight = max(weight, 0.01)
+        self.name = name or mask_key(api_key)
+        self.in_flight = 0  # 进行中的请求数
+        self.breaker = CircuitBreaker(self.name)
+        self.remaining_requests: Optional[int] = None  # 服务端报告的剩余请求额度
+        self.remaining_tokens: Optional[int] = None  # 服务端报告的剩余令牌额度
+        self.budget_reset_at = 0.0  # 额度耗尽时的恢复时间
+        self.stats = {"requests": 0, "failures": 0, "rate_limited": 0}
+
+    def is_circuit_open(self, now: float) -> bool:
+        """检查成员的熔断器是否拒绝请求（打开，或半开且探测名额已满）"""
+        return not self.breaker.available(now)
+
+    def is_rate_limited(self, now: float) -> bool:
+        """检查成员的限流额度是否已耗尽"""
+        return now < self.budget_reset_at
+
+    def is_available(self, now: float) -> bool:
+        """检查成员是否可以接收请求"""
+        return not self.is_circuit_open(now) and not self.is_rate_limited(now)
+
+    def load(self) -> float:
+        """估计成员的负载：进行中的请求数按权重归一，额度将尽时加重"""
+        load = (self.in_flight + 1) / self.weight
+        if self.remaining_requests is not None and self.remaining_requests < LOW_BUDGET_REQUESTS:
+            load *= LOW_BUDGET_REQUESTS / (self.remaining_requests + 1)
+        return load
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        """获取成员状态"""
+        now = time.monotonic() if now is None else now
+        return {
+            "name": self.name,
+            "api_base": self.api_base,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "healthy": not self.is_circuit_open(now),
+            "budget_exhausted": self.is_rate_limited(now),
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+            "circuit": self.breaker.snapshot(now),
+            **self.stats
+        }
+
+class ProviderPool:
+    """
+    API提供方池
+
+    线程安全。acquire()选出一个成员并计入进行中的请求，请求结束后须调用
+    release()报告结果，池据此更新健康状态和限流额度。
+    """
+
+    def __init__(self, members: Iterable[ProviderMember], strategy: str = STRATEGY_P2C,
+                 rng: Optional[random.Random] = None):
+        """
+        初始化提供方池
+
+        Args:
+            members: 成员列表
+            strategy: 选择策略，p2c或least_loaded
+            rng: 随机数生成器（便于复现）
+        """
+        self.members: List[ProviderMember] = list(members)
+        if not self.members:
+            raise ValueError("提供方池至少需要一个成员")
+        if strategy not in (STRATEGY_P2C, STRATEGY_LEAST_LOADED):
+            raise ValueError(f"不支持的选择策略: {strategy}")
+        self.strategy = strategy
+        self._rng = rng or random.Random()
+        # 熔断器的状态变化监听者可能在持有锁时被调用，允许其再次读取池的状态
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls, fallback_key: Optional[str] = None, strategy: str = STRATEGY_P2C) -> 'ProviderPool':
+        """
+        从环境变量创建提供方池
+
+        优先读取SILICONFLOW_API_KEYS（逗号分隔，每项格式为key[@api_base][*weight]），
+        其次SILICONFLOW_API_KEY，最后使用fallback_key。
+
+        Args:
+            fallback_key: 环境变量都未设置时使用的密钥
+            strategy: 选择策略
+
+        Returns:
+            提供方池
+        """
+        entries = os.getenv(API_KEYS_ENV, "")
+        members = [cls._parse_member(entry) for entry in entries.split(",") if entry.strip()]
+        if not members:
+            api_key = os.getenv(API_KEY_ENV) or fallback_key
+            if not api_key:
+                raise ValueError(f"未配置API密钥，请设置 {API_KEYS_ENV} 或 {API_KEY_ENV}")
+            members = [ProviderMember(api_key)]
+        logger.info(f"提供方池已创建，成员数: {len(members)}，策略: {strategy}")
+        return cls(members, strategy)
+
+    @classmethod
+    def single(cls, api_key: str, api_base: str = DEFAULT_API_BASE) -> 'ProviderPool':
+        """创建只有一个成员的提供方池"""
+        return cls([ProviderMember(api_key, api_base)])
+
+    @staticmethod
+    def _parse_member(entry: str) -> ProviderMember:
+        """解析key[@api_base][*weight]格式的成员配置"""
+        entry = entry.strip()
+        weight = 1.0
+        if "*" in entry:
+            entry, weight_str = entry.rsplit("*", 1)
+            weight = float(weight_str)
+        api_key, _, api_base = entry.partition("@")
+        return ProviderMember(api_key.strip(), api_base.strip() or DEFAULT_API_BASE, weight)
+
+    def add_listener(self, listener: Callable[[str, str, str, str], None]) -> None:
+        """注册所有成员熔断器状态变化的监听者，参数为(成员名称, 原状态, 新状态, 原因)"""
+        for member in self.members:
+            member.breaker.add_listener(listener)
+
+    def acquire(self, exclude: Iterable[ProviderMember] = ()) -> ProviderMember:
+        """
+        选择一个成员并计入进行中的请求
+
+        熔断器打开的成员不参与分配；其余成员的限流额度都已耗尽时，选择额度
+        最早恢复的成员。
+
+        Args:
+            exclude: 本次请求已尝试过的成员，尽量不再选择
+
+        Returns:
+            选中的成员
+
+        Raises:
+            CircuitOpenError: 候选成员的熔断器全部打开
+        """
+        excluded = set(map(id, exclude))
+        with self._lock:
+            now = time.monotonic()
+            candidates = [m for m in self.members if id(m) not in excluded] or self.members
+            reachable = [m for m in candidates if not m.is_circuit_open(now)]
+            if not reachable:
+                raise self._circuit_open_error(candidates, now)
+            available = [m for m in reachable if not m.is_rate_limited(now)]
+            if available:
+                member = self._choose(available)
+            else:
+                member = min(reachable, key=lambda m: m.budget_reset_at)
+                logger.warning(f"提供方池成员的限流额度均已耗尽，临时使用最早恢复的成员 {member.name}")
+            # 半开状态的成员占用一个探测名额
+            member.breaker.allow(now)
+            member.in_flight += 1
+            member.stats["requests"] += 1
+            return member
+
+    def check_circuits(self) -> None:
+        """所有成员的熔断器都拒绝请求时抛出CircuitOpenError，用于在排队等待之前快速失败"""
+        with self._lock:
+            now = time.monotonic()
+            if all(m.is_circuit_open(now) for m in self.members):
+                raise self._circuit_open_error(self.members, now)
+
+    @staticmethod
+    def _circuit_open_error(members: List[ProviderMember], now: float) -> CircuitOpenError:
+        for member in members:
+            member.breaker.count_rejected()
+        retry_after = min(m.breaker.retry_after(now) for m in members)
+        return CircuitOpenError(f"提供方池的熔断器全部打开，{retry_after:.1f} 秒后探测", retry_after)
+
+    def pin(self, member: ProviderMember) -> ProviderMember:
+        """不经选择直接使用指定成员（例如逐个检测成员），同样计入进行中的请求"""
+        with self._lock:
+            member.in_flight += 1
+            member.stats["requests"] += 1
+            return member
+
+    def _choose(self, available: List[ProviderMember]) -> ProviderMember:
+        """按策略从可用成员中选择"""
+        if len(available) == 1:
+            return available[0]
+        if self.strategy == STRATEGY_LEAST_LOADED:
+            return min(available, key=lambda m: m.load())
+        # 按权重不放回地抽取两个成员，选负载较低者
+        first = self._rng.choices(available, weights=[m.weight for m in available])[0]
+        rest = [m for m in available if m is not first]
+        second = self._rng.choices(rest, weights=[m.weight for m in rest])[0]
+        return first if first.load() <= second.load() else second
+
+    def release(self, member: ProviderMember, status_code: Optional[int] = None,
+                headers: Optional[Mapping[str, str]] = None, latency: Optional[float] = None,
+                record_health: bool = True) -> None:
+        """
+        报告请求结果
+
+        Args:
+            member: acquire()返回的成员
+            status_code: HTTP状态码，None表示连接失败或超时
+            headers: 响应头，用于更新限流额度
+            latency: 收到响应头（或失败）的耗时（秒），用于熔断器的慢调用统计
+            record_health: 为False时不计入熔断器统计（例如请求被调用方自己的截止时间中止）
+        """
+        with self._lock:
+            now = time.monotonic()
+            member.in_flight = max(0, member.in_flight - 1)
+            if headers is not None:
+                self._update_budget(member, headers, now)
+
+            failed = status_code is None or status_code >= 500 or status_code in (401, 403)
+            if status_code == 429:
+                member.stats["rate_limited"] += 1
+                retry_after = parse_reset_seconds((headers or {}).get("retry-after"))
+                member.budget_reset_at = max(member.budget_reset_at,
+                                             now + (retry_after or DEFAULT_RATE_LIMIT_SECONDS))
+                logger.warning(f"成员 {member.name} 被限流，{member.budget_reset_at - now:.1f} 秒后恢复")
+            elif failed:
+                member.stats["failures"] += 1
+
+        if not record_health:
+            member.breaker.discard()
+        else:
+            # 连接失败、服务端错误和密钥失效计入熔断器的错误率；限流说明端点可达，不计为失败
+            member.breaker.record(not failed, latency)
+
+    def _update_budget(self, member: ProviderMember, headers: Mapping[str, str], now: float) -> None:
+        """根据响应头更新成员的剩余限流额度"""
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            member.remaining_requests = remaining_requests
+        if remaining_tokens is not None:
+            member.remaining_tokens = remaining_tokens
+        if remaining_requests == 0 or remaining_tokens == 0:
+            reset = (parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+                     if remaining_requests == 0 else
+                     parse_reset_seconds(headers.get("x-ratelimit-reset-tokens")))
+            member.budget_reset_at = now + (reset or DEFAULT_RATE_LIMIT_SECONDS)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """获取所有成员的状态"""
+        with self._lock:
+            now = time.monotonic()
+            return [member.snapshot(now) for member in self.members]
@@ -0,0 +1,140 @@
+"""
+推理内容处理模块
+
+DeepSeek-R1系列模型在回答前输出很长的推理过程：有时以<think>...</think>内联在
+content中，有时放在单独的reasoning_content字段里。推理过程对接收方没有用处，
+却会在对端的提示词中占用令牌。这个模块把推理与回答分开：只有回答进入上下文和
+数据包，推理保存在旁路存储中以便查阅，并统计因此少转发的令牌数。
+"""
+
+import re
+import threading
+import logging
+from typing import Optional, Dict, Any, Tuple, Callable, List
+
+from packet_identity import SeenPacketCache
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Reasoning')
+
+# 常量定义
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+REASONING_STORE_SIZE = 256  # 每个智能体保留的推理记录数
+CHARS_PER_TOKEN = 4  # 非中日韩文字每个令牌的平均字符数（中日韩文字按每字一个令牌估算）
+
+_THINK_BLOCK_PATTERN = re.compile(r'<think>(.*?)(?:</think>|$)', re.DOTALL)
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+
+def split_reasoning(content: str, reasoning_content: Optional[str] = None) -> Tuple[str, str]:
+    """
+    把模型输出拆分为回答和推理
+
+    支持三种形式: reasoning_content字段、内联的<think>...</think>块（包括因max_tokens
+    截断而没有结束标签的块），以及聊天模板已预置开始标签、输出中只有</think>的情况。
+
+    Args:
+        content: 消息的content字段
+        reasoning_content: 消息的reasoning_content字段（如有）
+
+    Returns:
+        (回答, 推理)，没有推理时推理为空字符串
+    """
+    parts: List[str] = [reasoning_content.strip()] if reasoning_content else []
+    if THINK_CLOSE in content and THINK_OPEN not in content.split(THINK_CLOSE, 1)[0]:
+        # 只有结束标签：之前的全部内容都是推理
+        reasoning, content = content.split(THINK_CLOSE, 1)
+        parts.append(reasoning.strip())
+    if THINK_OPEN in content:
+        parts.extend(block.strip() for block in _THINK_BLOCK_PATTERN.findall(content))
+        content = _THINK_BLOCK_PATTERN.sub('', content)
+    return content.strip(), "\n\n".join(part for part in parts if part)
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的令牌数：中日韩文字每字一个令牌，其他字符每CHARS_PER_TOKEN个一个令牌"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def reasoning_token_count(usage: Optional[Dict[str, Any]], reasoning: str, answer: str) -> int:
+    """
+    推理部分的令牌数
+
+    优先使用API返回的completion_tokens_details.reasoning_tokens；否则按字符比例
+    分摊completion_tokens；都没有时按文本估算。
+    """
+    if not reasoning:
+        return 0
+    usage = usage or {}
+    details = usage.get("completion_tokens_details") or {}
+    if details.get("reasoning_tokens"):
+        return int(details["reasoning_tokens"])
+    completion = usage.get("completion_tokens")
+    if completion:
+        return round(completion * len(reasoning) / (len(reasoning) + len(answer)))
+    return estimate_tokens(reasoning)
+
+class ReasoningStore:
+    """推理内容的旁路存储，按数据包ID保存最近的推理记录，线程安全"""
+
+    def __init__(self, maxsize: int = REASONING_STORE_SIZE):
+        self._records = SeenPacketCache(maxsize)
+        self._lock = threading.Lock()
+
+    def add(self, packet_id: str, record: Dict[str, Any]) -> None:
+        """保存一条推理记录（reasoning、model、tokens）"""
+        with self._lock:
+            self._records.add(packet_id, record)
+
+    def get(self, packet_id: str) -> Optional[Dict[str, Any]]:
+        """获取某个数据包对应的推理记录"""
+        with self._lock:
+            _, record = self._records.lookup(packet_id)
+        return record
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+class ThinkStreamFilter:
+    """
+    流式回调的推理过滤器：丢弃内联<think>...</think>块中的文本，只把回答转发给回调
+
+    标签可能被拆分在两个数据块之间，疑似标签开头的结尾部分会暂存到下一个数据块。
+    """
+
+    def __init__(self, on_chunk: Callable[[str], None]):
+        self.on_chunk = on_chunk
+        self._buffer = ""
+        self._in_think = False
+
+    def __call__(self, text: str) -> None:
+        self._buffer += text
+        output: List[str] = []
+        while self._buffer:
+            tag = THINK_CLOSE if self._in_think else THINK_OPEN
+            index = self._buffer.find(tag)
+            if index >= 0:
+                if not self._in_think:
+                    output.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            # 保留可能是标签开头的结尾部分
+            keep = next((n for n in range(min(len(tag) - 1, len(self._buffer)), 0, -1)
+                         if tag.startswith(self._buffer[-n:])), 0)
+            if not self._in_think:
+                output.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+        text = "".join(output)
+        if text:
+            self.on_chunk(text)
+
+    def flush(self) -> None:
+        """流结束时转发暂存的文本"""
+        if self._buffer and not self._in_think:
+            self.on_chunk(self._buffer)
+        self._buffer = ""
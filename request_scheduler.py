@@ -0,0 +1,287 @@
+"""
+API请求调度模块
+
+多个对话共用同一个密钥时，后台的批量对话会让交互式对话的用户长时间等待。
+这个模块在HTTP层前面放一个中央调度器：
+
+- 优先级类别: interactive（交互式） > auto（自动对话） > batch（批量对话）；
+- 同一类别内按对话做加权公平排队（开始时间公平排队，SFQ），一个对话的连续
+  请求不会挤占同类别的其他对话；
+- 全局并发上限和每个类别的并发上限（默认按提供方池的成员数推算）；
+- 防饥饿: 排队每满AGING_SECONDS秒，请求的有效优先级提升一级；
+- 按类别统计排队延迟。
+
+请求的类别和所属对话通过request_context()设置在上下文变量中，调用链上的
+ApiClient.complete()自动读取，无需逐层传参。
+"""
+
+import os
+import time
+import math
+import heapq
+import threading
+import contextvars
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple, Iterator, Deque
+
+from cancellation import current_token, POLL_INTERVAL
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('Request_Scheduler')
+
+# 常量定义
+PRIORITY_CLASSES = ("interactive", "auto", "batch")  # 按优先级从高到低
+DEFAULT_PRIORITY = "auto"
+MAX_CONCURRENT_REQUESTS = 4  # 每个提供方成员同时进行的上游请求数
+MAX_CONCURRENT_ENV = "EFFICODE_MAX_CONCURRENT_REQUESTS"  # 全局并发上限，未设置时按成员数推算
+CLASS_CAPS = {"interactive": 4, "auto": 3, "batch": 2}  # 全局上限为MAX_CONCURRENT_REQUESTS时每个类别的上限，按比例缩放
+AGING_SECONDS = 10.0  # 排队每满此时间，有效优先级提升一级
+DELAY_SAMPLES = 512  # 每个类别保留的最近排队延迟样本数（用于分位数）
+MAX_TRACKED_FLOWS = 1024  # 公平排队跟踪的对话数超过此值时清理空闲对话
+
+_request_priority: contextvars.ContextVar = contextvars.ContextVar("request_priority", default=None)
+_request_flow: contextvars.ContextVar = contextvars.ContextVar("request_flow", default=None)
+
+@contextmanager
+def request_context(priority: Optional[str] = None, flow: Optional[str] = None) -> Iterator[None]:
+    """
+    设置此上下文中API请求的类别和所属对话
+
+    Args:
+        priority: 类别（interactive / auto / batch），None表示沿用外层设置
+        flow: 所属对话的标识，None表示沿用外层设置
+    """
+    if priority is not None and priority not in PRIORITY_CLASSES:
+        raise ValueError(f"未知的请求类别: {priority}")
+    tokens = []
+    if priority is not None:
+        tokens.append((_request_priority, _request_priority.set(priority)))
+    if flow is not None:
+        tokens.append((_request_flow, _request_flow.set(flow)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+def current_priority() -> Optional[str]:
+    """当前上下文的请求类别，未设置时为None"""
+    return _request_priority.get()
+
+class _Ticket:
+    """一个排队中的请求"""
+
+    def __init__(self, priority: str, flow: str, start_tag: float, sequence: int):
+        self.priority = priority
+        self.rank = PRIORITY_CLASSES.index(priority)
+        self.flow = flow
+        self.start_tag = start_tag
+        self.sequence = sequence
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+    def __lt__(self, other: '_Ticket') -> bool:
+        return (self.start_tag, self.sequence) < (other.start_tag, other.sequence)
+
+class _ClassStats:
+    """一个类别的排队统计"""
+
+    def __init__(self):
+        self.granted = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.recent: Deque[float] = deque(maxlen=DELAY_SAMPLES)
+
+    def record(self, delay: float) -> None:
+        self.granted += 1
+        self.total_delay += delay
+        self.max_delay = max(self.max_delay, delay)
+        self.recent.append(delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.recent)
+        def percentile(fraction: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3) if ordered else None
+        return {
+            "granted": self.granted,
+            "avg_delay": round(self.total_delay / self.granted, 3) if self.granted else None,
+            "p50_delay": percentile(0.5),
+            "p95_delay": percentile(0.95),
+            "max_delay": round(self.max_delay, 3)
+        }
+
+class RequestScheduler:
+    """
+    API请求调度器，线程安全
+
+    用法:
+        with scheduler.slot():
+            发送请求并读取完整响应
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+                 class_caps: Optional[Dict[str, int]] = None, aging_seconds: float = AGING_SECONDS):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrent: 同时进行的请求数上限
+            class_caps: 每个类别的并发上限（固定值），默认按max_concurrent缩放CLASS_CAPS
+            aging_seconds: 排队每满此时间，有效优先级提升一级
+        """
+        self._fixed_caps = dict(class_caps or {})
+        self.aging_seconds = aging_seconds
+        self._condition = threading.Condition()
+        self._queues: Dict[str, List[_Ticket]] = {name: [] for name in PRIORITY_CLASSES}
+        self._running: Dict[str, int] = {name: 0 for name in PRIORITY_CLASSES}
+        self._virtual_time: Dict[str, float] = {name: 0.0 for name in PRIORITY_CLASSES}
+        self._flow_finish: Dict[Tuple[str, str], float] = {}
+        self._flow_weights: Dict[str, float] = {}
+        self._sequence = 0
+        self._stats = {name: _ClassStats() for name in PRIORITY_CLASSES}
+        self.set_capacity(max_concurrent)
+
+    def set_capacity(self, max_concurrent: int) -> None:
+        """设置全局并发上限，未固定的类别上限按比例缩放，容量增加时立即放行排队的请求"""
+        with self._condition:
+            self.max_concurrent = max(1, max_concurrent)
+            scale = self.max_concurrent / MAX_CONCURRENT_REQUESTS
+            self.class_caps = {name: max(1, math.ceil(cap * scale)) for name, cap in CLASS_CAPS.items()}
+            self.class_caps.update(self._fixed_caps)
+            self._dispatch()
+
+    def ensure_capacity(self, max_concurrent: int) -> None:
+        """全局并发上限低于max_concurrent时提高到max_concurrent"""
+        with self._condition:
+            if max_concurrent > self.max_concurrent:
+                self.set_capacity(max_concurrent)
+
+    def set_weight(self, flow: str, weight: float) -> None:
+        """设置对话在公平排队中的权重（默认1，权重越大分到的份额越多）"""
+        with self._condition:
+            self._flow_weights[flow] = weight
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, flow: Optional[str] = None) -> Iterator[None]:
+        """
+        等待并占用一个请求槽位
+
+        Args:
+            priority: 类别，默认读取request_context()设置的类别，仍未设置时为auto
+            flow: 所属对话，默认读取request_context()设置的对话
+        """
+        ticket = self._acquire(priority or current_priority() or DEFAULT_PRIORITY,
+                               flow or _request_flow.get() or "default")
+        try:
+            yield
+        finally:
+            self._release(ticket)
+
+    def _acquire(self, priority: str, flow: str) -> _Ticket:
+        with self._condition:
+            # 开始时间公平排队: 开始标签取类别虚拟时间与该对话上一个请求结束标签的较大者
+            key = (priority, flow)
+            start = max(self._virtual_time[priority], self._flow_finish.get(key, 0.0))
+            self._flow_finish[key] = start + 1.0 / self._flow_weights.get(flow, 1.0)
+            if len(self._flow_finish) > MAX_TRACKED_FLOWS:
+                self._prune_flows()
+            self._sequence += 1
+            ticket = _Ticket(priority, flow, start, self._sequence)
+            heapq.heappush(self._queues[priority], ticket)
+            self._dispatch()
+            token = current_token()
+            try:
+                while not ticket.granted:
+                    if token is not None:
+                        token.check()
+                    self._condition.wait(POLL_INTERVAL if token is not None else None)
+            except BaseException:
+                # 等待被中断(取消、超时或KeyboardInterrupt): 撤回排队的请求或归还已分到的槽位
+                if ticket.granted:
+                    self._running[priority] -= 1
+                else:
+                    self._queues[priority].remove(ticket)
+                    heapq.heapify(self._queues[priority])
+                self._dispatch()
+                raise
+            return ticket
+
+    def _release(self, ticket: _Ticket) -> None:
+        with self._condition:
+            self._running[ticket.priority] -= 1
+            self._dispatch()
+
+    def _dispatch(self) -> None:
+        """在容量允许时按有效优先级放行排队的请求（调用方持有锁）"""
+        granted_any = False
+        while sum(self._running.values()) < self.max_concurrent:
+            now = time.monotonic()
+            best: Optional[_Ticket] = None
+            best_key: Optional[Tuple[int, float]] = None
+            for name in PRIORITY_CLASSES:
+                queue = self._queues[name]
+                if not queue or self._running[name] >= self.class_caps.get(name, self.max_concurrent):
+                    continue
+                head = queue[0]
+                # 防饥饿: 等待越久有效优先级越高，同级时先来先服务
+                effective = max(0, head.rank - int((now - head.enqueued) // self.aging_seconds))
+                key = (effective, head.enqueued)
+                if best_key is None or key < best_key:
+                    best, best_key = head, key
+            if best is None:
+                break
+            heapq.heappop(self._queues[best.priority])
+            self._virtual_time[best.priority] = best.start_tag
+            self._running[best.priority] += 1
+            self._stats[best.priority].record(now - best.enqueued)
+            best.granted = True
+            granted_any = True
+        if granted_any:
+            self._condition.notify_all()
+
+    def _prune_flows(self) -> None:
+        """移除已空闲的对话（结束标签不晚于类别虚拟时间）"""
+        self._flow_finish = {
+            key: finish for key, finish in self._flow_finish.items()
+            if finish > self._virtual_time[key[0]]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """按类别获取排队延迟（秒）、排队数和进行中的请求数"""
+        with self._condition:
+            return {
+                name: dict(self._stats[name].snapshot(),
+                           queued=len(self._queues[name]), running=self._running[name])
+                for name in PRIORITY_CLASSES
+            }
+
+_default_scheduler: Optional[RequestScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+def default_capacity(members: int = 1) -> int:
+    """全局并发上限：环境变量EFFICODE_MAX_CONCURRENT_REQUESTS，未设置时为成员数×MAX_CONCURRENT_REQUESTS"""
+    value = os.getenv(MAX_CONCURRENT_ENV)
+    if value:
+        return max(1, int(value))
+    return max(1, members) * MAX_CONCURRENT_REQUESTS
+
+def get_default_scheduler(members: Optional[int] = None) -> RequestScheduler:
+    """
+    获取进程级共享的请求调度器
+
+    Args:
+        members: 使用调度器的提供方池的成员数，指定时容量至少能容纳这些成员
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler(default_capacity(members or 1))
+        elif members is not None:
+            _default_scheduler.ensure_capacity(default_capacity(members))
+        return _default_scheduler
@@ -0,0 +1,77 @@
+"""
+熔断器状态机测试
+"""
+
+import unittest
+
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN, CONSECUTIVE_FAILURES, MIN_CALLS
+
+class CircuitBreakerTest(unittest.TestCase):
+    """关闭、打开、半开之间的状态转换"""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker("测试成员", base_open_seconds=10.0)
+        self.changes = []
+        self.breaker.add_listener(lambda name, previous, state, reason: self.changes.append((previous, state)))
+
+    def _trip(self):
+        for _ in range(CONSECUTIVE_FAILURES):
+            self.breaker.record(False)
+
+    def _after_open(self) -> float:
+        return self.breaker.open_until + 0.001
+
+    def test_consecutive_failures_open(self):
+        for _ in range(CONSECUTIVE_FAILURES - 1):
+            self.breaker.record(False)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.stats["rejected"], 1)
+        self.assertEqual(self.changes, [(CLOSED, OPEN)])
+
+    def test_error_rate_opens(self):
+        for success in [True, False] * MIN_CALLS:
+            self.breaker.record(success)
+            if self.breaker.state == OPEN:
+                break
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_slow_calls_open(self):
+        for _ in range(MIN_CALLS):
+            self.breaker.record(True, latency=self.breaker.slow_call_seconds)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open_allows_single_probe(self):
+        self._trip()
+        now = self._after_open()
+        self.assertTrue(self.breaker.allow(now))
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow(now))
+
+    def test_probe_success_closes(self):
+        self._trip()
+        self.assertTrue(self.breaker.allow(self._after_open()))
+        self.breaker.record(True, latency=0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertEqual(self.changes, [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_probe_failure_reopens_with_backoff(self):
+        self._trip()
+        self.assertAlmostEqual(self.breaker.retry_after(), 10.0, delta=1.0)
+        self.assertTrue(self.breaker.allow(self._after_open()))
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertAlmostEqual(self.breaker.retry_after(), 20.0, delta=1.0)
+
+    def test_discard_returns_probe(self):
+        self._trip()
+        now = self._after_open()
+        self.assertTrue(self.breaker.allow(now))
+        self.breaker.discard()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow(now))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""
+分片传输测试：乱序重组、校验和、流式交出和内存上限
+"""
+
+import random
+import unittest
+
+from efficode_core import EfficodePacket
+from efficode_chunking import ReassemblyBuffer, split_data_packet, is_chunk_packet
+
+LONG_TEXT = "".join(f"第{i}段：分片传输需要容忍乱序到达和重复分片。\n" for i in range(3000))
+
+def make_chunks(text: str = LONG_TEXT, chunk_size: int = 1024):
+    """生成一条消息的分片"""
+    return split_data_packet(EfficodePacket("DATA", {"content": text, "type": "text"}, "智谋"), chunk_size=chunk_size)
+
+class ReassemblyTest(unittest.TestCase):
+    """分片的拆分与重组"""
+
+    def test_in_order(self):
+        chunks = make_chunks()
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(is_chunk_packet(chunk) for chunk in chunks))
+        buffer = ReassemblyBuffer()
+        results = [buffer.add(chunk) for chunk in chunks]
+        self.assertTrue(all(result is None for result in results[:-1]))
+        self.assertEqual(results[-1].params["content"], LONG_TEXT)
+        self.assertEqual(results[-1].packet_id, chunks[0].params["msg_id"])
+
+    def test_out_of_order_with_duplicates(self):
+        chunks = make_chunks()
+        shuffled = chunks + chunks[:3]
+        random.Random(7).shuffle(shuffled)
+        buffer = ReassemblyBuffer()
+        completed = [result for result in map(buffer.add, shuffled) if result is not None]
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(completed[0].params["content"], LONG_TEXT)
+        self.assertEqual(buffer.pending_ids(), [])
+        self.assertEqual(buffer.buffered_bytes, 0)
+
+    def test_checksum_mismatch_dropped(self):
+        chunks = make_chunks()
+        chunks[0].params["checksum"] = "00000000"
+        buffer = ReassemblyBuffer()
+        self.assertIsNone(buffer.add(chunks[0]))
+        self.assertEqual(buffer.stats["checksum_errors"], 1)
+        self.assertEqual(buffer.pending_ids(), [])
+
+class StreamingTest(unittest.TestCase):
+    """设置on_text时的流式交出"""
+
+    def test_streamed_text_not_retained(self):
+        received = []
+        buffer = ReassemblyBuffer(max_bytes=4096, on_text=lambda msg_id, text: received.append(text))
+        results = [buffer.add(chunk) for chunk in make_chunks()]
+        packet = results[-1]
+        self.assertEqual("".join(received), LONG_TEXT)
+        self.assertEqual(packet.params["content"], "")
+        self.assertTrue(packet.params["streamed"])
+        self.assertEqual(packet.params["length"], len(LONG_TEXT))
+        self.assertEqual(buffer.stats["evicted"], 0)
+
+    def test_keep_text_with_callback(self):
+        received = []
+        buffer = ReassemblyBuffer(on_text=lambda msg_id, text: received.append(text), keep_text=True)
+        packet = [buffer.add(chunk) for chunk in make_chunks()][-1]
+        self.assertEqual(packet.params["content"], LONG_TEXT)
+        self.assertEqual("".join(received), LONG_TEXT)
+
+class LimitTest(unittest.TestCase):
+    """超时和内存上限"""
+
+    def test_evicts_oldest_message_over_limit(self):
+        first, second = make_chunks(), make_chunks()
+        buffer = ReassemblyBuffer(max_bytes=2048)
+        # 只送入乱序分片，使其暂存在缓冲区
+        buffer.add(first[-1])
+        buffer.add(second[-1])
+        for chunk in second[1:-1]:
+            buffer.add(chunk)
+        self.assertGreater(buffer.stats["evicted"], 0)
+        self.assertNotIn(first[0].params["msg_id"], buffer.pending_ids())
+        # 已丢弃消息的后续分片被忽略
+        self.assertIsNone(buffer.add(first[0]))
+        self.assertNotIn(first[0].params["msg_id"], buffer.pending_ids())
+
+    def test_expire(self):
+        chunks = make_chunks()
+        buffer = ReassemblyBuffer(timeout=-1.0)
+        buffer.add(chunks[-1])
+        expired = buffer.expire()
+        self.assertEqual(expired, [chunks[0].params["msg_id"]])
+        self.assertEqual(buffer.buffered_bytes, 0)
+
+if __name__ == "__main__":
+    unittest.main()
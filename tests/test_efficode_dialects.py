@@ -0,0 +1,146 @@
+"""
+Efficode两种线格式的一致性测试
+
+旧版格式（原ai_communication中的数据包类）: DID/ACK/ERROR为 <前缀><操作码>:<JSON参数>，
+压缩内容带 _compressed/_original_type 标记（zlib）；标准格式为 ?k=v&k=v，压缩标记为
+compressed=<方法>。两种格式都应被efficode_core.EfficodePacket.from_string解出相同的内容。
+"""
+
+import json
+import gzip
+import zlib
+import base64
+import unittest
+from typing import Dict, Any
+
+from efficode_core import EfficodePacket, LEGACY_COMPRESSED_KEY, LEGACY_ORIGINAL_TYPE_KEY
+
+LONG_TEXT = "智能体之间的高效通信协议需要兼顾压缩率和可读性。" * 40
+LONG_JSON = {"topic": "AI与人类的未来", "rounds": 3, "notes": ["压缩"] * 200}
+
+def legacy_to_string(op_code: str, params: Dict[str, Any]) -> str:
+    """按旧版数据包类的规则编码"""
+    prefix = {"DID": "@", "REQ": "#", "DATA": "#", "ACK": "!", "ERROR": "!"}[op_code]
+    if not params:
+        return f"{prefix}{op_code}"
+    if op_code in ("DID", "ACK", "ERROR"):
+        return f"{prefix}{op_code}:{json.dumps(params, ensure_ascii=False)}"
+    parts = [f"{k}={json.dumps(v, ensure_ascii=False)}" if isinstance(v, dict) else f"{k}={v}"
+             for k, v in params.items()]
+    return f"{prefix}{op_code}?{'&'.join(parts)}"
+
+def legacy_compressed_params(content: Any) -> Dict[str, Any]:
+    """按旧版数据包类的规则压缩content"""
+    text = json.dumps(content, ensure_ascii=False) if isinstance(content, dict) else content
+    return {
+        "content": base64.b64encode(zlib.compress(text.encode('utf-8'))).decode('ascii'),
+        "type": "text",
+        LEGACY_COMPRESSED_KEY: True,
+        LEGACY_ORIGINAL_TYPE_KEY: "json" if isinstance(content, dict) else "text"
+    }
+
+class LegacyDialectTest(unittest.TestCase):
+    """旧版格式的解码"""
+
+    def test_json_body_packets(self):
+        did = EfficodePacket.from_string('@DID:{"value": "did:efficode:abc", "name": "智谋"}', "慧眼")
+        self.assertEqual(did.op_code, "DID")
+        self.assertEqual(did.params, {"value": "did:efficode:abc", "name": "智谋"})
+
+        ack = EfficodePacket.from_string('!ACK:{"status": "ok", "message": "收到"}', "慧眼")
+        self.assertEqual(ack.op_code, "ACK")
+        self.assertEqual(ack.params["message"], "收到")
+
+        error = EfficodePacket.from_string('!ERROR:{"message": "超时"}', "慧眼")
+        self.assertTrue(error.is_error())
+        self.assertEqual(error.params["message"], "超时")
+
+    def test_invalid_json_body_kept_as_value(self):
+        packet = EfficodePacket.from_string("!ERROR:not json", "慧眼")
+        self.assertEqual(packet.op_code, "ERROR")
+        self.assertEqual(packet.params, {"value": "not json"})
+
+    def test_compressed_text(self):
+        packet = EfficodePacket.from_string(legacy_to_string("DATA", legacy_compressed_params(LONG_TEXT)), "智谋")
+        self.assertFalse(packet.is_compressed())
+        self.assertEqual(packet.params["content"], LONG_TEXT)
+        self.assertNotIn(LEGACY_COMPRESSED_KEY, packet.params)
+        self.assertNotIn(LEGACY_ORIGINAL_TYPE_KEY, packet.params)
+
+    def test_compressed_json(self):
+        packet = EfficodePacket.from_string(legacy_to_string("DATA", legacy_compressed_params(LONG_JSON)), "智谋")
+        self.assertEqual(packet.params["content"], LONG_JSON)
+
+    def test_uncompressed_query_params(self):
+        packet = EfficodePacket.from_string(
+            legacy_to_string("REQ", {"type": "analysis", "topic": "AI", "options": {"depth": 2}}), "智谋")
+        self.assertEqual(packet.op_code, "REQ")
+        self.assertEqual(packet.params, {"type": "analysis", "topic": "AI", "options": {"depth": 2}})
+
+class StandardDialectTest(unittest.TestCase):
+    """标准格式的解码"""
+
+    def test_query_params(self):
+        packet = EfficodePacket.from_string("#REQ?type=knowledge&query=熵", "智谋")
+        self.assertEqual(packet.op_code, "REQ")
+        self.assertEqual(packet.params, {"type": "knowledge", "query": "熵"})
+
+    def test_did_query_form(self):
+        packet = EfficodePacket.from_string("@DID?value=did:efficode:abc", "智谋")
+        self.assertEqual(packet.op_code, "DID")
+        self.assertEqual(packet.params, {"value": "did:efficode:abc"})
+
+    def test_compressed_content(self):
+        encoders = {
+            "zlib": zlib.compress,
+            "gzip": lambda data: gzip.compress(data, mtime=0),
+        }
+        for method, compress in encoders.items():
+            with self.subTest(method=method):
+                encoded = base64.b64encode(compress(LONG_TEXT.encode('utf-8'))).decode('ascii')
+                wire = f"#DATA?content={encoded}&type=text&compressed={method}&original_type=text"
+                packet = EfficodePacket.from_string(wire, "智谋")
+                self.assertFalse(packet.is_compressed())
+                self.assertEqual(packet.params["content"], LONG_TEXT)
+                self.assertEqual(packet.params["type"], "text")
+
+    def test_metadata_identity_preserved(self):
+        sent = EfficodePacket("DATA", {"content": "你好", "type": "text"}, "智谋").add_metadata(seq=7)
+        packet = EfficodePacket.from_string(sent.to_string(), "智谋")
+        self.assertEqual(packet.packet_id, sent.packet_id)
+        self.assertEqual(packet.seq, 7)
+
+class CrossDialectRoundTripTest(unittest.TestCase):
+    """旧版数据包解码后用标准格式重新编码，内容应保持不变"""
+
+    def _round_trip(self, packet: EfficodePacket) -> EfficodePacket:
+        return EfficodePacket.from_string(packet.to_string(), packet.sender)
+
+    def test_uncompressed(self):
+        legacy = EfficodePacket.from_string(legacy_to_string("DATA", {"content": "短消息", "type": "text"}), "智谋")
+        again = self._round_trip(legacy)
+        self.assertEqual(again.params, legacy.params)
+
+    def test_compressed_text(self):
+        legacy = EfficodePacket.from_string(legacy_to_string("DATA", legacy_compressed_params(LONG_TEXT)), "智谋")
+        recompressed = EfficodePacket(legacy.op_code, dict(legacy.params), legacy.sender).compress_content()
+        self.assertIn(recompressed.params["compressed"], ("zlib", "gzip", "zstd", "brotli"))
+        again = self._round_trip(recompressed)
+        self.assertEqual(again.params["content"], LONG_TEXT)
+        self.assertEqual(again.params["type"], "text")
+        self.assertFalse(again.is_compressed())
+
+    def test_legacy_json_body_reencoded(self):
+        legacy = EfficodePacket.from_string('!ACK:{"status": "ok", "message": "收到"}', "慧眼")
+        again = self._round_trip(legacy)
+        self.assertEqual(again.op_code, "ACK")
+        self.assertEqual(again.params, legacy.params)
+
+    def test_standard_packet_survives_two_hops(self):
+        packet = EfficodePacket("DATA", {"content": LONG_TEXT, "type": "text"}, "智谋").compress_content()
+        first = self._round_trip(packet)
+        second = self._round_trip(EfficodePacket(first.op_code, dict(first.params), first.sender).compress_content())
+        self.assertEqual(second.params["content"], LONG_TEXT)
+
+if __name__ == "__main__":
+    unittest.main()
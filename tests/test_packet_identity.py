@@ -0,0 +1,72 @@
+"""
+数据包标识测试：ULID单调性、序列号和已见ID缓存
+"""
+
+import unittest
+from unittest import mock
+
+from packet_identity import (
+    PacketIdGenerator,
+    SequenceCounter,
+    SeenPacketCache,
+    packet_id_timestamp
+)
+
+class PacketIdGeneratorTest(unittest.TestCase):
+    """ULID风格ID的生成"""
+
+    def test_ids_strictly_increasing_within_same_millisecond(self):
+        generator = PacketIdGenerator()
+        with mock.patch("packet_identity.time.time", return_value=1700000000.0):
+            ids = [generator.new_id() for _ in range(1000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(packet_id) == 26 for packet_id in ids))
+
+    def test_clock_going_backwards_stays_monotonic(self):
+        generator = PacketIdGenerator()
+        with mock.patch("packet_identity.time.time", return_value=1700000001.0):
+            first = generator.new_id()
+        with mock.patch("packet_identity.time.time", return_value=1700000000.0):
+            second = generator.new_id()
+        self.assertLess(first, second)
+        self.assertEqual(packet_id_timestamp(second), 1700000001.0)
+
+    def test_timestamp_round_trip(self):
+        generator = PacketIdGenerator()
+        with mock.patch("packet_identity.time.time", return_value=1700000000.123):
+            packet_id = generator.new_id()
+        self.assertAlmostEqual(packet_id_timestamp(packet_id), 1700000000.123, places=3)
+
+class SequenceCounterTest(unittest.TestCase):
+    """对话内序列号"""
+
+    def test_starts_at_one(self):
+        counter = SequenceCounter()
+        self.assertEqual([counter.next() for _ in range(3)], [1, 2, 3])
+        self.assertEqual(counter.last, 3)
+
+class SeenPacketCacheTest(unittest.TestCase):
+    """已见ID缓存的去重和LRU淘汰"""
+
+    def test_duplicate_returns_recorded_value(self):
+        cache = SeenPacketCache()
+        self.assertTrue(cache.add("a", "响应"))
+        self.assertFalse(cache.add("a", "响应"))
+        self.assertEqual(cache.lookup("a"), (True, "响应"))
+        self.assertEqual(cache.lookup("b"), (False, None))
+        self.assertEqual(cache.duplicates, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = SeenPacketCache(maxsize=2)
+        cache.add("a")
+        cache.add("b")
+        cache.lookup("a")  # a变为最近使用
+        cache.add("c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(len(cache), 2)
+
+if __name__ == "__main__":
+    unittest.main()